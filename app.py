@@ -1,5 +1,7 @@
 # streamlit_app.py
-import face_recognition
+import hashlib
+import shutil
+import tempfile
 import streamlit as st
 import cv2
 import numpy as np
@@ -7,46 +9,107 @@ import os
 
 from PIL import Image
 
-from face_recognition_utils import *
+# Only what the page uses; the dlib models load on the first recognition (models.py), not at page start.
+from face_recognition_utils import (
+    capture_face_data,
+    capture_face_data_from_folder,
+    check_face_in_video,
+    iter_face_video,
+    recognize_face_in_image_stream,
+    video_executor,
+)
+import metrics
+import models
+from detectors import BACKENDS, default_config, detector_config
+from frame_gate import GATE_ENABLED, make_gate
+from gallery import Gallery
+from gallery_store import face_dir_signature
+from rendering import draw_faces
+from tracking import DETECT_EVERY, REVERIFY_EVERY, FaceTracker
 
 FACE_DIR = "./faces"
 if not os.path.exists(FACE_DIR):
     os.makedirs(FACE_DIR)
 
-def recognize_face_video():
-    st.title("Real-time Face Recognition")
-    known_faces = load_known_faces()
-    frame_window = st.image([])
+# Annotated results kept across reruns, keyed by upload hash and gallery version.
+RESULT_CACHE_ENTRIES = 32
+# Uploads are copied to disk in chunks of this size; decoding then reads frames incrementally.
+SPOOL_CHUNK = 8 * 1024 * 1024
+
 
-    cap = cv2.VideoCapture(0)
+@st.cache_resource(show_spinner="Loading face models...")
+def load_models():
+    models.warm()
+    return models.face_recognition_module()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            st.error("Failed to capture frame")
-            break
 
-        face_locations = face_recognition.face_locations(frame)
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
+@st.cache_resource(show_spinner="Starting video workers...")
+def load_video_executor():
+    # Kept across reruns so every video check reuses the warm encoder processes.
+    return video_executor()
 
-        for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-            label = "Unknown"
-            for name, known_face_encodings in known_faces.items():
-                matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                if True in matches:
-                    label = name
-                    break
 
-            cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+@st.cache_resource(max_entries=1, show_spinner="Loading known faces...")
+def load_gallery(faces_version):
+    # A new ./faces version is a new cache key; max_entries=1 drops the stale gallery.
+    gallery = Gallery(FACE_DIR)
+    gallery.load()
+    return gallery
 
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = Image.fromarray(frame)
-        frame_window.image(frame)
 
+def spool_upload(uploaded_file):
+    # cv2.VideoCapture needs a path; copy the upload to a temporary file without another full in-memory copy.
+    suffix = os.path.splitext(uploaded_file.name)[1] or ".mp4"
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+        shutil.copyfileobj(uploaded_file, spool, SPOOL_CHUNK)
+    return spool.name
 
 
-    cap.release()
+def show_scan_progress(progress_bar, status_line, match_line):
+    def on_progress(progress):
+        done = progress.frames_processed + progress.frames_skipped
+        if progress.total_frames:
+            progress_bar.progress(min(1.0, done / progress.total_frames))
+        fps = done / max(progress.seconds, 1e-9)
+        total = f"/{progress.total_frames}" if progress.total_frames else ""
+        status_line.caption(f"{done}{total} frames in {progress.seconds:.1f}s ({fps:.1f} frames/s), "
+                            f"{progress.frames_skipped} skipped by the frame gate, {progress.faces_seen} faces seen")
+        if progress.match is not None:
+            match_line.info(f"Match: {progress.match.name} in frame {progress.match.frame_number} "
+                            f"at {progress.match.timestamp:.2f}s")
+
+    return on_progress
+
+
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner="Recognizing faces...")
+def recognize_upload(upload_hash, faces_version, detector, _content):
+    # _content is not hashed by Streamlit; upload_hash stands in for it.
+    load_models()
+    image_array = np.frombuffer(_content, dtype=np.uint8)
+    return recognize_face_in_image_stream(image_array, gallery=load_gallery(faces_version), detector=detector)
+
+
+def recognize_face_video(tracking=True, detect_every=DETECT_EVERY, gate=GATE_ENABLED, detector=None):
+    st.title("Real-time Face Recognition")
+    if not tracking:
+        detect_every = 1
+    load_models()
+    gallery = load_gallery(face_dir_signature(FACE_DIR))
+    frame_gate = make_gate(gate)
+    tracker = FaceTracker(gallery, detect_every, REVERIFY_EVERY if tracking else 1, gate=frame_gate,
+                          detector=detector)
+    frame_window = st.image([])
+    stats_line = st.empty()
+
+    # The Streamlit page is the rendering sink for the headless frame generator.
+    for video_frame in iter_face_video(0, tracker, gate=frame_gate):
+        annotated = draw_faces(video_frame.frame, video_frame.faces)
+        with metrics.stage("color_convert"):
+            frame = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
+        frame_window.image(Image.fromarray(frame))
+        stats_line.caption(f"{tracker.fps:.1f} FPS, detection on {tracker.duty_cycle:.0%} of frames")
+    st.error("Failed to capture frame")
 
 
 
@@ -57,28 +120,50 @@ option = st.sidebar.selectbox(
     ('Capture Face Data', 'Recognize Face in Real-time Video', 'Recognize Face in Image', 'Capture Face Data from Folder', 'Check Face in Video')
 )
 
+# Defaults to HELOS_DETECTOR or the backend `python detectors.py calibrate` picked for this machine.
+with st.sidebar.expander("Face detector"):
+    default_detector = default_config()
+    detector = detector_config(
+        st.selectbox("Backend", BACKENDS, index=BACKENDS.index(default_detector.backend)),
+        st.number_input("Upsample (hog and cnn)", min_value=0, max_value=3, value=default_detector.upsample),
+        st.number_input("Encoding jitters", min_value=1, max_value=100, value=default_detector.num_jitters),
+    )
+
+# Enabled with HELOS_METRICS=1 (and HELOS_METRICS_FILE for an exported file) when starting streamlit.
+if metrics.enabled():
+    with st.sidebar.expander("Stage timings"):
+        rows = metrics.stage_summary()
+        st.table([{"stage": name, "calls": calls, "total s": round(seconds, 3), "mean ms": round(mean_ms, 2)}
+                  for name, calls, seconds, mean_ms in rows])
+        if st.button("Export metrics"):
+            metrics.export()
+
 if option == 'Capture Face Data':
     st.header('Capture Face Data')
     name = st.text_input("Enter the name of the person:")
     if st.button('Start Capturing'):
         # Call your capture_face_data function
-        capture_face_data(name)
+        capture_face_data(name, detector=detector)
 
 elif option == 'Recognize Face in Real-time Video':
     st.header('Recognize and Tag Faces in Real-time Video')
+    tracking = st.checkbox("Track faces between detections", value=True)
+    detect_every = st.slider("Detect every N frames", 1, 30, DETECT_EVERY, disabled=not tracking)
+    gate = st.checkbox("Skip static and blurry frames", value=GATE_ENABLED)
     if st.button('Start Video Recognition'):
-        recognize_face_video()
+        recognize_face_video(tracking, detect_every, gate, detector)
 
 elif option == 'Recognize Face in Image':
 
         st.header('Helos.ai Recognize Face in an Image')
         image_file = st.file_uploader("Upload Image", type=['jpg', 'png'])
         if image_file is not None:
-            # Convert the file to an opencv image.
-            file_bytes = np.asarray(bytearray(image_file.read()), dtype=np.uint8)
-            if st.button('Recognize Faces'):
-                # Process the image and recognize faces
-                annotated_image = recognize_face_in_image_stream(file_bytes)
+            content = image_file.getvalue()
+            upload_hash = hashlib.sha256(content).hexdigest()
+            # Keep showing the result on later reruns without pressing the button again.
+            if st.button('Recognize Faces') or st.session_state.get("recognized_upload") == upload_hash:
+                st.session_state["recognized_upload"] = upload_hash
+                annotated_image = recognize_upload(upload_hash, face_dir_signature(FACE_DIR), detector, content)
                 # Display the annotated image
                 st.image(annotated_image, channels="RGB", use_column_width=True)
 
@@ -87,17 +172,29 @@ elif option == 'Capture Face Data from Folder':
     st.header('Capture Face Data from a Folder')
     dir_path = st.text_input("Enter the directory path:")
     if st.button('Capture Data'):
-        capture_face_data_from_folder(dir_path)
+        capture_face_data_from_folder(dir_path, detector=detector)
 
 elif option == 'Check Face in Video':
     st.header('Check if a Face Exists in a Video')
-    face_image_path = st.text_input("Enter the path to the face data file:")
+    face_image_path = st.text_input("Enter an enrolled name or the path to a face data file:")
     video_file = st.file_uploader("Upload Video", type=['mp4', 'avi'])
-    if video_file is not None and face_image_path:
+    # Multi-GB videos: the uploader holds uploads in memory, so read them from disk instead.
+    server_video_path = st.text_input("...or the path to a video on this machine:")
+    sample_every = st.number_input("Analyse every Nth frame", min_value=1, value=1)
+    gate = st.checkbox("Skip static and blurry frames", value=GATE_ENABLED)
+    if (video_file is not None or server_video_path) and face_image_path:
         if st.button('Check Video'):
-            result = check_face_in_video(face_image_path, video_file)
+            video_path = server_video_path if video_file is None else spool_upload(video_file)
+            on_progress = show_scan_progress(st.progress(0.0), st.empty(), st.empty())
+            try:
+                result = check_face_in_video(face_image_path, video_path, sample_every=int(sample_every),
+                                             on_progress=on_progress, gate=gate, detector=detector,
+                                             executor=load_video_executor())
+            finally:
+                if video_file is not None:
+                    os.remove(video_path)
             if result:
-                st.success("Face exists in video")
+                st.success(f"Face exists in video (frame {result.frame_number}, {result.timestamp:.2f}s)")
             else:
                 st.error("Face not found in video")
 
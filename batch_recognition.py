@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+import cv2
+import numpy as np
+
+import metrics
+import models
+
+from detection import DETECTION_SCALE, check_detection_scale, detect_faces
+from detectors import BACKENDS, detector_config
+from encoding_cache import BGR_PARAMS, CACHE_DIR, cached_faces, get_encoding_cache
+from gallery import ENCODING_SIZE, FACE_DIR, TOLERANCE, get_gallery
+from rendering import draw_faces
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class FaceResult(namedtuple("FaceResult", ["box", "name", "distance", "known"])):
+    # box is (top, right, bottom, left); name is the nearest identity even when it is not a match.
+
+    @property
+    def label(self):
+        return self.name if self.known else "Unknown"
+
+
+# image is only kept when asked for (for annotation); error is a message when the item failed.
+ImageResult = namedtuple("ImageResult", ["source", "faces", "image", "error", "cache_hit"])
+
+
+def read_content(item):
+    # Accepts a path, encoded bytes, or a uint8 buffer such as np.frombuffer(upload.read(), np.uint8).
+    if isinstance(item, (str, os.PathLike)):
+        with open(item, "rb") as f:
+            return f.read()
+    if isinstance(item, np.ndarray):
+        return item.tobytes()
+    return bytes(item)
+
+
+def decode_image(content):
+    with metrics.stage("decode"):
+        image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("could not decode image")
+    return image
+
+
+def warm_worker():
+    # Pool initializer: pays the dlib model load once per worker process instead of on its first item.
+    models.warm()
+
+
+def encode_item(item, detection_scale=DETECTION_SCALE, cache_dir=CACHE_DIR, keep_image=False, detector=None):
+    # Runs in a worker thread or process. Returns (locations, encodings, image, error, cache_hit);
+    # on a cache hit the image is not even decoded unless keep_image is set.
+    try:
+        content = read_content(item)
+        image = decode_image(content) if keep_image else None
+        config = detector_config(detector)
+
+        def compute():
+            decoded = image if image is not None else decode_image(content)
+            locations = detect_faces(decoded, detection_scale, config)
+            return locations, models.face_encodings(decoded, locations, config.num_jitters)
+
+        params = dict(BGR_PARAMS, scale=detection_scale, **config.params())
+        locations, encodings, hit = cached_faces(get_encoding_cache(cache_dir), content, params, compute)
+        metrics.observe("faces_per_frame", len(encodings), metrics.COUNT_BUCKETS)
+        return locations, encodings, image, None, hit
+    except Exception as e:
+        return [], [], None, str(e), False
+
+
+def recognize_images(items, matcher=None, tolerance=TOLERANCE, detection_scale=DETECTION_SCALE, workers=None,
+                     processes=True, keep_images=False, cache_dir=CACHE_DIR, executor=None, detector=None):
+    # Decodes, detects and encodes the items in parallel, then matches every face of the batch in a
+    # single gallery query. Items are spread over worker processes, as dlib holds the GIL while
+    # detecting; processes=False uses threads, which only overlap decoding. A single item is encoded
+    # in this process. Pass a long-lived executor to avoid starting a pool per batch. detector is a backend name or detectors.DetectorConfig.
+    check_detection_scale(detection_scale)
+    items = list(items)
+    if not items:
+        return []
+    matcher = matcher if matcher is not None else get_gallery(FACE_DIR)
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    # Resolved here so worker processes use this process's default, not their own.
+    args = (items, repeat(detection_scale), repeat(cache_dir), repeat(keep_images), repeat(detector_config(detector)))
+    chunksize = max(1, len(items) // (workers * 4))
+    if executor is not None:
+        encoded = list(map(metrics.unwrap, executor.map(metrics.in_worker(executor, encode_item), *args,
+                                                        chunksize=chunksize)))
+    elif workers == 1:
+        encoded = list(map(encode_item, *args))
+    elif processes:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(workers) as pool:
+            encoded = list(map(metrics.unwrap, pool.map(metrics.in_worker(pool, encode_item), *args,
+                                                        chunksize=chunksize)))
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            encoded = list(pool.map(encode_item, *args))
+
+    all_encodings = [encoding for _, encodings, _, _, _ in encoded for encoding in encodings]
+    matches = iter(matcher.match(np.asarray(all_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE), tolerance)
+                   if all_encodings else [])
+
+    results = []
+    for i, (item, (locations, encodings, image, error, hit)) in enumerate(zip(items, encoded)):
+        faces = []
+        for location, _ in zip(locations, encodings):
+            match = next(matches)
+            faces.append(FaceResult(tuple(int(v) for v in location), match.name, match.distance, match.known))
+        source = os.fspath(item) if isinstance(item, (str, os.PathLike)) else i
+        results.append(ImageResult(source, faces, image, error, hit))
+    return results
+
+
+def annotate(image, faces, box_color=(0, 0, 255), text_color=None, font_scale=1.2, thickness=3):
+    # Draws boxes and labels on a copy of a BGR image.
+    return draw_faces(image.copy(), faces, box_color, text_color, font_scale, thickness)
+
+
+def list_images(image_dir):
+    return sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(image_dir)
+        for file in files
+        if file.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognise every face in a folder of images")
+    parser.add_argument("image_dir")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", action="store_true", help="use threads instead of worker processes")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    parser.add_argument("--detector", choices=BACKENDS, default=None, help="default: see detectors.py")
+    parser.add_argument("--upsample", type=int, default=None)
+    parser.add_argument("--num-jitters", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per image")
+    args = parser.parse_args()
+
+    paths = list_images(args.image_dir)
+    gallery = get_gallery(FACE_DIR)
+    detector = detector_config(args.detector, args.upsample, args.num_jitters)
+    from concurrent.futures import ProcessPoolExecutor
+
+    executor = (ThreadPoolExecutor if args.threads else ProcessPoolExecutor)(args.workers or os.cpu_count() or 1)
+    start = time.perf_counter()
+    faces = 0
+    for offset in range(0, len(paths), args.batch_size):
+        batch = paths[offset:offset + args.batch_size]
+        for result in recognize_images(batch, gallery, detection_scale=args.detection_scale, executor=executor,
+                                       detector=detector):
+            faces += len(result.faces)
+            if args.json:
+                print(json.dumps({
+                    "image": result.source,
+                    "error": result.error,
+                    "faces": [{"box": face.box, "name": face.label, "distance": face.distance}
+                              for face in result.faces],
+                }))
+            elif result.error:
+                print(f"[ERROR] Error processing image {result.source}. Error: {result.error}")
+            else:
+                print(f"{result.source}\t" + ", ".join(face.label for face in result.faces))
+    executor.shutdown()
+    seconds = time.perf_counter() - start
+    print(f"[INFO] {len(paths)} images, {faces} faces in {seconds:.1f}s "
+          f"({len(paths) / max(seconds, 1e-9):.1f} images/s)", file=sys.stderr if args.json else sys.stdout)
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_recognition import list_images, recognize_images
+from gallery import FACE_DIR, get_gallery
+
+
+def run(image_dir, limit, workers):
+    paths = list_images(image_dir)[:limit]
+    if not paths:
+        print(f"[ERROR] No images found in {image_dir}")
+        return
+    gallery = get_gallery(FACE_DIR)
+    gallery.load()
+    modes = [
+        ("one call per image", lambda cache_dir: [recognize_images([path], gallery, workers=1, cache_dir=cache_dir)
+                                                  for path in paths]),
+        ("batch, threads", lambda cache_dir: recognize_images(paths, gallery, workers=workers, processes=False,
+                                                              cache_dir=cache_dir)),
+        ("batch, processes", lambda cache_dir: recognize_images(paths, gallery, workers=workers, processes=True,
+                                                                cache_dir=cache_dir)),
+    ]
+    print(f"[INFO] {len(paths)} images; every mode starts with an empty encoding cache.")
+    print(f"{'mode':>20} {'seconds':>9} {'images/s':>9}")
+    for label, fn in modes:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            fn(cache_dir)
+            seconds = time.perf_counter() - start
+        print(f"{label:>20} {seconds:>9.2f} {len(paths) / seconds:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image recognition throughput: per-image calls vs batches")
+    parser.add_argument("image_dir")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    run(args.image_dir, args.limit, args.workers)
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_recognition import list_images
+from detection import detect_faces
+from detectors import BACKENDS, _recall, detector_config
+
+
+def load_images(image_dir, limit):
+    images = [(path, cv2.imread(path)) for path in list_images(image_dir)[:limit]]
+    return [(path, image) for path, image in images if image is not None]
+
+
+def run(image_dir, scales, limit, repeats, detector=None):
+    images = load_images(image_dir, limit)
+    if not images:
+        print(f"[ERROR] No images found in {image_dir}")
+        return
+    pixels = np.mean([image.shape[0] * image.shape[1] for _, image in images]) / 1e6
+    detector = detector_config(detector)
+    print(f"[INFO] {len(images)} images, {pixels:.1f} MP on average, {detector.backend} detector; full-scale "
+          f"detections are the reference.")
+
+    reference = {path: detect_faces(image, 1.0, detector) for path, image in images}
+    faces = sum(len(boxes) for boxes in reference.values())
+    print(f"{'scale':>6} {'ms/image':>10} {'speedup':>8} {'recall':>8} {'faces':>6}")
+    baseline = None
+    for scale in scales:
+        timings = []
+        hits = 0
+        found = 0
+        for path, image in images:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                detections = detect_faces(image, scale, detector)
+                timings.append(time.perf_counter() - start)
+            found += len(detections)
+            hits += _recall(reference[path], detections)[0]
+        ms = np.mean(timings) * 1000
+        baseline = baseline or ms
+        face_recall = hits / faces if faces else float("nan")
+        print(f"{scale:>6.2f} {ms:>10.1f} {baseline / ms:>7.1f}x {face_recall:>8.3f} {found:>6}")
+    print(f"[INFO] {faces} reference faces.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detection latency and recall at several detection scales")
+    parser.add_argument("image_dir")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.33, 0.25])
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--detector", choices=BACKENDS, default=None)
+    parser.add_argument("--upsample", type=int, default=None)
+    args = parser.parse_args()
+    run(args.image_dir, args.scales, args.limit, args.repeats, detector_config(args.detector, args.upsample))
@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import ENCODING_SIZE, Gallery
+
+
+def legacy_load_known_faces(face_dir):
+    known_faces = {}
+    for filename in os.listdir(face_dir):
+        if filename.endswith('_data.npy'):
+            encodings = np.load(os.path.join(face_dir, filename), allow_pickle=True)
+            known_faces[filename.split('_')[0]] = encodings
+    return known_faces
+
+
+def make_faces_dir(path, identities, encodings_per_identity, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(identities):
+        encodings = rng.normal(0, 0.1, size=(encodings_per_identity, ENCODING_SIZE))
+        np.save(os.path.join(path, f"person{i:06d}_data.npy"), list(encodings))
+
+
+def time_per_request(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def run(sizes, encodings_per_identity, repeats):
+    print(f"{'identities':>10} {'legacy ms':>12} {'cold ms':>12} {'rescan ms':>12} {'cached ms':>12}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as face_dir:
+            make_faces_dir(face_dir, size, encodings_per_identity)
+
+            legacy = time_per_request(lambda: legacy_load_known_faces(face_dir), max(1, repeats // 10))
+            cold = time_per_request(lambda: Gallery(face_dir).load(), 1)
+
+            # check_interval=0 stats every file on every request; the default throttles that as well.
+            rescanning = Gallery(face_dir, check_interval=0)
+            rescanning.load()
+            rescan = time_per_request(rescanning.load, repeats)
+
+            cached = Gallery(face_dir)
+            cached.load()
+            cached_ms = time_per_request(cached.load, repeats)
+
+            print(f"{size:>10} {legacy:>12.2f} {cold:>12.2f} {rescan:>12.2f} {cached_ms:>12.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-request gallery load latency")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--encodings-per-identity", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.encodings_per_identity, args.repeats)
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gallery import ENCODING_SIZE
+from gallery_store import legacy_files, migrate_legacy_files
+
+# Runs in a fresh interpreter per format so start-up time and memory are not shared. Memory is the
+# growth of the current resident set (VmRSS, which counts the touched pages of a memory map) from
+# after the imports to after the first match; ru_maxrss is a lifetime peak and hides it.
+STARTUP_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+import numpy as np
+from gallery import Gallery
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+before = rss_mb()
+start = time.perf_counter()
+gallery = Gallery({face_dir!r})
+data = gallery.load()
+loaded = time.perf_counter() - start
+gallery.match(np.zeros((1, 128), dtype=np.float32))
+first_match = time.perf_counter() - start - loaded
+print(json.dumps({{"load_ms": loaded * 1000, "first_match_ms": first_match * 1000,
+                  "rss_mb": rss_mb() - before, "encodings": len(data.encodings)}}))
+"""
+
+
+def make_legacy_dir(path, identities, encodings_per_identity, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(identities):
+        encodings = rng.normal(0, 0.1, size=(encodings_per_identity, ENCODING_SIZE))
+        np.save(os.path.join(path, f"person_{i:06d}_data.npy"), list(encodings))
+
+
+def measure(face_dir):
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(root=ROOT, face_dir=face_dir)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(sizes, encodings_per_identity):
+    print(f"{'identities':>10} {'format':>8} {'load ms':>10} {'match ms':>10} {'RSS MB':>8} {'disk MB':>8}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            legacy_dir = os.path.join(root, "legacy")
+            store_dir = os.path.join(root, "store")
+            os.makedirs(legacy_dir)
+            make_legacy_dir(legacy_dir, size, encodings_per_identity)
+            shutil.copytree(legacy_dir, store_dir)
+            migrate_legacy_files(store_dir)
+            for filename in legacy_files(store_dir):
+                os.remove(os.path.join(store_dir, filename))
+
+            for label, face_dir in (("npy", legacy_dir), ("store", store_dir)):
+                disk = sum(os.path.getsize(os.path.join(face_dir, f)) for f in os.listdir(face_dir)) / 1e6
+                result = measure(face_dir)
+                print(f"{size:>10} {label:>8} {result['load_ms']:>10.1f} {result['first_match_ms']:>10.1f} "
+                      f"{result['rss_mb']:>8.1f} {disk:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start-up load time and memory: per-person .npy files vs the store")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--encodings-per-identity", type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.encodings_per_identity)
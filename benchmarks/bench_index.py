@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_index import ExactIndex, HNSWIndex, IVFIndex
+from gallery import ENCODING_SIZE
+
+# Synthetic identities: centres ~1.0 apart, samples ~0.3 from each other, which is roughly
+# how dlib encodings of different / the same person are spread.
+CENTRE_SIGMA = 0.0625
+SAMPLE_SIGMA = 0.022
+
+
+def synthetic_gallery(identities, encodings_per_identity, rng):
+    centres = rng.normal(0, CENTRE_SIGMA, size=(identities, ENCODING_SIZE)).astype(np.float32)
+    faces = {}
+    for i, centre in enumerate(centres):
+        noise = rng.normal(0, SAMPLE_SIGMA, size=(encodings_per_identity, ENCODING_SIZE))
+        faces[f"person{i}"] = (centre + noise).astype(np.float32)
+    return centres, faces
+
+
+def timed_matches(index, queries, batch):
+    start = time.perf_counter()
+    matches = []
+    for i in range(0, len(queries), batch):
+        matches.extend(index.match(queries[i:i + batch]))
+    elapsed = time.perf_counter() - start
+    return matches, elapsed / len(queries) * 1000
+
+
+def recall(matches, reference):
+    return np.mean([match.name == expected.name for match, expected in zip(matches, reference)])
+
+
+def run(identities, encodings_per_identity, queries_count, batch, seed):
+    rng = np.random.default_rng(seed)
+    centres, faces = synthetic_gallery(identities, encodings_per_identity, rng)
+    picked = rng.integers(0, identities, size=queries_count)
+    queries = centres[picked] + rng.normal(0, SAMPLE_SIGMA, size=(queries_count, ENCODING_SIZE)).astype(np.float32)
+    print(f"[INFO] {identities} identities, {identities * encodings_per_identity} encodings, {queries_count} queries")
+
+    exact = ExactIndex()
+    for name, encodings in faces.items():
+        exact.add(name, encodings)
+    exact.match(queries[:1])
+    reference, exact_ms = timed_matches(exact, queries, batch)
+    print(f"{'index':<8} {'param':<12} {'build s':>9} {'ms/query':>10} {'recall@1':>9}")
+    print(f"{'exact':<8} {'-':<12} {'-':>9} {exact_ms:>10.3f} {1.0:>9.3f}")
+
+    start = time.perf_counter()
+    ivf = IVFIndex()
+    for name, encodings in faces.items():
+        ivf.add(name, encodings)
+    ivf.train()
+    build = time.perf_counter() - start
+    for nprobe in (1, 2, 4, 8, 16, 32):
+        ivf.nprobe = nprobe
+        matches, ms = timed_matches(ivf, queries, batch)
+        print(f"{'ivf':<8} {f'nprobe={nprobe}':<12} {build:>9.2f} {ms:>10.3f} {recall(matches, reference):>9.3f}")
+
+    try:
+        start = time.perf_counter()
+        hnsw = HNSWIndex()
+        for name, encodings in faces.items():
+            hnsw.add(name, encodings)
+        build = time.perf_counter() - start
+    except ImportError:
+        print("[INFO] hnswlib is not installed; skipping the HNSW index.")
+        return
+    for ef in (16, 32, 64, 128, 256):
+        hnsw.ef = ef
+        matches, ms = timed_matches(hnsw, queries, batch)
+        print(f"{'hnsw':<8} {f'ef={ef}':<12} {build:>9.2f} {ms:>10.3f} {recall(matches, reference):>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of the approximate gallery indexes")
+    parser.add_argument("--identities", type=int, default=100000)
+    parser.add_argument("--encodings-per-identity", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=4, help="faces matched per call, e.g. faces per frame")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.identities, args.encodings_per_identity, args.queries, args.batch, args.seed)
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_recognition_utils import iter_face_video
+from gallery import FACE_DIR, get_gallery
+from rendering import WindowSink, draw_faces, draw_status
+from tracking import DETECT_EVERY, REVERIFY_EVERY, FaceTracker
+
+
+def run_mode(video_path, mode, max_frames, detect_every):
+    tracker = FaceTracker(get_gallery(FACE_DIR), detect_every, REVERIFY_EVERY if detect_every > 1 else 1)
+    sink = WindowSink("bench_rendering") if mode == "window" else None
+    frames = 0
+    start = time.perf_counter()
+    for video_frame in iter_face_video(video_path, tracker, max_frames):
+        frames += 1
+        if mode == "headless":
+            continue
+        draw_faces(video_frame.frame, video_frame.faces)
+        draw_status(video_frame.frame, f"{tracker.fps:.1f} FPS")
+        if sink is not None:
+            sink.show(video_frame.frame)
+    seconds = time.perf_counter() - start
+    if sink is not None:
+        sink.close()
+    return frames, seconds
+
+
+def run(video_path, max_frames, detect_every):
+    modes = ["headless", "draw"]
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        modes.append("window")
+    else:
+        print("[INFO] No display; skipping the imshow mode.")
+    print(f"{'mode':>10} {'frames':>8} {'fps':>8}")
+    for mode in modes:
+        try:
+            frames, seconds = run_mode(video_path, mode, max_frames, detect_every)
+        except cv2.error as e:
+            print(f"[WARNING] {mode} mode failed: {e}")
+            continue
+        print(f"{mode:>10} {frames:>8} {frames / max(seconds, 1e-9):>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Video recognition FPS headless, drawing only, and drawing + imshow")
+    parser.add_argument("video_path")
+    parser.add_argument("--max-frames", type=int, default=300)
+    parser.add_argument("--detect-every", type=int, default=DETECT_EVERY, help="1 disables tracking")
+    args = parser.parse_args()
+    run(args.video_path, args.max_frames, args.detect_every)
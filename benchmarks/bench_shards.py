@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_index import SAMPLE_SIGMA, recall, synthetic_gallery, timed_matches
+
+from face_index import ExactIndex
+from gallery import ENCODING_SIZE
+from gallery_shards import ShardedIndex
+
+
+def run(identities, encodings_per_identity, queries_count, batches, shard_counts, churn, seed):
+    rng = np.random.default_rng(seed)
+    centres, faces = synthetic_gallery(identities, encodings_per_identity, rng)
+    picked = rng.integers(0, identities, size=queries_count)
+    queries = centres[picked] + rng.normal(0, SAMPLE_SIGMA, size=(queries_count, ENCODING_SIZE)).astype(np.float32)
+    print(f"[INFO] {identities} identities, {identities * encodings_per_identity} encodings, {queries_count} queries, "
+          f"{os.cpu_count()} CPUs")
+
+    exact = ExactIndex()
+    for name, encodings in faces.items():
+        exact.add(name, encodings)
+    reference = exact.match(queries)
+    print(f"{'shards':>7} {'batch':>6} {'load s':>8} {'ms/query':>10} {'recall@1':>9} {'rebalance s':>12}")
+    for batch in batches:
+        _, ms = timed_matches(exact, queries, batch)
+        print(f"{'local':>7} {batch:>6} {'-':>8} {ms:>10.3f} {1.0:>9.3f} {'-':>12}")
+
+    for shards in shard_counts:
+        index = ShardedIndex(shards)
+        try:
+            start = time.perf_counter()
+            for name, encodings in faces.items():
+                index.add(name, encodings)
+            index.flush()
+            load = time.perf_counter() - start
+
+            # Remove a slice of one shard's identities so the next flush has to move some across.
+            start = time.perf_counter()
+            removed = [name for name, shard_id in index._owners.items() if shard_id == 0][:int(identities * churn)]
+            for name in removed:
+                index.remove(name)
+            index.flush()
+            for name in removed:
+                index.add(name, faces[name])
+            index.flush()
+            rebalance = time.perf_counter() - start
+
+            for batch in batches:
+                index.match(queries[:batch])
+                matches, ms = timed_matches(index, queries, batch)
+                print(f"{shards:>7} {batch:>6} {load:>8.2f} {ms:>10.3f} {recall(matches, reference):>9.3f} "
+                      f"{rebalance:>12.2f}")
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query latency of the sharded gallery against shard count")
+    parser.add_argument("--identities", type=int, default=100000)
+    parser.add_argument("--encodings-per-identity", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 32], help="faces matched per call")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--churn", type=float, default=0.05,
+                        help="fraction of identities removed from one shard and re-enrolled")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.identities, args.encodings_per_identity, args.queries, args.batch, args.shards, args.churn, args.seed)
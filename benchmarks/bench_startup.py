@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each measurement runs in a fresh interpreter so nothing is already imported or loaded.
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print((time.perf_counter() - start) * 1000)
+"""
+
+REQUEST_SCRIPT = """
+import json, sys, tempfile, time
+sys.path.insert(0, {root!r})
+import cv2
+import numpy as np
+start = time.perf_counter()
+from batch_recognition import recognize_images
+import models
+imported = time.perf_counter()
+loaded_at_import = models.loaded()
+image = cv2.imencode(".jpg", np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8))[1]
+timings = []
+with tempfile.TemporaryDirectory() as cache_dir:
+    for seed in range(3):
+        content = image.tobytes() + bytes([seed])  # distinct content, so the encoding cache never answers
+        begin = time.perf_counter()
+        result = recognize_images([content], workers=1, cache_dir=cache_dir)[0]
+        if result.error:
+            sys.exit(result.error)
+        timings.append((time.perf_counter() - begin) * 1000)
+print(json.dumps({{"import_ms": (imported - start) * 1000, "models_loaded_at_import": loaded_at_import,
+                  "first_ms": timings[0], "warm_ms": min(timings[1:])}}))
+"""
+
+
+def run_python(script):
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=ROOT)
+    if result.returncode:
+        return None, result.stderr.strip().splitlines()[-1]
+    return result.stdout.strip().splitlines()[-1], None
+
+
+def import_ms(module, repeats):
+    timings = []
+    for _ in range(repeats):
+        output, error = run_python(IMPORT_SCRIPT.format(root=ROOT, module=module))
+        if error:
+            return None, error
+        timings.append(float(output))
+    return min(timings), None
+
+
+def run(repeats):
+    print(f"{'import':>24} {'ms':>9}")
+    # face_recognition is what every module used to import eagerly; it loads the dlib models.
+    for module in ("main", "gallery", "face_recognition_utils", "server", "face_recognition"):
+        ms, error = import_ms(module, repeats)
+        print(f"{module:>24} {ms:>9.1f}" if error is None else f"{module:>24} {'n/a':>9}  ({error})")
+
+    output, error = run_python(REQUEST_SCRIPT.format(root=ROOT))
+    if error:
+        print(f"[ERROR] First-request measurement failed: {error}")
+        return
+    result = json.loads(output)
+    print(f"[INFO] Models loaded by importing batch_recognition: {result['models_loaded_at_import']}")
+    print(f"[INFO] First recognition (loads the models) {result['first_ms']:.1f} ms, "
+          f"warm recognition {result['warm_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of the entry points and first-request latency")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeats)
@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from run import write_video
+
+from batch_recognition import warm_worker
+from detection import DETECTION_SCALE
+from gallery import ENCODING_SIZE, build_gallery_data
+from video_pipeline import scan_video
+
+# Measured with the real dlib HOG detector, --frames 150 --workers 2 on a one-CPU host: workers=1
+# 3.2 frames/s, workers=2 3.1, warm pool 3.3. With one core the pool can only overlap decoding with
+# detection, so this shows the pool costs ~3% at worst; the speedup needs more cores to show.
+
+
+def run(video_path, workers, sample_every, detection_scale, repeats):
+    # A probe that never matches, so every mode scans the whole video.
+    probe = build_gallery_data({"probe": np.full((1, ENCODING_SIZE), 10.0, dtype=np.float32)})
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(workers, initializer=warm_worker)
+    list(executor.map(abs, range(workers)))
+    modes = [
+        ("workers=1", {"workers": 1}),
+        (f"workers={workers}", {"workers": workers}),
+        (f"workers={workers}, warm pool", {"workers": workers, "executor": executor}),
+    ]
+    print(f"[INFO] {video_path}, every {sample_every} frame(s), {os.cpu_count()} CPUs")
+    print(f"{'mode':>24} {'seconds':>9} {'frames/s':>9} {'speedup':>8}")
+    baseline = None
+    for label, options in modes:
+        samples = []
+        for _ in range(repeats):
+            result = scan_video(video_path, probe, sample_every, detection_scale=detection_scale, **options)
+            samples.append(result.seconds)
+        seconds = float(np.median(samples))
+        baseline = baseline or seconds
+        print(f"{label:>24} {seconds:>9.2f} {result.frames_scanned / seconds:>9.1f} {baseline / seconds:>7.2f}x")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="scan_video throughput: one process vs a pool of worker processes")
+    parser.add_argument("video_path", nargs="?", default=None, help="default: a synthetic clip of drawn faces")
+    parser.add_argument("--frames", type=int, default=300, help="length of the synthetic clip")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per CPU core")
+    parser.add_argument("--sample-every", type=int, default=1)
+    parser.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.video_path:
+        run(args.video_path, args.workers, args.sample_every, args.detection_scale, args.repeats)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            clip = write_video(os.path.join(work_dir, "faces.avi"), np.random.default_rng(args.seed), args.frames)
+            run(clip, args.workers, args.sample_every, args.detection_scale, args.repeats)
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_recognition import list_images
+
+
+def synthetic_images(count, size=(480, 640), seed=0):
+    # Distinct noise images, so the server's encoding cache cannot answer them.
+    rng = np.random.default_rng(seed)
+    return [cv2.imencode(".jpg", rng.integers(0, 255, size=(*size, 3), dtype=np.uint8))[1].tobytes()
+            for _ in range(count)]
+
+
+def post(url, body, timeout):
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": "application/octet-stream"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = json.loads(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        payload = {}
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        payload = {}
+        status = None
+    return status, time.perf_counter() - start, payload.get("batch_size")
+
+
+def run(url, images, requests, concurrency, timeout):
+    lock = threading.Lock()
+    results = []
+
+    def worker(i):
+        result = post(url, images[i % len(images)], timeout)
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(requests)))
+    seconds = time.perf_counter() - start
+
+    ok = np.array([latency for status, latency, _ in results if status == 200]) * 1000
+    statuses = {}
+    for status, _, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    batches = [batch for status, _, batch in results if status == 200 and batch]
+    print(f"[INFO] {requests} requests, concurrency {concurrency}, {seconds:.1f}s")
+    print(f"[INFO] status counts: {statuses}")
+    if len(ok):
+        print(f"[INFO] latency p50 {np.percentile(ok, 50):.1f} ms, p99 {np.percentile(ok, 99):.1f} ms, "
+              f"max {ok.max():.1f} ms")
+        print(f"[INFO] throughput {len(ok) / seconds:.1f} successful requests/s, mean batch size {np.mean(batches):.1f}")
+    return {"seconds": seconds, "statuses": statuses, "latencies_ms": ok.tolist()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test POST /recognize on a running server.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/recognize")
+    parser.add_argument("--image-dir", help="default: synthetic noise images")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.image_dir:
+        images = []
+        for path in list_images(args.image_dir)[:args.requests]:
+            with open(path, "rb") as f:
+                images.append(f.read())
+    else:
+        images = synthetic_images(min(args.requests, 200))
+    run(args.url, images, args.requests, args.concurrency, args.timeout)
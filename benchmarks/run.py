@@ -0,0 +1,301 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import metrics
+
+from bench_index import SAMPLE_SIGMA, synthetic_gallery
+from gallery import ENCODING_SIZE, build_gallery_data
+
+# Reproducible end-to-end benchmarks, offline and on CPU:
+#
+#     python benchmarks/run.py --output results/$(git rev-parse --short HEAD).json
+#
+# Everything runs in a scratch directory on a synthetic corpus generated from --seed: drawn faces
+# (images, an enrollment folder, a video made from them) and a gallery of random 128-d encodings.
+# Each benchmark also records the per-stage breakdown from metrics.py. The drawn faces time the
+# detector, but HOG finds few of them; pass --images DIR to time encoding on real photos too.
+BENCHMARKS = ("image", "enroll", "video", "match")
+IMAGE_SIZE = (640, 480)
+VIDEO_FPS = 30
+QUICK = {"images": 8, "people": 3, "images_per_person": 3, "video_frames": 60, "gallery_sizes": "1000,10000",
+         "repeats": 1}
+
+
+def synthetic_background(rng, size=IMAGE_SIZE):
+    width, height = size
+    gradient = np.linspace(60, 190, width, dtype=np.float32)[None, :, None]
+    image = np.broadcast_to(gradient, (height, width, 3)) + rng.normal(0, 8, (height, width, 3))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def draw_face(image, cx, cy, s, skin):
+    # In place: a face of height 2*s centred on (cx, cy).
+    cv2.ellipse(image, (cx, cy), (int(s * 0.75), s), 0, 0, 360, skin, -1)
+    for side in (-1, 1):
+        eye = (cx + side * int(s * 0.32), cy - int(s * 0.2))
+        cv2.ellipse(image, eye, (int(s * 0.14), int(s * 0.07)), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(image, eye, int(s * 0.05), (40, 30, 30), -1)
+        cv2.line(image, (eye[0] - int(s * 0.15), eye[1] - int(s * 0.14)),
+                 (eye[0] + int(s * 0.15), eye[1] - int(s * 0.16)), (40, 40, 60), max(2, s // 25))
+    cv2.line(image, (cx, cy - int(s * 0.1)), (cx - int(s * 0.06), cy + int(s * 0.2)), (70, 90, 130), 2)
+    cv2.ellipse(image, (cx, cy + int(s * 0.45)), (int(s * 0.28), int(s * 0.1)), 0, 0, 180, (60, 60, 150), -1)
+    return image
+
+
+def random_skin(rng):
+    return tuple(int(v) for v in rng.integers((90, 120, 160), (140, 170, 230)))
+
+
+def synthetic_face_image(rng, faces=1, size=IMAGE_SIZE):
+    width, height = size
+    image = synthetic_background(rng, size)
+    for _ in range(faces):
+        s = int(rng.integers(70, 150))
+        draw_face(image, int(rng.integers(s, width - s)), int(rng.integers(s, height - s)), s, random_skin(rng))
+    return image
+
+
+def write_images(directory, rng, count, prefix="image"):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{prefix}{i:04d}.jpg")
+        cv2.imwrite(path, synthetic_face_image(rng, faces=int(rng.integers(1, 4))))
+        paths.append(path)
+    return paths
+
+
+def write_video(path, rng, frames):
+    # A few scenes of drawn faces drifting sideways.
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), VIDEO_FPS, IMAGE_SIZE)
+    scene = None
+    for i in range(frames):
+        if i % VIDEO_FPS == 0:
+            scene = synthetic_face_image(rng, faces=int(rng.integers(1, 3)))
+        writer.write(np.roll(scene, 2 * (i % VIDEO_FPS), axis=1))
+    writer.release()
+    return path
+
+
+def summarize(seconds):
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "n": len(ms),
+        "total_s": float(ms.sum() / 1000),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "min_ms": float(ms.min()),
+    }
+
+
+def stages():
+    return {name: {"calls": calls, "total_s": seconds, "mean_ms": mean_ms}
+            for name, calls, seconds, mean_ms in metrics.stage_summary()}
+
+
+@contextlib.contextmanager
+def measured(results, name, verbose):
+    # Resets the stage metrics, silences the library's [INFO] output and stores the breakdown.
+    print(f"[INFO] Running {name}...", file=sys.stderr)
+    metrics.drain()
+    entry = results[name] = {}
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        yield entry
+    entry["stages"] = stages()
+
+
+def bench_image(results, corpus, gallery, verbose):
+    from face_recognition_utils import recognize_face_in_image_stream
+
+    buffers = []
+    for path in corpus["images"]:
+        with open(path, "rb") as f:
+            buffers.append(np.frombuffer(f.read(), dtype=np.uint8))
+    # The first pass misses the encoding cache; the second hits it.
+    for label in ("cold", "warm"):
+        with measured(results, f"recognize_face_in_image_stream_{label}", verbose) as entry:
+            samples = []
+            for buffer in buffers:
+                start = time.perf_counter()
+                recognize_face_in_image_stream(buffer, gallery=gallery)
+                samples.append(time.perf_counter() - start)
+            entry.update(summarize(samples))
+
+
+def bench_enroll(results, corpus, workers, verbose):
+    from face_recognition_utils import capture_face_data_from_folder
+
+    with measured(results, "capture_face_data_from_folder", verbose) as entry:
+        start = time.perf_counter()
+        capture_face_data_from_folder(corpus["people_dir"], workers=workers)
+        seconds = time.perf_counter() - start
+        entry.update({"images": corpus["people_images"], "seconds": seconds,
+                      "images_per_s": corpus["people_images"] / max(seconds, 1e-9)})
+
+
+def bench_video(results, corpus, workers, repeats, verbose):
+    from face_recognition_utils import check_face_in_video
+
+    # The probe never matches, so every run scans the whole video.
+    with measured(results, "check_face_in_video", verbose) as entry:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            match = check_face_in_video(corpus["probe"], corpus["video"], workers=workers)
+            samples.append(time.perf_counter() - start)
+        entry.update(summarize(samples))
+        entry["frames"] = match.frames_scanned
+        entry["frames_per_s"] = match.frames_scanned / max(np.median(samples), 1e-9)
+
+
+def bench_match(results, sizes, encodings_per_identity, queries_count, batches, seed, verbose):
+    for size in sizes:
+        rng = np.random.default_rng(seed)
+        identities = max(1, size // encodings_per_identity)
+        centres, faces = synthetic_gallery(identities, encodings_per_identity, rng)
+        data = build_gallery_data(faces)
+        picked = rng.integers(0, identities, size=queries_count)
+        queries = (centres[picked] + rng.normal(0, SAMPLE_SIGMA, (queries_count, ENCODING_SIZE))).astype(np.float32)
+        data.match(queries[:1])
+        for batch in batches:
+            with measured(results, f"gallery_match_{len(data.encodings)}_batch{batch}", verbose) as entry:
+                samples = []
+                for i in range(0, queries_count, batch):
+                    start = time.perf_counter()
+                    data.match(queries[i:i + batch])
+                    samples.append(time.perf_counter() - start)
+                entry.update(summarize(samples))
+                entry.update({"identities": identities, "encodings": len(data.encodings), "batch": batch,
+                              "ms_per_query": entry["total_s"] * 1000 / queries_count})
+
+
+def build_corpus(work_dir, args, rng):
+    corpus = {}
+    if args.images:
+        from batch_recognition import list_images
+
+        corpus["images"] = list_images(args.images)[:args.images_limit]
+    else:
+        corpus["images"] = write_images(os.path.join(work_dir, "images"), rng, args.image_count)
+    people_dir = os.path.join(work_dir, "people")
+    for i in range(args.people):
+        write_images(os.path.join(people_dir, f"person{i:03d}"), rng, args.images_per_person)
+    corpus["people_dir"] = people_dir
+    corpus["people_images"] = args.people * args.images_per_person
+    corpus["video"] = write_video(os.path.join(work_dir, "video.avi"), rng, args.video_frames)
+    corpus["probe"] = os.path.join(work_dir, "probe_data.npy")
+    np.save(corpus["probe"], rng.normal(0, 1, (4, ENCODING_SIZE)).astype(np.float32))
+    return corpus
+
+
+def environment():
+    def git(*command):
+        try:
+            return subprocess.run(["git", "-C", ROOT, *command], capture_output=True, text=True,
+                                  timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def run(args):
+    only = set(args.only.split(",")) if args.only else set(BENCHMARKS)
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="helos-bench-"))
+    os.makedirs(work_dir, exist_ok=True)
+    cwd = os.getcwd()
+    # FACE_DIR is ./faces, so the gallery and encoding cache of the run live in the scratch directory.
+    os.chdir(work_dir)
+    metrics.enable(interval=None)
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    try:
+        corpus = build_corpus(work_dir, args, rng)
+        gallery_rng = np.random.default_rng(args.seed)
+        _, faces = synthetic_gallery(args.image_gallery, 4, gallery_rng)
+        gallery = build_gallery_data(faces)
+        started = time.perf_counter()
+        if "image" in only:
+            bench_image(results, corpus, gallery, args.verbose)
+        if "enroll" in only:
+            bench_enroll(results, corpus, args.workers, args.verbose)
+        if "video" in only:
+            bench_video(results, corpus, args.workers, args.repeats, args.verbose)
+        if "match" in only:
+            sizes = [int(size) for size in args.gallery_sizes.split(",")]
+            batches = [int(batch) for batch in args.batches.split(",")]
+            bench_match(results, sizes, 4, args.queries, batches, args.seed, args.verbose)
+        seconds = time.perf_counter() - started
+    finally:
+        os.chdir(cwd)
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "verbose", "keep")}
+    return {"environment": environment(), "config": config, "seconds": seconds, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducible CPU benchmarks on a synthetic corpus; writes JSON")
+    parser.add_argument("--output", default=None, help="JSON file to write; default: stdout")
+    parser.add_argument("--only", default=None, help=f"comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="small corpus for a smoke run")
+    parser.add_argument("--images", default=None, help="use the images in this folder instead of drawn faces")
+    parser.add_argument("--images-limit", type=int, default=200)
+    parser.add_argument("--image-count", type=int, default=40)
+    parser.add_argument("--image-gallery", type=int, default=1000, help="identities matched against in 'image'")
+    parser.add_argument("--people", type=int, default=10)
+    parser.add_argument("--images-per-person", type=int, default=5)
+    parser.add_argument("--video-frames", type=int, default=300)
+    parser.add_argument("--gallery-sizes", default="1000,10000,100000,200000", help="encodings per gallery")
+    parser.add_argument("--batches", default="1,32")
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3, help="runs of the video check")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--work-dir", default=None, help="scratch directory; default: a temporary one")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary scratch directory")
+    parser.add_argument("--verbose", action="store_true", help="show the library's own output")
+    args = parser.parse_args()
+    if args.quick:
+        args.image_count = QUICK["images"]
+        args.people = QUICK["people"]
+        args.images_per_person = QUICK["images_per_person"]
+        args.video_frames = QUICK["video_frames"]
+        args.gallery_sizes = QUICK["gallery_sizes"]
+        args.repeats = QUICK["repeats"]
+
+    report = run(args)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"[INFO] Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
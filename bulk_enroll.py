@@ -0,0 +1,259 @@
+import argparse
+import io
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import metrics
+import models
+
+from compaction import MAX_PROTOTYPES, compact_encodings, max_prototypes_arg
+from detection import DETECTION_SCALE, check_detection_scale, detect_faces
+from detectors import BACKENDS, detector_config
+from encoding_cache import CACHE_SUBDIR, RGB_PARAMS, cached_faces, get_encoding_cache
+from gallery import ENCODING_SIZE, FACE_DIR, get_gallery
+from gallery_store import save_face_data
+
+# Raw encodings and processed image keys of people still being enrolled, so an interrupted run only
+# encodes images it has not seen; removed once the person is saved. A repeated run reads its images
+# again but finds their encodings in the encoding cache.
+CHECKPOINT_DIR = ".enroll"
+CHECKPOINT_EVERY = 50
+PROGRESS_INTERVAL = 5.0
+# Tasks kept in flight per worker; bounds memory while keeping every core busy.
+TASKS_PER_WORKER = 4
+
+
+def encode_image(image_path, cache_dir, detection_scale=DETECTION_SCALE, detector=None):
+    # Runs in a worker process. Returns (encodings, error, cache_hit).
+    try:
+        with open(image_path, "rb") as f:
+            content = f.read()
+
+        config = detector_config(detector)
+
+        def compute():
+            image = models.load_image_file(io.BytesIO(content))
+            locations = detect_faces(image, detection_scale, config, rgb=True)
+            return locations, models.face_encodings(image, locations, config.num_jitters)
+
+        params = dict(RGB_PARAMS, scale=detection_scale, **config.params())
+        _, encodings, hit = cached_faces(get_encoding_cache(cache_dir), content, params, compute)
+        metrics.observe("faces_per_frame", len(encodings), metrics.COUNT_BUCKETS)
+        return encodings, None, hit
+    except Exception as e:
+        return [], str(e), False
+
+
+def image_key(image_path):
+    stat = os.stat(image_path)
+    return f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def checkpoint_path(person_name, face_dir=FACE_DIR):
+    return os.path.join(face_dir, CHECKPOINT_DIR, f"{person_name}.npz")
+
+
+class PersonProgress:
+    def __init__(self, name, face_dir):
+        self.name = name
+        self.face_dir = face_dir
+        self.encodings = []
+        self.keys = set()
+        self.pending = 0
+        self.added = 0
+        self.unsaved = 0
+        path = checkpoint_path(name, face_dir)
+        if os.path.exists(path):
+            with np.load(path) as checkpoint:
+                self.encodings = list(checkpoint["encodings"])
+                self.keys = set(checkpoint["keys"].tolist())
+
+    def add(self, key, encodings):
+        self.encodings.extend(encodings)
+        if key is not None:
+            self.keys.add(key)
+        self.pending -= 1
+        self.added += 1
+        self.unsaved += 1
+
+    def save_checkpoint(self):
+        path = checkpoint_path(self.name, self.face_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                encodings=np.asarray(self.encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE),
+                keys=np.array(sorted(self.keys), dtype=str),
+            )
+        os.replace(tmp_path, path)
+        self.unsaved = 0
+
+
+def list_people(dir_path):
+    # Same layout as before: every directory with files is one person, named after the directory.
+    for subdir, _, files in os.walk(dir_path):
+        if files:
+            yield os.path.basename(subdir), [os.path.join(subdir, file) for file in sorted(files)]
+
+
+def duplicate_names(people):
+    # Names of more than one folder, e.g. teamA/john and teamB/john.
+    folders = {}
+    for name, images in people:
+        folders.setdefault(name, set()).add(os.path.dirname(images[0]))
+    return {name: sorted(dirs) for name, dirs in folders.items() if len(dirs) > 1}
+
+
+class Throughput:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.encoded = 0
+        self.faces = 0
+        self.cache_hits = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def rate(self):
+        return self.encoded / max(time.perf_counter() - self.start, 1e-9)
+
+    def skip(self):
+        self.done += 1
+
+    def update(self, faces, cache_hit):
+        self.done += 1
+        self.encoded += 1
+        self.faces += faces
+        self.cache_hits += cache_hit
+        if time.perf_counter() - self._last_report >= PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self):
+        self._last_report = time.perf_counter()
+        print(f"[INFO] {self.done}/{self.total} images, {self.faces} faces, {self.rate():.1f} images/s, "
+              f"{self.cache_hits} encoding cache hits")
+
+
+def enroll_from_folder(dir_path, face_dir=FACE_DIR, max_prototypes=MAX_PROTOTYPES, workers=None,
+                       detection_scale=DETECTION_SCALE, detector=None):
+    check_detection_scale(detection_scale)
+    people = list(list_people(dir_path))
+    duplicates = duplicate_names(people)
+    if duplicates:
+        raise ValueError("people are named after their folders, so these folders would be enrolled as the same "
+                         "person; rename or merge them: " + "; ".join(f"{name}: {', '.join(dirs)}"
+                                                                      for name, dirs in sorted(duplicates.items())))
+    progress = Throughput(sum(len(images) for _, images in people))
+    workers = workers or os.cpu_count() or 1
+    cache_dir = os.path.join(face_dir, CACHE_SUBDIR)
+    detector = detector_config(detector)
+    print(f"[INFO] Enrolling {len(people)} people from {progress.total} images with {workers} workers...")
+
+    in_progress = {}
+    saved = []
+    enrolled = set(get_gallery(face_dir).load().names)
+
+    def finish(person):
+        del in_progress[person.name]
+        if not person.added and person.name in enrolled:
+            # Saved by a run that stopped before removing its checkpoint.
+            if os.path.exists(checkpoint_path(person.name, face_dir)):
+                os.remove(checkpoint_path(person.name, face_dir))
+            return
+        person.save_checkpoint()
+        if not person.encodings:
+            print(f"[WARNING] No faces found for {person.name}. Skipping...")
+            return
+        save_face_data(person.name, compact_encodings(person.encodings, max_prototypes), face_dir)
+        os.remove(checkpoint_path(person.name, face_dir))
+        saved.append(person.name)
+        print(f"[INFO] Face data for {person.name} captured and saved to the gallery in {face_dir}!")
+
+    def record(person, image_path, key, encodings, error, cache_hit):
+        if error is not None:
+            # Not recorded as done, so the next run retries it.
+            print(f"[ERROR] Error processing image {image_path}. Error: {error}")
+            key = None
+        elif not encodings:
+            print(f"[WARNING] No faces found in {image_path}. Skipping...")
+        person.add(key, encodings)
+        progress.update(len(encodings), cache_hit)
+        if person.unsaved >= CHECKPOINT_EVERY:
+            person.save_checkpoint()
+        if not person.pending:
+            finish(person)
+
+    def tasks():
+        for name, images in people:
+            person = in_progress[name] = PersonProgress(name, face_dir)
+            todo = []
+            for image_path in images:
+                key = image_key(image_path)
+                if key in person.keys:
+                    progress.skip()
+                else:
+                    todo.append((image_path, key))
+            person.pending = len(todo)
+            if not todo:
+                finish(person)
+            for image_path, key in todo:
+                yield person, image_path, key
+
+    try:
+        if workers == 1:
+            for person, image_path, key in tasks():
+                record(person, image_path, key, *encode_image(image_path, cache_dir, detection_scale, detector))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                encode = metrics.in_worker(pool, encode_image)
+                running = {}
+                queue = tasks()
+                for person, image_path, key in queue:
+                    future = pool.submit(encode, image_path, cache_dir, detection_scale, detector)
+                    running[future] = (person, image_path, key)
+                    while len(running) >= workers * TASKS_PER_WORKER:
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(*running.pop(future), *metrics.unwrap(future.result()))
+                for future in list(running):
+                    record(*running.pop(future), *metrics.unwrap(future.result()))
+    except KeyboardInterrupt:
+        print("[INFO] Interrupted; saving progress so the next run resumes where this one stopped.")
+        for person in list(in_progress.values()):
+            person.save_checkpoint()
+        raise
+
+    progress.report()
+    elapsed = time.perf_counter() - progress.start
+    print(f"[INFO] Encoded {progress.encoded} new images ({progress.total - progress.encoded} already done) "
+          f"in {elapsed:.1f}s, {progress.rate():.1f} images/s")
+    print(f"[INFO] Encoding cache: {progress.cache_hits} hits, {progress.encoded - progress.cache_hits} misses")
+    return {
+        "people": saved,
+        "images": progress.total,
+        "encoded": progress.encoded,
+        "faces": progress.faces,
+        "cache_hits": progress.cache_hits,
+        "seconds": elapsed,
+        "images_per_second": progress.rate(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enroll every person folder under a directory in parallel")
+    parser.add_argument("dir_path")
+    parser.add_argument("--face-dir", default=FACE_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="default: one per CPU core")
+    parser.add_argument("--max-prototypes", type=max_prototypes_arg, default=MAX_PROTOTYPES,
+                        help="0 or none: keep every encoding")
+    parser.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    parser.add_argument("--detector", choices=BACKENDS, default=None, help="default: see detectors.py")
+    parser.add_argument("--upsample", type=int, default=None)
+    parser.add_argument("--num-jitters", type=int, default=None)
+    args = parser.parse_args()
+    enroll_from_folder(args.dir_path, args.face_dir, args.max_prototypes, args.workers, args.detection_scale,
+                       detector_config(args.detector, args.upsample, args.num_jitters))
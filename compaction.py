@@ -0,0 +1,149 @@
+import argparse
+import time
+
+import numpy as np
+
+from face_index import kmeans
+from gallery import (ENCODING_SIZE, FACE_DIR, TOLERANCE, Gallery, build_gallery_data, invalidate_galleries,
+                     pairwise_sq_distances)
+from gallery_store import GalleryStore
+
+# Upper bound on stored encodings per person. None keeps every encoding.
+MAX_PROTOTYPES = 32
+# Encodings closer than this to an already kept one are treated as duplicates of it
+# (consecutive webcam frames are typically ~0.05-0.15 apart).
+DEDUP_DISTANCE = 0.15
+
+
+def max_prototypes_arg(value):
+    # argparse type for --max-prototypes: 0 or "none" keep every encoding (max_prototypes=None).
+    if value.strip().lower() in ("0", "none"):
+        return None
+    try:
+        count = int(value)
+    except ValueError:
+        count = -1
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive number, 0 or none, got {value!r}")
+    return count
+
+
+def deduplicate_rows(encodings, dedup_distance=DEDUP_DISTANCE):
+    # Indices of the encodings kept in order, each one dropped if it is close to one kept before it.
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    kept = np.empty_like(encodings)
+    rows = []
+    threshold = dedup_distance ** 2
+    for row, encoding in enumerate(encodings):
+        if rows and pairwise_sq_distances(encoding, kept[:len(rows)]).min() <= threshold:
+            continue
+        kept[len(rows)] = encoding
+        rows.append(row)
+    return rows
+
+
+def deduplicate_encodings(encodings, dedup_distance=DEDUP_DISTANCE):
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    return encodings[deduplicate_rows(encodings, dedup_distance)]
+
+
+def compact_encodings(encodings, max_prototypes=MAX_PROTOTYPES, dedup_distance=DEDUP_DISTANCE, seed=0):
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    if max_prototypes is None or len(encodings) < 2:
+        return encodings
+    prototypes = deduplicate_encodings(encodings, dedup_distance)
+    if len(prototypes) > max_prototypes:
+        # Cluster all raw encodings (not just the kept ones) so centres follow how often a pose was seen.
+        prototypes = kmeans(encodings, max_prototypes, seed=seed)
+    return prototypes
+
+
+def split_probes(faces, probe_fraction, rng):
+    enrolled, probes = {}, []
+    for name, encodings in faces.items():
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        count = int(len(encodings) * probe_fraction)
+        if len(encodings) < 2 or not count:
+            enrolled[name] = encodings
+            continue
+        order = rng.permutation(len(encodings))
+        enrolled[name] = encodings[order[count:]]
+        probes.extend((name, encoding) for encoding in encodings[order[:count]])
+    return enrolled, probes
+
+
+def evaluate_compaction(faces, max_prototypes=MAX_PROTOTYPES, dedup_distance=DEDUP_DISTANCE,
+                        probe_fraction=0.2, tolerance=TOLERANCE, seed=0):
+    # Holds out probe_fraction of every person's encodings, enrolls the rest raw and compacted,
+    # and compares how the held-out encodings are matched against each.
+    enrolled, probes = split_probes(faces, probe_fraction, np.random.default_rng(seed))
+    raw = build_gallery_data(enrolled)
+    compacted = build_gallery_data({
+        name: compact_encodings(encodings, max_prototypes, dedup_distance, seed) for name, encodings in enrolled.items()
+    })
+    report = {
+        "identities": len(raw),
+        "raw_encodings": len(raw.encodings),
+        "compacted_encodings": len(compacted.encodings),
+        "probes": len(probes),
+    }
+    if not probes:
+        return report
+
+    names = [name for name, _ in probes]
+    queries = np.stack([encoding for _, encoding in probes])
+    results = {}
+    for key, data in (("raw", raw), ("compacted", compacted)):
+        data.match(queries[:1], tolerance)
+        start = time.perf_counter()
+        results[key] = data.match(queries, tolerance)
+        report[f"{key}_match_ms"] = (time.perf_counter() - start) * 1000
+        report[f"{key}_accuracy"] = float(np.mean([
+            match.known and match.name == name for match, name in zip(results[key], names)
+        ]))
+    report["agreement"] = float(np.mean([
+        (a.name if a.known else None) == (b.name if b.known else None)
+        for a, b in zip(results["raw"], results["compacted"])
+    ]))
+    report["speedup"] = report["raw_match_ms"] / max(report["compacted_match_ms"], 1e-9)
+    return report
+
+
+def compact_face_dir(face_dir=FACE_DIR, max_prototypes=MAX_PROTOTYPES, dedup_distance=DEDUP_DISTANCE, dry_run=False):
+    faces = Gallery(face_dir).load().as_dict()
+
+    report = evaluate_compaction(faces, max_prototypes, dedup_distance)
+    print(f"[INFO] {report['identities']} identities: {report['raw_encodings']} encodings "
+          f"-> {report['compacted_encodings']} prototypes")
+    if report["probes"]:
+        print(f"[INFO] Held-out accuracy raw {report['raw_accuracy']:.3f}, compacted {report['compacted_accuracy']:.3f}, "
+              f"agreement {report['agreement']:.3f} over {report['probes']} probes")
+        print(f"[INFO] Match time raw {report['raw_match_ms']:.2f} ms, compacted {report['compacted_match_ms']:.2f} ms "
+              f"({report['speedup']:.1f}x)")
+
+    if dry_run:
+        return report
+    # Compacted prototypes are written to the store, where they supersede a legacy *_data.npy file;
+    # the file itself is left alone.
+    store = GalleryStore(face_dir)
+    compacted = {}
+    for name, encodings in faces.items():
+        prototypes = compact_encodings(encodings, max_prototypes, dedup_distance)
+        if len(prototypes) < len(encodings):
+            compacted[name] = prototypes
+            print(f"[INFO] Compacted {name}: {len(encodings)} -> {len(prototypes)} encodings")
+    if compacted:
+        store.append_many(compacted)
+        invalidate_galleries(face_dir)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collapse per-frame face encodings into per-person prototypes")
+    parser.add_argument("--face-dir", default=FACE_DIR)
+    parser.add_argument("--max-prototypes", type=max_prototypes_arg, default=MAX_PROTOTYPES,
+                        help="0 or none: no compaction")
+    parser.add_argument("--dedup-distance", type=float, default=DEDUP_DISTANCE)
+    parser.add_argument("--dry-run", action="store_true", help="only report accuracy parity and speedup")
+    args = parser.parse_args()
+    compact_face_dir(args.face_dir, args.max_prototypes, args.dedup_distance, args.dry_run)
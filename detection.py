@@ -0,0 +1,45 @@
+import os
+
+import cv2
+
+import metrics
+
+from detectors import get_detector
+
+# Detection runs on a copy resized by this factor; boxes are mapped back so encodings are still
+# computed on the full-resolution image. HOG cost scales with pixel count, so 0.5 is ~4x cheaper
+# on 1080p/4K frames at the price of missing faces smaller than ~80 px in the original.
+DETECTION_SCALE = float(os.environ.get("HELOS_DETECTION_SCALE", "1.0"))
+
+
+def check_detection_scale(scale):
+    # Checked where a scale enters (entry points, CLI flags) so a bad one fails before any work starts.
+    if not 0 < scale <= 1:
+        raise ValueError(f"detection scale must be greater than 0 and at most 1, got {scale}")
+    return scale
+
+
+def scale_locations(locations, scale, shape):
+    height, width = shape[:2]
+    scaled = []
+    for top, right, bottom, left in locations:
+        scaled.append((
+            max(0, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale))),
+        ))
+    return scaled
+
+
+def detect_faces(image, scale=DETECTION_SCALE, detector=None, rgb=False):
+    # detector: a backend name or detectors.DetectorConfig; None for the default backend.
+    check_detection_scale(scale)
+    backend = get_detector(detector)
+    if scale == 1.0:
+        with metrics.stage("detect"):
+            return backend.detect(image, rgb)
+    with metrics.stage("resize"):
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    with metrics.stage("detect"):
+        return scale_locations(backend.detect(small, rgb), scale, image.shape)
@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import models
+
+from gallery import FACE_DIR
+
+# Face detector backends. A DetectorConfig names the backend plus the dlib upsample count and the
+# encoding num_jitters; it is a plain tuple, so it travels to worker processes, and get_detector()
+# builds (and caches) the backend in whichever process needs it.
+#
+#   hog   dlib HOG, the face_recognition default; CPU, moderate speed
+#   cnn   dlib CNN (mmod); most accurate, very slow without CUDA
+#   haar  OpenCV Haar cascade from cv2.data.haarcascades; fastest, least accurate
+#   dnn   OpenCV DNN: YuNet (.onnx, cv2.FaceDetectorYN) or a Caffe/TensorFlow SSD such as res10_300x300;
+#         the model files are not shipped with opencv-python, point HELOS_DNN_MODEL (and
+#         HELOS_DNN_CONFIG for an SSD) at them
+#
+# The default is HELOS_DETECTOR, else what `python detectors.py calibrate` picked for this machine
+# (saved in CALIBRATION_FILE), else hog.
+BACKENDS = ("hog", "cnn", "haar", "dnn")
+UPSAMPLE = int(os.environ.get("HELOS_UPSAMPLE", "1"))
+NUM_JITTERS = int(os.environ.get("HELOS_NUM_JITTERS", "1"))
+CALIBRATION_FILE = os.path.join(FACE_DIR, ".detector.json")
+HAAR_CASCADE = "haarcascade_frontalface_default.xml"
+DNN_MODEL = os.environ.get("HELOS_DNN_MODEL")
+DNN_CONFIG = os.environ.get("HELOS_DNN_CONFIG")
+DNN_CONFIDENCE = 0.6
+DNN_INPUT_SIZE = (300, 300)
+IOU_HIT = 0.5
+RECALL_TARGET = 0.9
+
+
+class DetectorConfig(namedtuple("DetectorConfig", ["backend", "upsample", "num_jitters"])):
+    # upsample only applies to the dlib backends; num_jitters is passed to face_encodings.
+
+    def params(self):
+        # What detections and encodings depend on, for encoding cache keys.
+        return {"detector": self.backend, "upsample": self.upsample, "num_jitters": self.num_jitters}
+
+
+# Backends have detect(image, rgb=False) -> [(top, right, bottom, left)]; rgb says the image is RGB
+# (face_recognition.load_image_file) rather than BGR (OpenCV).
+
+
+class DlibDetector:
+    def __init__(self, model="hog", upsample=1):
+        self.model = model
+        self.upsample = upsample
+
+    def detect(self, image, rgb=False):
+        return models.face_locations(image, self.upsample, self.model)
+
+
+def _boxes(rectangles, shape):
+    # (x, y, w, h) rectangles to clipped (top, right, bottom, left) boxes.
+    height, width = shape[:2]
+    return [(max(0, int(y)), min(width, int(x + w)), min(height, int(y + h)), max(0, int(x)))
+            for x, y, w, h in rectangles]
+
+
+class HaarDetector:
+    # CascadeClassifier is not safe to share between threads, so each thread loads its own.
+
+    def __init__(self, cascade_path=None, scale_factor=1.1, min_neighbors=5, min_size=(30, 30)):
+        self.cascade_path = cascade_path or os.path.join(cv2.data.haarcascades, HAAR_CASCADE)
+        if not os.path.isfile(self.cascade_path):
+            raise ValueError(f"Haar cascade not found at {self.cascade_path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self._local = threading.local()
+
+    def detect(self, image, rgb=False):
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.cascade_path)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        gray = cv2.equalizeHist(gray)
+        rectangles = cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors, minSize=self.min_size)
+        return _boxes(rectangles, image.shape)
+
+
+class DNNDetector:
+    # One network per thread, like HaarDetector. The networks expect BGR, as from cv2.imread.
+
+    def __init__(self, model_path=None, config_path=None, confidence=DNN_CONFIDENCE):
+        self.model_path = model_path or DNN_MODEL
+        self.config_path = config_path or DNN_CONFIG
+        if not self.model_path or not os.path.isfile(self.model_path):
+            raise ValueError("the dnn detector needs a model file; set HELOS_DNN_MODEL")
+        self.yunet = self.model_path.endswith(".onnx") and hasattr(cv2, "FaceDetectorYN")
+        self.confidence = confidence
+        self._local = threading.local()
+
+    def _net(self):
+        net = getattr(self._local, "net", None)
+        if net is None:
+            if self.yunet:
+                net = cv2.FaceDetectorYN.create(self.model_path, "", (320, 320), self.confidence)
+            else:
+                net = cv2.dnn.readNet(self.model_path, self.config_path or "")
+            self._local.net = net
+        return net
+
+    def detect(self, image, rgb=False):
+        net = self._net()
+        if rgb:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        height, width = image.shape[:2]
+        if self.yunet:
+            net.setInputSize((width, height))
+            _, faces = net.detect(image)
+            return _boxes([] if faces is None else faces[:, :4], image.shape)
+        net.setInput(cv2.dnn.blobFromImage(image, 1.0, DNN_INPUT_SIZE, (104.0, 177.0, 123.0)))
+        detections = net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.confidence]
+        corners = detections[:, 3:7] * np.array([width, height, width, height])
+        return _boxes([(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in corners], image.shape)
+
+
+def _build(config):
+    if config.backend in ("hog", "cnn"):
+        return DlibDetector(config.backend, config.upsample)
+    if config.backend == "haar":
+        return HaarDetector()
+    if config.backend == "dnn":
+        return DNNDetector()
+    raise ValueError(f"unknown detector backend {config.backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+_default = None
+
+
+def default_config():
+    global _default
+    if _default is None:
+        backend = os.environ.get("HELOS_DETECTOR")
+        upsample = UPSAMPLE
+        if backend is None and os.path.isfile(CALIBRATION_FILE):
+            try:
+                with open(CALIBRATION_FILE) as f:
+                    calibrated = json.load(f)
+                backend, upsample = calibrated["backend"], calibrated["upsample"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[WARNING] Ignoring {CALIBRATION_FILE}. Error: {e}")
+        _default = DetectorConfig(backend or "hog", upsample, NUM_JITTERS)
+    return _default
+
+
+def detector_config(detector=None, upsample=None, num_jitters=None):
+    # detector: None for the default, a backend name or a DetectorConfig; upsample and num_jitters
+    # override what it says.
+    if detector is None:
+        config = default_config()
+    elif isinstance(detector, DetectorConfig):
+        config = detector
+    else:
+        config = default_config()._replace(backend=detector)
+    if upsample is not None:
+        config = config._replace(upsample=upsample)
+    if num_jitters is not None:
+        config = config._replace(num_jitters=num_jitters)
+    return config
+
+
+def get_detector(detector=None):
+    config = detector_config(detector)
+    key = (config.backend, config.upsample)
+    with _detectors_lock:
+        backend = _detectors.get(key)
+        if backend is None:
+            backend = _detectors[key] = _build(config)
+    return backend
+
+
+def available_backends():
+    found = []
+    for backend in BACKENDS:
+        try:
+            _build(DetectorConfig(backend, 1, 1))
+        except (ValueError, cv2.error):
+            continue
+        found.append(backend)
+    return found
+
+
+def _recall(reference, detections):
+    from tracking import iou
+
+    hits = sum(any(iou(box, found) >= IOU_HIT for found in detections) for box in reference)
+    return hits, len(reference)
+
+
+def calibrate(images, candidates, reference, recall_target=RECALL_TARGET):
+    # Times every candidate config on the images and measures its recall against the reference
+    # backend's detections. Returns (rows, chosen): rows are (config, ms per image, recall), and
+    # chosen is the fastest config whose recall meets the target (the reference itself otherwise).
+    reference_detector = _build(reference)
+    expected = [reference_detector.detect(image) for image in images]
+    rows = []
+    for config in candidates:
+        detector = _build(config)
+        detector.detect(images[0])
+        hits = total = 0
+        start = time.perf_counter()
+        found = [detector.detect(image) for image in images]
+        ms = (time.perf_counter() - start) * 1000 / len(images)
+        for boxes, detections in zip(expected, found):
+            image_hits, image_total = _recall(boxes, detections)
+            hits += image_hits
+            total += image_total
+        rows.append((config, ms, hits / total if total else 1.0))
+    passing = [row for row in rows if row[2] >= recall_target]
+    chosen = min(passing, key=lambda row: row[1])[0] if passing else reference
+    return rows, chosen
+
+
+def save_calibration(config, path=CALIBRATION_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"backend": config.backend, "upsample": config.upsample}, f)
+
+
+def run_calibration(image_dir, recall_target=RECALL_TARGET, reference="cnn", backends=None, upsamples=(0, 1),
+                    limit=50, save=True):
+    from batch_recognition import list_images
+
+    images = [image for image in (cv2.imread(path) for path in list_images(image_dir)[:limit]) if image is not None]
+    if not images:
+        print(f"[ERROR] No images found in {image_dir}")
+        return None
+    backends = backends or available_backends()
+    candidates = []
+    for backend in backends:
+        for upsample in (upsamples if backend in ("hog", "cnn") else (1,)):
+            candidates.append(DetectorConfig(backend, upsample, NUM_JITTERS))
+    reference = DetectorConfig(reference, max(upsamples), NUM_JITTERS)
+    print(f"[INFO] Calibrating {len(candidates)} detectors on {len(images)} images against {reference.backend} "
+          f"(upsample {reference.upsample}); recall target {recall_target:.0%}...")
+    rows, chosen = calibrate(images, candidates, reference, recall_target)
+    print(f"{'backend':>8} {'upsample':>9} {'ms/image':>10} {'recall':>8}")
+    for config, ms, recall in sorted(rows, key=lambda row: row[1]):
+        marker = " <" if config == chosen else ""
+        print(f"{config.backend:>8} {config.upsample:>9} {ms:>10.1f} {recall:>8.3f}{marker}")
+    print(f"[INFO] Fastest detector meeting the target: {chosen.backend} (upsample {chosen.upsample}).")
+    if save:
+        save_calibration(chosen)
+        print(f"[INFO] Saved to {CALIBRATION_FILE}; it is the default from now on unless HELOS_DETECTOR is set.")
+    return chosen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Face detector backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = commands.add_parser("calibrate", help="pick the fastest backend that meets a recall target")
+    calibrate_parser.add_argument("image_dir", help="sample images from this deployment")
+    calibrate_parser.add_argument("--recall", type=float, default=RECALL_TARGET)
+    calibrate_parser.add_argument("--reference", choices=BACKENDS, default="cnn",
+                                  help="backend whose detections count as ground truth")
+    calibrate_parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=None,
+                                  help="default: every backend available here")
+    calibrate_parser.add_argument("--upsample", type=int, nargs="+", default=[0, 1])
+    calibrate_parser.add_argument("--limit", type=int, default=50)
+    calibrate_parser.add_argument("--dry-run", action="store_true", help="do not save the choice")
+    commands.add_parser("list", help="show the backends available here and the default")
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        run_calibration(args.image_dir, args.recall, args.reference, args.backends, args.upsample, args.limit,
+                        save=not args.dry_run)
+    else:
+        print(f"[INFO] Available: {', '.join(available_backends())}; default: {default_config()}")
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+import metrics
+
+from gallery import ENCODING_SIZE, FACE_DIR
+
+CACHE_SUBDIR = ".cache"
+CACHE_DIR = os.path.join(FACE_DIR, CACHE_SUBDIR)
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Evictions trim the cache down to this fraction of max_bytes so they do not run on every write.
+EVICT_TO = 0.9
+# Bump when the stored layout changes so stale entries are never read back.
+CACHE_VERSION = 1
+
+# What the encodings depend on besides the image bytes. face_recognition.load_image_file gives RGB
+# while cv2.imread/imdecode give BGR, and the two produce different encodings for the same file.
+RGB_PARAMS = {"detector": "hog", "upsample": 1, "num_jitters": 1, "landmarks": "small", "channels": "rgb"}
+BGR_PARAMS = dict(RGB_PARAMS, channels="bgr")
+
+
+class EncodingCache:
+    # On-disk cache of face locations and encodings keyed by image content hash + model parameters.
+    # Entries live in <cache_dir>/<2 hex>/<sha256>.npz; hits bump the file mtime so eviction is LRU.
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, content, params):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([CACHE_VERSION, params], sort_keys=True).encode())
+        digest.update(content)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                result = [tuple(location) for location in entry["locations"].tolist()], list(entry["encodings"])
+            os.utime(path)
+        except (OSError, ValueError, KeyError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, locations, encodings):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                locations=np.asarray(locations, dtype=np.int32).reshape(-1, 4),
+                encodings=np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE),
+            )
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.writes += 1
+            if self._size is None:
+                self._size = self._disk_usage()[0]
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        with os.scandir(self.cache_dir) as shards:
+            for shard in shards:
+                if shard.is_dir():
+                    with os.scandir(shard.path) as entries:
+                        for entry in entries:
+                            if entry.name.endswith(".npz"):
+                                yield entry
+
+    def _disk_usage(self):
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return sum(size for _, size, _ in entries), entries
+
+    def _evict(self):
+        # Several processes may share the directory, so re-measure instead of trusting self._size.
+        self._size, entries = self._disk_usage()
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in sorted(entries):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evictions += 1
+
+    def clear(self):
+        for entry in list(self._entries()):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+def cached_faces(cache, content, params, compute):
+    # compute() -> (locations, encodings) only runs on a miss. Returns (locations, encodings, hit).
+    key = cache.key(content, params)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.increment("encoding_cache_total", result="hit")
+        return cached[0], cached[1], True
+    metrics.increment("encoding_cache_total", result="miss")
+    locations, encodings = compute()
+    cache.put(key, locations, encodings)
+    return locations, encodings, False
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_encoding_cache(cache_dir=CACHE_DIR):
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = EncodingCache(cache_dir)
+    return cache
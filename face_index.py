@@ -0,0 +1,323 @@
+import numpy as np
+
+from gallery import ENCODING_SIZE, TOLERANCE, Match, build_gallery_data, empty_gallery_data, pairwise_sq_distances
+
+# Rows per distance block when assigning vectors to IVF centroids.
+ASSIGN_BATCH = 65536
+
+
+def _as_matrix(encodings):
+    return np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE))
+
+
+def _matches_from_candidates(sq_distances, label_ids, names, tolerance):
+    # Nearest and runner-up *identity* among a bag of candidate vectors.
+    if not len(sq_distances):
+        return Match(None, np.inf, np.inf, False)
+    order = np.lexsort((sq_distances, label_ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = label_ids[order[1:]] != label_ids[order[:-1]]
+    per_identity = order[first]
+    best = per_identity[np.argsort(sq_distances[per_identity])[:2]]
+    distance = float(np.sqrt(sq_distances[best[0]]))
+    second = float(np.sqrt(sq_distances[best[1]])) if len(best) > 1 else np.inf
+    return Match(names[label_ids[best[0]]], distance, second - distance, distance <= tolerance)
+
+
+class ExactIndex:
+    # Brute force over every stored vector; the reference the approximate indexes are measured against.
+
+    def __init__(self):
+        self._faces = {}
+        self._data = empty_gallery_data()
+        self._dirty = False
+
+    def __len__(self):
+        return sum(len(encodings) for encodings in self._faces.values())
+
+    def add(self, name, encodings):
+        self._faces[name] = _as_matrix(encodings)
+        self._dirty = True
+
+    def remove(self, name):
+        if self._faces.pop(name, None) is not None:
+            self._dirty = True
+
+    def prepare(self):
+        if self._dirty:
+            self._data = build_gallery_data(self._faces)
+            self._dirty = False
+
+    def match(self, face_encodings, tolerance=TOLERANCE):
+        self.prepare()
+        return self._data.match(face_encodings, tolerance)
+
+
+class _IdentityIds:
+    # Stable small-integer ids for identity names so candidates can be grouped with NumPy.
+
+    def __init__(self):
+        self.names = []
+        self._ids = {}
+        self._free_ids = []
+
+    def _identity_id(self, name):
+        label_id = self._ids.get(name)
+        if label_id is None:
+            if self._free_ids:
+                label_id = self._free_ids.pop()
+                self.names[label_id] = name
+            else:
+                label_id = len(self.names)
+                self.names.append(name)
+            self._ids[name] = label_id
+        return label_id
+
+    def _release_id(self, name):
+        label_id = self._ids.pop(name)
+        self.names[label_id] = None
+        self._free_ids.append(label_id)
+        return label_id
+
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points so every list stays usable.
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+    return centroids
+
+
+def assign(vectors, centroids):
+    sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BATCH):
+        block = vectors[start:start + ASSIGN_BATCH]
+        assignment[start:start + len(block)] = np.argmin(pairwise_sq_distances(block, centroids, sq_norms), axis=1)
+    return assignment
+
+
+class IVFIndex(_IdentityIds):
+    # Inverted-file index: vectors are bucketed by nearest k-means centroid and a query only scans
+    # the nprobe closest buckets. Below min_train_size vectors it stays a single bucket (exact search).
+    # The quantizer is retrained once the index has grown retrain_factor times since the last training;
+    # training is deferred to the next search so a bulk load does not retrain over and over.
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=4096, retrain_factor=4, seed=0):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self._faces = {}
+        self._identity_lists = {}
+        self._centroids = None
+        self._trained_size = 0
+        # Each list keeps appended (vectors, label_ids) chunks that are concatenated on first search.
+        self._lists = [[]]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _append(self, vectors, label_ids):
+        # Returns the ids of the lists the vectors landed in.
+        if self._centroids is None:
+            self._lists[0].append((vectors, label_ids))
+            return [0]
+        assignment = assign(vectors, self._centroids)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self._centroids) + 1))
+        touched = np.flatnonzero(np.diff(bounds))
+        for list_id in touched:
+            rows = order[bounds[list_id]:bounds[list_id + 1]]
+            self._lists[list_id].append((vectors[rows], label_ids[rows]))
+        return touched.tolist()
+
+    def add(self, name, encodings):
+        self.remove(name)
+        vectors = _as_matrix(encodings)
+        if not len(vectors):
+            return
+        label_ids = np.full(len(vectors), self._identity_id(name), dtype=np.int32)
+        self._faces[name] = vectors
+        self._size += len(vectors)
+        self._identity_lists[name] = self._append(vectors, label_ids)
+
+    def remove(self, name):
+        vectors = self._faces.pop(name, None)
+        if vectors is None:
+            return
+        label_id = self._release_id(name)
+        self._size -= len(vectors)
+        for list_id in self._identity_lists.pop(name):
+            list_vectors, label_ids = self._consolidate(list_id)
+            keep = label_ids != label_id
+            self._lists[list_id] = [(list_vectors[keep], label_ids[keep])]
+
+    def _needs_training(self):
+        if self._size < self.min_train_size:
+            return False
+        return self._centroids is None or self._size >= self._trained_size * self.retrain_factor
+
+    def train(self):
+        vectors = np.concatenate(list(self._faces.values()))
+        label_ids = np.concatenate([
+            np.full(len(encodings), self._ids[name], dtype=np.int32) for name, encodings in self._faces.items()
+        ])
+        nlist = min(self.nlist or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 40), replace=False)]
+        self._centroids = kmeans(sample, nlist, seed=self.seed)
+        self._trained_size = len(vectors)
+        self._lists = [[] for _ in range(nlist)]
+        self._append(vectors, label_ids)
+
+        self._identity_lists = {name: [] for name in self._faces}
+        for list_id, chunks in enumerate(self._lists):
+            if chunks:
+                for label_id in np.unique(chunks[0][1]):
+                    self._identity_lists[self.names[label_id]].append(list_id)
+
+    def _consolidate(self, list_id):
+        chunks = self._lists[list_id]
+        if not chunks:
+            return np.empty((0, ENCODING_SIZE), dtype=np.float32), np.empty(0, dtype=np.int32)
+        if len(chunks) > 1:
+            chunks[:] = [(np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks]))]
+        return chunks[0]
+
+    def _probe(self, queries):
+        if self._centroids is None:
+            return np.zeros((len(queries), 1), dtype=np.int64)
+        nprobe = min(self.nprobe, len(self._centroids))
+        distances = pairwise_sq_distances(queries, self._centroids)
+        return np.argpartition(distances, nprobe - 1, axis=1)[:, :nprobe]
+
+    def prepare(self):
+        if self._needs_training():
+            self.train()
+        for list_id in range(len(self._lists)):
+            self._consolidate(list_id)
+
+    def match(self, face_encodings, tolerance=TOLERANCE):
+        if not len(face_encodings):
+            return []
+        self.prepare()
+        queries = _as_matrix(face_encodings)
+        matches = []
+        for query, list_ids in zip(queries, self._probe(queries)):
+            lists = [self._consolidate(list_id) for list_id in list_ids]
+            vectors = np.concatenate([vectors for vectors, _ in lists])
+            label_ids = np.concatenate([label_ids for _, label_ids in lists])
+            sq_distances = pairwise_sq_distances(query, vectors)[0]
+            matches.append(_matches_from_candidates(sq_distances, label_ids, self.names, tolerance))
+        return matches
+
+
+class HNSWIndex(_IdentityIds):
+    # Graph index backed by the optional hnswlib package (pip install hnswlib).
+    # k nearest vectors are fetched per query and then reduced to the two nearest identities.
+
+    def __init__(self, m=16, ef_construction=200, ef=64, k=32, initial_capacity=1024):
+        import hnswlib
+
+        super().__init__()
+        self.ef = ef
+        self.k = k
+        self._index = hnswlib.Index(space="l2", dim=ENCODING_SIZE)
+        self._index.init_index(
+            max_elements=initial_capacity, ef_construction=ef_construction, M=m, allow_replace_deleted=True
+        )
+        # knn_query needs ef >= k.
+        self._index.set_ef(max(ef, k))
+        self._rows = {}
+        self._row_labels = np.empty(initial_capacity, dtype=np.int32)
+        self._next_row = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, name, encodings):
+        self.remove(name)
+        vectors = _as_matrix(encodings)
+        if not len(vectors):
+            return
+        needed = self._index.get_current_count() + len(vectors)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        rows = np.arange(self._next_row, self._next_row + len(vectors))
+        self._next_row += len(vectors)
+        if self._next_row > len(self._row_labels):
+            self._row_labels = np.resize(self._row_labels, max(self._next_row, 2 * len(self._row_labels)))
+        self._row_labels[rows] = self._identity_id(name)
+        self._index.add_items(vectors, rows, replace_deleted=True)
+        self._rows[name] = rows
+        self._size += len(rows)
+
+    def remove(self, name):
+        rows = self._rows.pop(name, None)
+        if rows is None:
+            return
+        for row in rows:
+            self._index.mark_deleted(int(row))
+        self._release_id(name)
+        self._size -= len(rows)
+
+    def prepare(self):
+        pass
+
+    def match(self, face_encodings, tolerance=TOLERANCE):
+        if not len(face_encodings):
+            return []
+        if not self._size:
+            return [Match(None, np.inf, np.inf, False) for _ in range(len(face_encodings))]
+        # Deleted rows still count towards get_current_count(); never ask for more than the live ones.
+        k = min(self.k, self._size)
+        while True:
+            try:
+                rows, sq_distances = self._index.knn_query(_as_matrix(face_encodings), k=k)
+                break
+            except RuntimeError:
+                # Deletions can leave too few reachable live rows for k results; the nearest one is enough.
+                if k == 1:
+                    raise
+                k = max(1, k // 2)
+        return [
+            _matches_from_candidates(row_distances.astype(np.float32), self._row_labels[row_ids], self.names, tolerance)
+            for row_ids, row_distances in zip(rows, sq_distances)
+        ]
+
+
+def _sharded_index(**options):
+    # Imported on demand, like hnswlib; gallery_shards starts processes and opens sockets.
+    from gallery_shards import ShardedIndex
+
+    return ShardedIndex(**options)
+
+
+INDEX_TYPES = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+    "hnsw": HNSWIndex,
+    "sharded": _sharded_index,
+}
+
+
+def make_index(kind, **options):
+    try:
+        index_type = INDEX_TYPES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown gallery index {kind!r}. Choose one of: {', '.join(INDEX_TYPES)}")
+    return index_type(**options)
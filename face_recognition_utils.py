@@ -1,213 +1,285 @@
 import cv2
-import dlib
-import numpy as np
 import os
-import face_recognition
+from collections import namedtuple
 
+import metrics
+import models
+from batch_recognition import FaceResult, annotate, recognize_images, warm_worker
+from compaction import MAX_PROTOTYPES, compact_encodings
+from detection import DETECTION_SCALE, detect_faces
+from detectors import detector_config
+from frame_gate import GATE_ENABLED, make_gate
+from gallery import FACE_DIR, TOLERANCE, build_gallery_data, get_gallery, load_encodings_file
+from gallery_store import save_face_data
+from rendering import WindowSink, draw_boxes, draw_faces, draw_status
 
+# Imported by app.py and main.py, so the modules only one entry point needs (stream_engine with
+# asyncio, the process pool machinery, bulk_enroll, tracking, video_pipeline) are imported where used.
+
+# Frames captured by a headless capture_face_data when max_frames is not given.
+HEADLESS_CAPTURE_FRAMES = 150
+# (workers, pool) of video_executor().
+_video_executor = (None, None)
+
+VideoFrame = namedtuple("VideoFrame", ["number", "frame", "faces"])
 
-FACE_DIR = "./faces"
 if not os.path.exists(FACE_DIR):
     os.makedirs(FACE_DIR)
 
 def load_known_faces():
-    known_faces = {}
-    for filename in os.listdir(FACE_DIR):
-        if filename.endswith('_data.npy'):
-            encodings = np.load(os.path.join(FACE_DIR, filename), allow_pickle=True)
-            known_faces[filename.split('_')[0]] = encodings
-    return known_faces
-
-
-
-def capture_face_data(name):
+    return get_gallery(FACE_DIR).load().as_dict()
+
+
+def label_faces(face_encodings, matcher, tolerance=TOLERANCE):
+    # matcher: a Gallery, GalleryData or face_index index; anything with .match().
+    return [match.name if match.known else "Unknown" for match in matcher.match(face_encodings, tolerance)]
+
+
+
+
+def iter_capture_frames(source=0, detection_scale=DETECTION_SCALE, gate=None, detector=None):
+    # Yields (frame, face_locations, face_encodings) for every frame of the source; frames the gate
+    # (a frame_gate.FrameGate) skips come with no faces, and only the faces it accepts are encoded.
+    from stream_engine import open_capture
+
+    config = detector_config(detector)
+    cap = open_capture(source)
+    try:
+        while True:
+            with metrics.stage("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                print("[ERROR] Failed to capture frame!")
+                return
+            if gate is not None and gate.check(frame):
+                yield frame, [], []
+                continue
+            face_locations = detect_faces(frame, detection_scale, config)
+            metrics.observe("faces_per_frame", len(face_locations), metrics.COUNT_BUCKETS)
+            if gate is not None:
+                face_locations = gate.filter_faces(frame, face_locations)
+            yield frame, face_locations, models.face_encodings(frame, face_locations, config.num_jitters)
+    finally:
+        cap.release()
+
+
+def capture_face_data(name, max_prototypes=MAX_PROTOTYPES, detection_scale=DETECTION_SCALE, headless=False,
+                      max_frames=None, source=0, gate=GATE_ENABLED, detector=None):
+    # Headless capture has no q key to stop it: it ends after max_frames (HEADLESS_CAPTURE_FRAMES by
+    # default), at the end of the source, or on Ctrl-C. The frame gate keeps blurred frames and faces,
+    # and repeats of a still scene, out of the saved encodings.
     print(f"[INFO] Starting face data capture for {name}...")
-    cap = cv2.VideoCapture(0)
+    metrics.increment("calls_total", entry="capture_face_data")
+    if headless and max_frames is None:
+        max_frames = HEADLESS_CAPTURE_FRAMES
+    sink = None if headless else WindowSink(f"Face Data Collection for {name}")
     all_encodings = []
+    frame_gate = make_gate(gate)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[ERROR] Failed to capture frame!")
-            break
-
-        face_locations = face_recognition.face_locations(frame)
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
-
-        for face_encoding in face_encodings:
-            all_encodings.append(face_encoding)
-            for (top, right, bottom, left) in face_locations:
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-
-        cv2.imshow(f"Face Data Collection for {name}", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
+    frames = iter_capture_frames(source, detection_scale, frame_gate, detector)
+    try:
+        for number, (frame, face_locations, face_encodings) in enumerate(frames, 1):
+            all_encodings.extend(face_encodings)
+            if sink is not None and sink.show(draw_boxes(frame, face_locations)):
+                break
+            if max_frames is not None and number >= max_frames:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frames.close()
+        if sink is not None:
+            sink.close()
+    if frame_gate is not None:
+        print(f"[INFO] The {frame_gate.summary()}.")
 
     if not all_encodings:
+        if headless:
+            print("[ERROR] No face data captured.")
+            return None
         print("[ERROR] No face data captured. Trying again...")
-        capture_face_data(name)
-        return
-
-    data_path = os.path.join(FACE_DIR, f"{name}_data.npy")
-    np.save(data_path, all_encodings)
-    print(f"[INFO] Face data for {name} captured and saved as {data_path}!")
-
+        return capture_face_data(name, max_prototypes, detection_scale, headless, max_frames, source, gate, detector)
+
+    prototypes = compact_encodings(all_encodings, max_prototypes)
+    print(f"[INFO] Compacted {len(all_encodings)} captured encodings into {len(prototypes)} prototypes.")
+    save_face_data(name, prototypes, FACE_DIR)
+    print(f"[INFO] Face data for {name} captured and saved to the gallery in {FACE_DIR}!")
+    return prototypes
+
+
+def iter_face_video(source=0, tracker=None, max_frames=None, gate=None):
+    # Yields a VideoFrame per frame with the tracker's labelled faces; frame is the raw BGR image.
+    # Frames the gate (a frame_gate.FrameGate) skips are not detected on, only tracked.
+    from stream_engine import open_capture
+    from tracking import FaceTracker
+
+    tracker = tracker or FaceTracker(get_gallery(FACE_DIR))
+    cap = open_capture(source)
+    try:
+        number = 0
+        while max_frames is None or number < max_frames:
+            with metrics.stage("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                print("[ERROR] Failed to capture frame!")
+                return
+            number += 1
+            skipped = gate is not None and gate.check(frame)
+            faces = [FaceResult(location, label, None, label != "Unknown")
+                     for location, label in tracker.process(frame, detect=not skipped)]
+            metrics.observe("faces_per_frame", len(faces), metrics.COUNT_BUCKETS)
+            yield VideoFrame(number, frame, faces)
+    finally:
+        cap.release()
+
+
+def recognize_face_video(tracking=True, detect_every=None, reverify_every=None,
+                          detection_scale=DETECTION_SCALE, source=0, headless=False, max_frames=None,
+                          on_frame=None, gate=GATE_ENABLED, detector=None):
+    # source: camera index, stream URL or video file. For many sources at once use stream_engine.py.
+    # Headless runs skip all drawing; on_frame(video_frame) receives every frame's results either way.
+    # detect_every and reverify_every default to tracking.DETECT_EVERY and REVERIFY_EVERY.
+    from tracking import DETECT_EVERY, REVERIFY_EVERY, FaceTracker
 
-def recognize_face_video():
     print("[INFO] Starting face recognition in video stream...")
-
-    known_faces = {}
-    for filename in os.listdir(FACE_DIR):
-        if filename.endswith('_data.npy'):
-            encodings = np.load(os.path.join(FACE_DIR, filename), allow_pickle=True)
-            known_faces[filename.split('_')[0]] = encodings
-
-    cap = cv2.VideoCapture(0)
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[ERROR] Failed to capture frame!")
-            break
-
-        face_locations = face_recognition.face_locations(frame)
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
-
-        for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-            label = "Unknown"
-            for name, known_face_encodings in known_faces.items():
-                matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                if True in matches:
-                    label = name
+    metrics.increment("calls_total", entry="recognize_face_video")
+
+    # Without tracking every frame is detected and encoded, as before.
+    if not tracking:
+        detect_every = reverify_every = 1
+    detect_every = detect_every or DETECT_EVERY
+    reverify_every = reverify_every or REVERIFY_EVERY
+    frame_gate = make_gate(gate)
+    tracker = FaceTracker(get_gallery(FACE_DIR), detect_every, reverify_every, detection_scale=detection_scale,
+                          gate=frame_gate, detector=detector)
+    sink = None if headless else WindowSink("Face Recognition")
+
+    frames = iter_face_video(source, tracker, max_frames, frame_gate)
+    try:
+        for video_frame in frames:
+            if on_frame is not None:
+                on_frame(video_frame)
+            if sink is not None:
+                draw_faces(video_frame.frame, video_frame.faces)
+                draw_status(video_frame.frame, f"{tracker.fps:.1f} FPS, detection duty {tracker.duty_cycle:.0%}")
+                if sink.show(video_frame.frame):
                     break
-
-            cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-
-        cv2.imshow("Face Recognition", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
-
-def recognize_face_in_image_stream(image_array):
-    # Load known face encodings
-    known_faces = {}
-    for filename in os.listdir(FACE_DIR):
-        if filename.endswith('_data.npy'):
-            encodings = np.load(os.path.join(FACE_DIR, filename), allow_pickle=True)
-            known_faces[filename.split('_')[0]] = encodings
-
-    # Decode the image array to OpenCV format
-    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-
-    # Detect faces
-    face_locations = face_recognition.face_locations(image)
-    face_encodings = face_recognition.face_encodings(image, face_locations)
-
-    # Annotate faces
-    for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-        label = "Unknown"
-        for name, known_face_encodings in known_faces.items():
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            if True in matches:
-                label = name
-                break
-
-        cv2.putText(image, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
-        cv2.rectangle(image, (left, top), (right, bottom), (0, 0, 255), 3)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frames.close()
+        if sink is not None:
+            sink.close()
+
+    stats = tracker.stats()
+    print(f"[INFO] {stats['frames']} frames at {stats['fps']:.1f} FPS, detection ran on "
+          f"{stats['duty_cycle']:.0%} of frames, {stats['encodings']} faces encoded.")
+    if frame_gate is not None:
+        stats["gate"] = frame_gate.stats()
+        print(f"[INFO] The {frame_gate.summary()}.")
+    return stats
+
+def recognize_faces_in_images(images, detection_scale=DETECTION_SCALE, workers=None, keep_images=False, gallery=None,
+                              detector=None):
+    # Many paths or encoded buffers at once; see batch_recognition.recognize_images.
+    metrics.increment("calls_total", entry="recognize_faces_in_images")
+    return recognize_images(images, gallery or get_gallery(FACE_DIR), detection_scale=detection_scale,
+                            workers=workers, keep_images=keep_images, detector=detector)
+
+
+def _recognize_one(image, detection_scale, gallery=None, detector=None):
+    result = recognize_faces_in_images([image], detection_scale, keep_images=True, gallery=gallery,
+                                       detector=detector)[0]
+    if result.error:
+        raise ValueError(f"Could not recognise faces in {result.source}: {result.error}")
+    return result
+
+
+def recognize_face_in_image_stream(image_array, detection_scale=DETECTION_SCALE, gallery=None, detector=None):
+    metrics.increment("calls_total", entry="recognize_face_in_image_stream")
+    result = _recognize_one(image_array, detection_scale, gallery, detector)
+    annotated = annotate(result.image, result.faces, box_color=(0, 0, 255), font_scale=1.2, thickness=3)
 
     # Convert back to RGB for display in Streamlit
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    return rgb_image
+    with metrics.stage("color_convert"):
+        return cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
 
 
-def recognize_face_in_image(image_path):
+def recognize_face_in_image(image_path, detection_scale=DETECTION_SCALE, headless=False, detector=None,
+                            box_color=(0, 255, 0), text_color=(255, 0, 0), font_scale=13):
     print(f"[INFO] Starting face recognition in image {image_path}...")
-
-    known_faces = {}
-    for filename in os.listdir(FACE_DIR):
-        if filename.endswith('_data.npy'):
-            encodings = np.load(os.path.join(FACE_DIR, filename), allow_pickle=True)
-            known_faces[filename.split('_')[0]] = encodings
-
-    image = cv2.imread(image_path)
-    face_locations = face_recognition.face_locations(image)
-    face_encodings = face_recognition.face_encodings(image, face_locations)
-
-    for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-        label = "Unknown"
-        for name, known_face_encodings in known_faces.items():
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            if True in matches:
-                label = name
-                break
-
-        cv2.putText(image, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 13, (255, 0, 0), 3)
-        cv2.rectangle(image, (left, top), (right, bottom), (0, 255, 0), 2)
-
-    cv2.imshow("Face Recognition in Image", image)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-
-
-def capture_face_data_from_folder(dir_path):
-    for subdir, _, files in os.walk(dir_path):
-        person_name = os.path.basename(subdir)
-        all_encodings = []
-
-        for file in files:
-            image_path = os.path.join(subdir, file)
-            try:
-                image = face_recognition.load_image_file(image_path)
-                face_encodings = face_recognition.face_encodings(image)
-
-                if not face_encodings:
-                    print(f"[WARNING] No faces found in {image_path}. Skipping...")
-                    continue
-
-                all_encodings.extend(face_encodings)
-            except Exception as e:
-                print(f"[ERROR] Error processing image {image_path}. Error: {e}")
-
-        if all_encodings:
-            data_path = os.path.join(FACE_DIR, f"{person_name}_data.npy")
-            np.save(data_path, all_encodings)
-            print(f"[INFO] Face data for {person_name} captured and saved as {data_path}!")
-
-def check_face_in_video(face_data_path, video_path):
-    print(f"[INFO] Loading face data from {face_data_path}")
-    known_face_encodings = np.load(face_data_path, allow_pickle=True)
-
-    print(f"[INFO] Opening video file {video_path}")
-    cap = cv2.VideoCapture(video_path)
-
-    frame_number = 0
-    while True:
-        ret, frame = cap.read()
-        frame_number += 1
-        if not ret:
-            print(f"[INFO] Reached end of video or failed to read frame {frame_number}. Exiting...")
-            break
-
-        print(f"[INFO] Processing frame {frame_number}")
-        frame_face_encodings = face_recognition.face_encodings(frame)
-
-        for encoding in frame_face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, encoding)
-            if True in matches:
-                print(f"[INFO] Face found in frame {frame_number}!")
-                cap.release()
-                cv2.destroyAllWindows()
-                return True
-
-    print("[INFO] Face not found in video.")
-    cap.release()
-    cv2.destroyAllWindows()
-    return False
+    metrics.increment("calls_total", entry="recognize_face_in_image")
+
+    if headless:
+        result = recognize_faces_in_images([image_path], detection_scale, detector=detector)[0]
+        if result.error:
+            raise ValueError(f"Could not recognise faces in {result.source}: {result.error}")
+        return result
+
+    result = _recognize_one(image_path, detection_scale, detector=detector)
+    annotated = annotate(result.image, result.faces, box_color=box_color, text_color=text_color,
+                         font_scale=font_scale, thickness=2)
+    sink = WindowSink("Face Recognition in Image", delay=0)
+    sink.show(annotated)
+    sink.close()
+    return result
+
+
+def capture_face_data_from_folder(dir_path, max_prototypes=MAX_PROTOTYPES, workers=None,
+                                  detection_scale=DETECTION_SCALE, detector=None):
+    # Encodes images across all cores, one person at a time, and resumes interrupted runs.
+    from bulk_enroll import enroll_from_folder
+
+    metrics.increment("calls_total", entry="capture_face_data_from_folder")
+    return enroll_from_folder(dir_path, FACE_DIR, max_prototypes, workers, detection_scale, detector)
+
+def video_executor(workers=None):
+    # One warm pool of encoder processes kept for every video check of this process, so a short clip
+    # does not pay for starting processes and loading the dlib models; None for a single worker.
+    global _video_executor
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return None
+    current_workers, pool = _video_executor
+    if pool is None or current_workers != workers:
+        if pool is not None:
+            pool.shutdown(wait=False)
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(workers, initializer=warm_worker)
+        _video_executor = (workers, pool)
+    return pool
+
+
+def check_face_in_video(face_data_path, video_path, detection_scale=DETECTION_SCALE, sample_every=1,
+                        start_time=None, end_time=None, workers=None, on_progress=None, gate=GATE_ENABLED,
+                        detector=None, executor=None):
+    # face_data_path is a legacy *_data.npy file or the name of an enrolled person. With the frame gate,
+    # frames identical to the last one scanned and blurred frames are not scanned. Without an executor
+    # the video_executor() pool is used.
+    from video_pipeline import scan_video
+
+    metrics.increment("calls_total", entry="check_face_in_video")
+    if os.path.isfile(face_data_path):
+        known_face_encodings = load_encodings_file(face_data_path)
+    else:
+        known_face_encodings = load_known_faces().get(face_data_path)
+        if known_face_encodings is None:
+            raise ValueError(f"{face_data_path} is neither a face data file nor an enrolled person")
+    gallery_data = build_gallery_data({face_data_path: known_face_encodings})
+
+    frame_gate = make_gate(gate)
+    result = scan_video(video_path, gallery_data, sample_every, start_time, end_time, workers, detection_scale,
+                        on_progress=on_progress, gate=frame_gate, detector=detector,
+                        executor=executor if executor is not None else video_executor(workers))
+    if frame_gate is not None:
+        print(f"[INFO] The {frame_gate.summary()}.")
+    if result:
+        print(f"[INFO] Face found in frame {result.frame_number} at {result.timestamp:.2f}s "
+              f"({result.frames_scanned} frames scanned in {result.seconds:.1f}s).")
+    else:
+        print(f"[INFO] Face not found in video ({result.frames_scanned} frames scanned in {result.seconds:.1f}s).")
+    return result
 
 
 
@@ -0,0 +1,177 @@
+import os
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import metrics
+
+# A cheap check run before HOG detection and encoding. Frames are skipped when nothing moved since the
+# last frame that went through ("static") or when they are motion-blurred ("blurry"). Both checks work
+# on a small grayscale copy, which costs well under a millisecond against tens of milliseconds for
+# detection. Optionally (HELOS_FRAME_GATE_FACES=1) detected faces are not encoded when they are too
+# small or blurred; on CCTV footage most faces are small. The gate trades recall for speed (a skipped
+# frame can be the only one showing someone), so it is off unless HELOS_FRAME_GATE=1 or asked for.
+GATE_ENABLED = os.environ.get("HELOS_FRAME_GATE", "0") == "1"
+CHECK_FACES = os.environ.get("HELOS_FRAME_GATE_FACES", "0") == "1"
+# Width of the grayscale copy the frame checks run on.
+GATE_WIDTH = 160
+# A pixel of the grayscale copy has moved when it changed by more than this (0-255), which is above
+# sensor noise once the copy is downscaled. A frame is static when fewer than MOTION_THRESHOLD of its
+# pixels moved since the last accepted frame; 0.002 is a ~6x6 block of the copy.
+MOTION_PIXEL_DELTA = 15
+MOTION_THRESHOLD = 0.002
+# A frame is blurry when the variance of the Laplacian of its grayscale copy drops below this fraction of
+# the scene's usual sharpness, a running average over the frames that were not static. Dark or plain
+# scenes are therefore not blurry, and a lasting change of scene is absorbed after a few frames while a
+# moment of motion blur is not.
+SHARPNESS_RATIO = 0.4
+SHARPNESS_AVERAGING = 0.1
+# Faces whose shorter side is below this many pixels are not encoded.
+MIN_FACE_SIZE = 40
+# Variance of the Laplacian of a face resized to FACE_SAMPLE pixels below which it is blurry.
+FACE_SHARPNESS_THRESHOLD = 25.0
+FACE_SAMPLE = (64, 64)
+# After this many skipped frames in a row the next one goes through anyway (0: never forced).
+MAX_SKIP = 30
+
+
+def sharpness(gray):
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+class FaceFilter(namedtuple("FaceFilter", ["min_face_size", "sharpness_threshold"])):
+    # The per-face check on its own; a plain tuple, so worker processes can apply it.
+
+    def reason(self, frame, location):
+        top, right, bottom, left = location
+        if min(bottom - top, right - left) < self.min_face_size:
+            return "small"
+        if self.sharpness_threshold > 0:
+            crop = frame[max(0, top):bottom, max(0, left):right]
+            if crop.ndim == 3:
+                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+            if sharpness(cv2.resize(crop, FACE_SAMPLE, interpolation=cv2.INTER_AREA)) < self.sharpness_threshold:
+                return "blurry"
+        return None
+
+    def split(self, frame, locations):
+        # (locations worth encoding, reasons the others were dropped)
+        kept = []
+        dropped = []
+        with metrics.stage("gate"):
+            for location in locations:
+                reason = self.reason(frame, location)
+                if reason is None:
+                    kept.append(location)
+                else:
+                    dropped.append(reason)
+        return kept, dropped
+
+
+class FrameGate:
+    # check(frame) is called once per frame in order, from one thread; filter_faces() may be called
+    # from several workers. face_filter is None unless check_faces is set; worker processes apply it
+    # themselves and hand what they dropped to record_dropped().
+
+    def __init__(self, motion_threshold=MOTION_THRESHOLD, sharpness_ratio=SHARPNESS_RATIO,
+                 min_face_size=MIN_FACE_SIZE, face_sharpness_threshold=FACE_SHARPNESS_THRESHOLD, max_skip=MAX_SKIP,
+                 check_faces=CHECK_FACES):
+        self.motion_threshold = motion_threshold
+        self.sharpness_ratio = sharpness_ratio
+        self.face_filter = FaceFilter(min_face_size, face_sharpness_threshold) if check_faces else None
+        self.max_skip = max_skip
+        self.frames = 0
+        self.skipped = {"static": 0, "blurry": 0}
+        self.faces_dropped = {"small": 0, "blurry": 0}
+        self._reference = None
+        self._scene_sharpness = None
+        self._skipped_in_row = 0
+        self._lock = threading.Lock()
+
+    def _small_gray(self, frame):
+        height, width = frame.shape[:2]
+        scale = GATE_WIDTH / width
+        small = cv2.resize(frame, (GATE_WIDTH, max(1, int(round(height * scale)))), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def motion(self, gray):
+        # Fraction of pixels that changed since the last accepted frame.
+        return np.count_nonzero(cv2.absdiff(gray, self._reference) > MOTION_PIXEL_DELTA) / gray.size
+
+    def check(self, frame):
+        # Returns the reason to skip this frame ("static" or "blurry"), or None to process it.
+        with metrics.stage("gate"):
+            self.frames += 1
+            gray = self._small_gray(frame)
+            reason = None
+            forced = self.max_skip and self._skipped_in_row >= self.max_skip
+            if not forced and self._reference is not None and self.motion(gray) < self.motion_threshold:
+                reason = "static"
+            else:
+                frame_sharpness = sharpness(gray)
+                if self._scene_sharpness is None:
+                    self._scene_sharpness = frame_sharpness
+                elif not forced and frame_sharpness < self.sharpness_ratio * self._scene_sharpness:
+                    reason = "blurry"
+                self._scene_sharpness += SHARPNESS_AVERAGING * (frame_sharpness - self._scene_sharpness)
+        if reason is None:
+            self._reference = gray
+            self._skipped_in_row = 0
+            return None
+        self._skipped_in_row += 1
+        self.skipped[reason] += 1
+        metrics.increment("gate_skipped_total", reason=reason)
+        return reason
+
+    def record_dropped(self, reasons):
+        with self._lock:
+            for reason in reasons:
+                self.faces_dropped[reason] += 1
+        for reason in reasons:
+            metrics.increment("gate_faces_dropped_total", reason=reason)
+
+    def accept_face(self, frame, location):
+        if self.face_filter is None:
+            return True
+        reason = self.face_filter.reason(frame, location)
+        if reason is None:
+            return True
+        self.record_dropped([reason])
+        return False
+
+    def filter_faces(self, frame, locations):
+        # Keeps the locations worth encoding.
+        if self.face_filter is None or not locations:
+            return locations
+        kept, dropped = self.face_filter.split(frame, locations)
+        self.record_dropped(dropped)
+        return kept
+
+    def stats(self):
+        skipped = sum(self.skipped.values())
+        return {
+            "frames": self.frames,
+            "skipped": skipped,
+            "skipped_static": self.skipped["static"],
+            "skipped_blurry": self.skipped["blurry"],
+            "skip_rate": skipped / self.frames if self.frames else 0.0,
+            "faces_dropped_small": self.faces_dropped["small"],
+            "faces_dropped_blurry": self.faces_dropped["blurry"],
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"frame gate skipped {stats['skipped']} of {stats['frames']} frames "
+                f"({stats['skipped_static']} static, {stats['skipped_blurry']} blurry) and dropped "
+                f"{stats['faces_dropped_small'] + stats['faces_dropped_blurry']} faces "
+                f"({stats['faces_dropped_small']} small, {stats['faces_dropped_blurry']} blurry)")
+
+
+def make_gate(gate=GATE_ENABLED):
+    # gate: True for a FrameGate with the default thresholds (frame checks only, unless
+    # HELOS_FRAME_GATE_FACES=1), False/None for none, or a FrameGate.
+    if gate is True:
+        return FrameGate()
+    return gate or None
@@ -0,0 +1,329 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+
+FACE_DIR = "./faces"
+ENCODING_SIZE = 128
+DATA_SUFFIX = "_data.npy"
+# Same default as face_recognition.compare_faces.
+TOLERANCE = 0.6
+# Largest (faces x encodings) distance block computed at once.
+MATCH_BLOCK_ELEMENTS = 1 << 24
+
+Match = namedtuple("Match", ["name", "distance", "margin", "known"])
+
+
+def pairwise_sq_distances(queries, encodings, sq_norms=None):
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    if sq_norms is None:
+        sq_norms = np.einsum("ij,ij->i", encodings, encodings)
+    distances = queries @ encodings.T
+    distances *= -2
+    distances += sq_norms
+    distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+    np.maximum(distances, 0, out=distances)
+    return distances
+
+
+def nearest_identities(per_identity, names, tolerance):
+    # per_identity: (faces, identities) euclidean distances -> one Match per face.
+    if per_identity.shape[1] == 0:
+        return [Match(None, np.inf, np.inf, False) for _ in range(len(per_identity))]
+
+    best = np.argmin(per_identity, axis=1)
+    rows = np.arange(len(per_identity))
+    best_distances = per_identity[rows, best]
+    if per_identity.shape[1] > 1:
+        runner_up = np.partition(per_identity, 1, axis=1)[:, 1]
+    else:
+        runner_up = np.full(len(per_identity), np.inf, dtype=per_identity.dtype)
+
+    return [
+        Match(names[i], float(distance), float(second - distance), bool(distance <= tolerance))
+        for i, distance, second in zip(best, best_distances, runner_up)
+    ]
+
+
+class GalleryData(namedtuple("GalleryData", ["names", "encodings", "labels", "offsets", "sq_norms"])):
+    # names[i] owns rows encodings[offsets[i]:offsets[i + 1]]; labels[row] == i.
+
+    def __len__(self):
+        return len(self.names)
+
+    def encodings_for(self, index):
+        return self.encodings[self.offsets[index]:self.offsets[index + 1]]
+
+    def as_dict(self):
+        return {name: self.encodings_for(i) for i, name in enumerate(self.names)}
+
+    def distances(self, face_encodings):
+        # (faces, identities) distance from each face to the closest encoding of every identity.
+        face_encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        result = np.empty((len(face_encodings), len(self.names)), dtype=np.float32)
+        if not len(self.names):
+            return result
+        # Bound the (faces, encodings) temporary for large query batches.
+        block = max(1, MATCH_BLOCK_ELEMENTS // len(self.encodings))
+        for start in range(0, len(face_encodings), block):
+            sq_distances = pairwise_sq_distances(face_encodings[start:start + block], self.encodings, self.sq_norms)
+            result[start:start + block] = np.minimum.reduceat(sq_distances, self.offsets[:-1], axis=1)
+        return np.sqrt(result, out=result)
+
+    def match(self, face_encodings, tolerance=TOLERANCE):
+        if not len(face_encodings):
+            return []
+        with metrics.stage("match"):
+            return nearest_identities(self.distances(face_encodings), self.names, tolerance)
+
+
+def empty_gallery_data():
+    return GalleryData(
+        names=[],
+        encodings=np.empty((0, ENCODING_SIZE), dtype=np.float32),
+        labels=np.empty(0, dtype=np.int32),
+        offsets=np.zeros(1, dtype=np.int64),
+        sq_norms=np.empty(0, dtype=np.float32),
+    )
+
+
+def build_gallery_data(faces):
+    # faces: {name: array-like of encodings}. Rows are laid out contiguously per name.
+    names = []
+    chunks = []
+    for name in sorted(faces):
+        encodings = np.asarray(faces[name], dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(encodings):
+            names.append(name)
+            chunks.append(encodings)
+    if not chunks:
+        return empty_gallery_data()
+
+    counts = np.array([len(chunk) for chunk in chunks], dtype=np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    encodings = np.ascontiguousarray(np.concatenate(chunks))
+    return GalleryData(
+        names=names,
+        encodings=encodings,
+        labels=np.repeat(np.arange(len(names), dtype=np.int32), counts),
+        offsets=offsets,
+        sq_norms=np.einsum("ij,ij->i", encodings, encodings),
+    )
+
+
+def label_from_filename(filename):
+    # "mary_ann_data.npy" -> "mary_ann"; names may themselves contain underscores.
+    return filename[:-len(DATA_SUFFIX)] if filename.endswith(DATA_SUFFIX) else filename
+
+
+def load_encodings_file(path):
+    return np.asarray(np.load(path, allow_pickle=True), dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+
+def face_data_path(name, face_dir=FACE_DIR):
+    return os.path.join(face_dir, f"{name}{DATA_SUFFIX}")
+
+
+class Gallery:
+    # Serves the consolidated store (gallery_store.py) plus any legacy *_data.npy files in face_dir,
+    # re-reading only what changed: the store when its table is replaced, a legacy file when its mtime
+    # changes. Checks are throttled to one per check_interval seconds. With an index (see
+    # face_index.py) only the identities that changed are removed from / re-added to it.
+
+    def __init__(self, face_dir=FACE_DIR, check_interval=1.0, index=None):
+        from gallery_store import GalleryStore
+
+        self.face_dir = face_dir
+        self.check_interval = check_interval
+        self.index = index
+        self.store = GalleryStore(face_dir)
+        self._files = {}
+        self._store_signature = None
+        self._store_table = None
+        self._store_matrix = None
+        self._store_faces = {}
+        self._faces = {}
+        self._data = empty_gallery_data()
+        self._last_check = None
+        self._lock = threading.Lock()
+        # Index queries run outside _lock; an update to the index waits until none is running.
+        self._idle = threading.Condition(self._lock)
+        self._matching = 0
+        self._updating = False
+
+    def _scan(self):
+        found = {}
+        if not os.path.isdir(self.face_dir):
+            return found
+        with os.scandir(self.face_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(DATA_SUFFIX) and entry.is_file():
+                    found[entry.name] = entry.stat().st_mtime_ns
+        return found
+
+    def refresh(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+                return False
+            self._last_check = now
+
+            found = self._scan()
+            changed = set()
+            for filename in list(self._files):
+                if filename not in found:
+                    changed.add(self._files.pop(filename)[1])
+
+            for filename, mtime in found.items():
+                cached = self._files.get(filename)
+                if cached is not None and cached[0] == mtime:
+                    continue
+                try:
+                    encodings = load_encodings_file(os.path.join(self.face_dir, filename))
+                except (OSError, ValueError, EOFError) as e:
+                    # Most likely a file that is still being written; pick it up on the next scan.
+                    print(f"[WARNING] Could not load face data {filename}. Error: {e}")
+                    continue
+                label = label_from_filename(filename)
+                self._files[filename] = (mtime, label, encodings)
+                changed.add(label)
+
+            changed |= self._refresh_store()
+            if changed:
+                if self.index is not None:
+                    self._updating = True
+                    while self._matching:
+                        self._idle.wait()
+                try:
+                    self._update(changed)
+                finally:
+                    self._updating = False
+                    self._idle.notify_all()
+            return bool(changed)
+
+    def _refresh_store(self):
+        signature = self.store.signature()
+        if signature == self._store_signature:
+            return set()
+        try:
+            table, matrix, faces = self.store.load()
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Could not load the gallery store in {self.face_dir}. Error: {e}")
+            return set()
+        previous = self._store_table["identities"] if self._store_table else {}
+        moved = self._store_table is not None and self._store_table["matrix"] != table["matrix"]
+        changed = {
+            name for name in set(previous) | set(table["identities"])
+            if moved or previous.get(name) != table["identities"].get(name)
+        }
+        self._store_signature = signature
+        self._store_table = table
+        self._store_matrix = matrix
+        self._store_faces = faces
+        return changed
+
+    def _update(self, labels):
+        # A name in the store supersedes its legacy file: save_face_data writes to the store, so the
+        # file holds what the person was enrolled with before.
+        by_label = {}
+        for label, encodings in self._store_faces.items():
+            if label in labels:
+                by_label[label] = [encodings]
+        for _, label, encodings in self._files.values():
+            if label in labels and label not in self._store_faces:
+                by_label.setdefault(label, []).append(encodings)
+        for label in labels:
+            chunks = by_label.get(label)
+            if chunks:
+                # A single store chunk stays a view of the memory map.
+                self._faces[label] = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+            else:
+                self._faces.pop(label, None)
+            if self.index is not None:
+                self.index.remove(label)
+                if chunks:
+                    self.index.add(label, self._faces[label])
+        # The contiguous layout is rebuilt lazily; index-backed galleries may never need it.
+        self._data = None
+
+    def load(self):
+        self.refresh()
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    if not self._files and self._store_table is not None:
+                        # Store only: match straight off the memory map instead of copying it.
+                        self._data = self.store.gallery_data(self._store_table, self._store_matrix)
+                    if self._data is None:
+                        self._data = build_gallery_data(self._faces)
+                    metrics.set_gauge("gallery_identities", len(self._data.names))
+                    metrics.set_gauge("gallery_encodings", len(self._data.encodings))
+                data = self._data
+        return data
+
+    def match(self, face_encodings, tolerance=TOLERANCE):
+        if self.index is None:
+            return self.load().match(face_encodings, tolerance)
+        self.refresh()
+        with self._lock:
+            while self._updating:
+                self._idle.wait()
+            # Whatever the index builds lazily (a rebuilt matrix, IVF training) is built here, so the
+            # query itself only reads and concurrent callers do not wait for each other.
+            self.index.prepare()
+            index = self.index
+            self._matching += 1
+            metrics.set_gauge("gallery_identities", len(self._faces))
+        try:
+            with metrics.stage("match"):
+                return index.match(face_encodings, tolerance)
+        finally:
+            with self._lock:
+                self._matching -= 1
+                if not self._matching:
+                    self._idle.notify_all()
+
+    def invalidate(self):
+        with self._lock:
+            self._last_check = None
+
+
+# "exact" searches the contiguous gallery directly; "ivf" and "hnsw" are the approximate indexes
+# in face_index.py for galleries with millions of encodings; "sharded" spreads the gallery over
+# shard processes or nodes (gallery_shards.py).
+GALLERY_INDEX = os.environ.get("HELOS_GALLERY_INDEX", "exact")
+
+_galleries = {}
+_galleries_lock = threading.Lock()
+
+
+def get_gallery(face_dir=FACE_DIR, index=None):
+    index = index or GALLERY_INDEX
+    key = (os.path.abspath(face_dir), index)
+    with _galleries_lock:
+        gallery = _galleries.get(key)
+        if gallery is None:
+            if index == "exact":
+                gallery = Gallery(face_dir)
+            else:
+                from face_index import make_index
+
+                gallery = Gallery(face_dir, index=make_index(index))
+            _galleries[key] = gallery
+    return gallery
+
+
+def invalidate_galleries(face_dir=FACE_DIR):
+    # After a write to face_dir: every cached gallery of it re-reads the directory on its next use,
+    # whatever index it was built with.
+    face_dir = os.path.abspath(face_dir)
+    with _galleries_lock:
+        galleries = [gallery for (directory, _), gallery in _galleries.items() if directory == face_dir]
+    for gallery in galleries:
+        gallery.invalidate()
@@ -0,0 +1,322 @@
+import argparse
+import heapq
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+import metrics
+
+from gallery import ENCODING_SIZE, TOLERANCE, Match, build_gallery_data
+
+# The gallery partitioned by identity across shard servers, each a process holding its identities'
+# encodings and answering top-k searches over a multiprocessing.connection socket. A ShardedIndex
+# either starts local shard processes or connects to shard nodes started elsewhere with
+#
+#     HELOS_SHARD_AUTHKEY=... python gallery_shards.py serve --host 0.0.0.0 --port 7100
+#
+# and is used like the other indexes in face_index.py (HELOS_GALLERY_INDEX=sharded). Every identity
+# lives on exactly one shard, so the nearest identity is the best of the shards' top-k lists.
+SHARDS = int(os.environ.get("HELOS_GALLERY_SHARDS", str(min(4, os.cpu_count() or 1))))
+# "host:port,host:port" of running shard nodes; when set, no local shard processes are started.
+SHARD_ADDRESSES = os.environ.get("HELOS_GALLERY_SHARD_ADDRESSES", "")
+SHARD_AUTHKEY = os.environ.get("HELOS_SHARD_AUTHKEY", "")
+SHARD_PORT = 7100
+# Identities move between shards once the most and least loaded shard differ by more than this
+# fraction of the mean shard size (in encodings).
+REBALANCE_TOLERANCE = 0.1
+# Candidates per query from each shard; two are enough for the nearest identity and its margin.
+TOP_K = 2
+SHARD_COMMANDS = ("update", "take", "reset", "search", "stats")
+
+
+class Shard:
+    # One shard's identities. Updates are applied before the next search rebuilds the layout.
+
+    def __init__(self):
+        self.faces = {}
+        self._data = None
+
+    def update(self, added, removed):
+        for name in removed:
+            self.faces.pop(name, None)
+        for name, encodings in added.items():
+            self.faces[name] = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        self._data = None
+        return sum(len(encodings) for encodings in self.faces.values())
+
+    def take(self, names):
+        # Removes and returns the identities, to move them to another shard.
+        taken = {name: self.faces.pop(name) for name in names if name in self.faces}
+        self._data = None
+        return taken
+
+    def reset(self):
+        self.faces = {}
+        self._data = None
+
+    def search(self, queries, k):
+        # Per query, up to k (name, distance) pairs nearest first.
+        if self._data is None:
+            self._data = build_gallery_data(self.faces)
+        data = self._data
+        if not len(data):
+            return [[] for _ in range(len(queries))]
+        distances = data.distances(queries)
+        k = min(k, distances.shape[1])
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        return [[(data.names[i], float(distance)) for i, distance in zip(row[rank], row_distances[rank])]
+                for row, row_distances, rank in zip(top, top_distances, order)]
+
+    def stats(self):
+        return {"identities": len(self.faces), "encodings": sum(len(e) for e in self.faces.values()),
+                "pid": os.getpid()}
+
+
+def _serve_connection(conn, shard, lock):
+    with conn:
+        while True:
+            try:
+                command, *args = conn.recv()
+            except (EOFError, OSError):
+                return
+            start = time.perf_counter()
+            try:
+                if command not in SHARD_COMMANDS:
+                    raise ValueError(f"unknown shard command {command!r}")
+                with lock:
+                    result = getattr(shard, command)(*args)
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}", 0.0))
+                continue
+            conn.send(("ok", result, time.perf_counter() - start))
+
+
+def serve_shard(address, authkey, ready=None):
+    # Serves one Shard until the process is stopped; ready (a Pipe end) receives the bound address.
+    shard = Shard()
+    lock = threading.Lock()
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            try:
+                conn = listener.accept()
+            except (multiprocessing.AuthenticationError, OSError) as e:
+                print(f"[WARNING] Rejected a shard connection. Error: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, shard, lock), daemon=True).start()
+
+
+def start_local_shard(authkey):
+    # A shard server in a child process on a free localhost port; returns (process, address).
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=serve_shard, args=(("127.0.0.1", 0), authkey, sender),
+                                      name="gallery-shard", daemon=True)
+    process.start()
+    sender.close()
+    address = receiver.recv()
+    receiver.close()
+    return process, address
+
+
+def parse_addresses(text):
+    addresses = []
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        host, _, port = item.rpartition(":")
+        addresses.append((host or "127.0.0.1", int(port)))
+    return addresses
+
+
+class ShardedIndex:
+    # add/remove only record what changed; the next match() sends each shard its updates in one
+    # message, rebalances, then fans the query out to all shards at once and merges their top-k.
+    # Gallery serialises add/remove and prepare(); concurrent searches take turns on the connections.
+
+    def __init__(self, shards=None, addresses=None, authkey=None, rebalance_tolerance=REBALANCE_TOLERANCE):
+        addresses = list(addresses) if addresses is not None else parse_addresses(SHARD_ADDRESSES)
+        self.rebalance_tolerance = rebalance_tolerance
+        self.processes = []
+        if addresses:
+            authkey = authkey or SHARD_AUTHKEY.encode()
+            if not authkey:
+                raise ValueError("connecting to shard nodes needs an authkey; set HELOS_SHARD_AUTHKEY")
+        else:
+            authkey = secrets.token_bytes(32)
+            for _ in range(shards or SHARDS):
+                process, address = start_local_shard(authkey)
+                self.processes.append(process)
+                addresses.append(address)
+        self.addresses = addresses
+        self.connections = [Client(address, authkey=authkey) for address in addresses]
+        self._owners = {}
+        self._counts = {}
+        self._loads = [0] * len(self.connections)
+        self._pending = [({}, set()) for _ in self.connections]
+        # A connection carries one request and its reply at a time.
+        self._lock = threading.Lock()
+        # Shard nodes may still hold what a previous coordinator gave them.
+        self._call_all("reset", [() for _ in self.connections])
+
+    def __len__(self):
+        return sum(self._loads)
+
+    def _call_all(self, command, args, shard_ids=None):
+        # Sends to every shard before reading any reply, so the shards work in parallel.
+        shard_ids = range(len(self.connections)) if shard_ids is None else shard_ids
+        for shard_id, shard_args in zip(shard_ids, args):
+            self.connections[shard_id].send((command, *shard_args))
+        # Every reply is read before raising, or the next command would read this one's leftovers.
+        results = []
+        error = None
+        for shard_id in shard_ids:
+            status, result, seconds = self.connections[shard_id].recv()
+            if status != "ok":
+                error = error or RuntimeError(f"Gallery shard {self.addresses[shard_id]} failed: {result}")
+                continue
+            metrics.observe("shard_seconds", seconds, command=command, shard=str(shard_id))
+            results.append(result)
+        if error is not None:
+            raise error
+        return results
+
+    def add(self, name, encodings):
+        self.remove(name)
+        encodings = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE))
+        if not len(encodings):
+            return
+        shard_id = int(np.argmin(self._loads))
+        self._owners[name] = shard_id
+        self._counts[name] = len(encodings)
+        self._loads[shard_id] += len(encodings)
+        self._pending[shard_id][0][name] = encodings
+
+    def remove(self, name):
+        shard_id = self._owners.pop(name, None)
+        if shard_id is None:
+            return
+        self._loads[shard_id] -= self._counts.pop(name)
+        added, removed = self._pending[shard_id]
+        added.pop(name, None)
+        removed.add(name)
+
+    def _plan_moves(self):
+        # Moves (name, from, to) that bring the shard sizes within rebalance_tolerance of each other;
+        # each move takes the identity whose size is closest to half the gap between the extremes.
+        loads = list(self._loads)
+        members = [{} for _ in loads]
+        for name, shard_id in self._owners.items():
+            members[shard_id][name] = self._counts[name]
+        moves = []
+        while len(loads) > 1:
+            heavy, light = int(np.argmax(loads)), int(np.argmin(loads))
+            gap = loads[heavy] - loads[light]
+            if gap <= self.rebalance_tolerance * sum(loads) / len(loads):
+                break
+            candidates = [(abs(gap / 2 - count), name) for name, count in members[heavy].items() if count < gap]
+            if not candidates:
+                break
+            _, name = min(candidates)
+            count = members[heavy].pop(name)
+            members[light][name] = count
+            loads[heavy] -= count
+            loads[light] += count
+            moves.append((name, heavy, light))
+        return moves
+
+    def _rebalance(self):
+        moves = self._plan_moves()
+        if not moves:
+            return
+        by_source = {}
+        for name, source, _ in moves:
+            by_source.setdefault(source, []).append(name)
+        sources = sorted(by_source)
+        taken = {}
+        for faces in self._call_all("take", [(by_source[source],) for source in sources], sources):
+            taken.update(faces)
+        added = {}
+        for name, source, target in moves:
+            added.setdefault(target, {})[name] = taken[name]
+            self._owners[name] = target
+            self._loads[source] -= self._counts[name]
+            self._loads[target] += self._counts[name]
+        targets = sorted(added)
+        self._call_all("update", [(added[target], []) for target in targets], targets)
+        metrics.increment("shard_moves_total", len(moves))
+
+    def prepare(self):
+        with self._lock:
+            self.flush()
+
+    def flush(self):
+        shard_ids = [shard_id for shard_id, (added, removed) in enumerate(self._pending) if added or removed]
+        if not shard_ids:
+            return
+        self._call_all("update", [self._pending[shard_id] for shard_id in shard_ids], shard_ids)
+        for shard_id in shard_ids:
+            self._pending[shard_id] = ({}, set())
+        self._rebalance()
+        for shard_id, load in enumerate(self._loads):
+            metrics.set_gauge("gallery_shard_encodings", load, shard=str(shard_id))
+
+    def search(self, face_encodings, k=TOP_K):
+        # Per face, the k nearest identities across all shards as (name, distance), nearest first.
+        queries = np.ascontiguousarray(np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE))
+        candidates = [[] for _ in range(len(queries))]
+        with self._lock:
+            self.flush()
+            results = self._call_all("search", [(queries, k)] * len(self.connections))
+        for shard_results in results:
+            for found, shard_found in zip(candidates, shard_results):
+                found.extend(shard_found)
+        return [heapq.nsmallest(k, found, key=lambda candidate: candidate[1]) for found in candidates]
+
+    def match(self, face_encodings, tolerance=TOLERANCE):
+        if not len(face_encodings):
+            return []
+        matches = []
+        for found in self.search(face_encodings, TOP_K):
+            if not found:
+                matches.append(Match(None, np.inf, np.inf, False))
+                continue
+            name, distance = found[0]
+            second = found[1][1] if len(found) > 1 else np.inf
+            matches.append(Match(name, distance, second - distance, distance <= tolerance))
+        return matches
+
+    def stats(self):
+        with self._lock:
+            self.flush()
+            return self._call_all("stats", [() for _ in self.connections])
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one gallery shard for a ShardedIndex on another machine")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run a shard node (needs HELOS_SHARD_AUTHKEY)")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=SHARD_PORT)
+    args = parser.parse_args()
+
+    if not SHARD_AUTHKEY:
+        print("[ERROR] Set HELOS_SHARD_AUTHKEY to the key the coordinator uses.")
+    else:
+        print(f"[INFO] Serving a gallery shard on {args.host}:{args.port}...")
+        serve_shard((args.host, args.port), SHARD_AUTHKEY.encode())
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from gallery import (
+    DATA_SUFFIX,
+    ENCODING_SIZE,
+    FACE_DIR,
+    GalleryData,
+    invalidate_galleries,
+    label_from_filename,
+    load_encodings_file,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers in one process are still serialised by the thread lock.
+    fcntl = None
+
+# One append-only float32 matrix (gallery.<generation>.f32, memory-mapped on load) plus a JSON table
+# mapping each name to its (offset, count) rows. Re-enrolling a name appends new rows and repoints
+# the table; the old rows become garbage until the store is compacted into a new generation.
+STORE_TABLE = "gallery.json"
+STORE_LOCK = "gallery.lock"
+STORE_VERSION = 1
+ROW_BYTES = ENCODING_SIZE * 4
+COMPACT_GARBAGE_RATIO = 0.25
+
+
+def empty_table():
+    return {"version": STORE_VERSION, "generation": 0, "matrix": "gallery.0.f32", "rows": 0, "identities": {}}
+
+
+class GalleryStore:
+    def __init__(self, face_dir=FACE_DIR):
+        self.face_dir = face_dir
+        self.table_path = os.path.join(face_dir, STORE_TABLE)
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.table_path)
+
+    def signature(self):
+        try:
+            stat = os.stat(self.table_path)
+        except FileNotFoundError:
+            return None
+        # The table is only ever replaced by rename, so a new inode means a new version.
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def read_table(self):
+        try:
+            with open(self.table_path) as f:
+                table = json.load(f)
+        except FileNotFoundError:
+            return empty_table()
+        if table.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported gallery store version {table.get('version')} in {self.table_path}")
+        return table
+
+    def matrix(self, table):
+        # Zero-copy: rows are paged in from disk as they are touched.
+        if not table["rows"]:
+            return np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        path = os.path.join(self.face_dir, table["matrix"])
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(table["rows"], ENCODING_SIZE))
+
+    def load(self):
+        table = self.read_table()
+        matrix = self.matrix(table)
+        faces = {name: matrix[offset:offset + count] for name, (offset, count) in table["identities"].items()}
+        return table, matrix, faces
+
+    def gallery_data(self, table, matrix):
+        # GalleryData straight over the memory map when the live rows tile it without holes.
+        ranges = sorted((offset, count, name) for name, (offset, count) in table["identities"].items())
+        if sum(count for _, count, _ in ranges) != table["rows"]:
+            return None
+        names = [name for _, _, name in ranges]
+        counts = np.array([count for _, count, _ in ranges], dtype=np.int64)
+        offsets = np.zeros(len(ranges) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return GalleryData(
+            names=names,
+            encodings=matrix,
+            labels=np.repeat(np.arange(len(names), dtype=np.int32), counts),
+            offsets=offsets,
+            sq_norms=np.einsum("ij,ij->i", matrix, matrix),
+        )
+
+    @contextmanager
+    def _locked(self):
+        # Serialises writers across threads and, where flock exists, across processes.
+        with self._lock:
+            os.makedirs(self.face_dir, exist_ok=True)
+            with open(os.path.join(self.face_dir, STORE_LOCK), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_table(self, table):
+        tmp_path = self.table_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.table_path)
+
+    def append_many(self, faces):
+        # faces: {name: encodings}. Replaces those identities in one table update.
+        with self._locked():
+            table = self.read_table()
+            path = os.path.join(self.face_dir, table["matrix"])
+            with open(path, "ab") as f:
+                # Drop rows a crashed writer appended without committing them to the table.
+                f.truncate(table["rows"] * ROW_BYTES)
+                for name, encodings in faces.items():
+                    encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+                    if not len(encodings):
+                        table["identities"].pop(name, None)
+                        continue
+                    f.write(encodings.tobytes())
+                    table["identities"][name] = [table["rows"], len(encodings)]
+                    table["rows"] += len(encodings)
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_table(table)
+            if self._garbage_ratio(table) > COMPACT_GARBAGE_RATIO:
+                self._compact(table)
+
+    def append(self, name, encodings):
+        self.append_many({name: encodings})
+
+    def remove(self, name):
+        with self._locked():
+            table = self.read_table()
+            if table["identities"].pop(name, None) is not None:
+                self._write_table(table)
+
+    def _garbage_ratio(self, table):
+        if not table["rows"]:
+            return 0.0
+        live = sum(count for _, count in table["identities"].values())
+        return 1 - live / table["rows"]
+
+    def compact(self):
+        with self._locked():
+            self._compact(self.read_table())
+
+    def _compact(self, table):
+        # Writes the live rows to a new generation file, then switches the table over in one rename.
+        # The old generation is only deleted by the next compaction: a reader that has just read the
+        # old table can still map it, and readers that already map it keep a valid view either way.
+        matrix = self.matrix(table)
+        generation = table["generation"] + 1
+        new_table = dict(table, generation=generation, matrix=f"gallery.{generation}.f32", rows=0, identities={})
+        with open(os.path.join(self.face_dir, new_table["matrix"]), "wb") as f:
+            for name, (offset, count) in sorted(table["identities"].items()):
+                f.write(np.ascontiguousarray(matrix[offset:offset + count]).tobytes())
+                new_table["identities"][name] = [new_table["rows"], count]
+                new_table["rows"] += count
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_table(new_table)
+        for filename in os.listdir(self.face_dir):
+            if filename.startswith("gallery.") and filename.endswith(".f32") and \
+                    filename not in (table["matrix"], new_table["matrix"]):
+                os.remove(os.path.join(self.face_dir, filename))
+
+
+def face_dir_signature(face_dir=FACE_DIR):
+    # Changes whenever an enrollment, compaction or migration writes to face_dir; one stat per file.
+    legacy = tuple((filename, os.stat(os.path.join(face_dir, filename)).st_mtime_ns)
+                   for filename in legacy_files(face_dir))
+    return GalleryStore(face_dir).signature(), legacy
+
+
+def save_face_data(name, encodings, face_dir=FACE_DIR):
+    GalleryStore(face_dir).append(name, encodings)
+    invalidate_galleries(face_dir)
+
+
+def legacy_files(face_dir=FACE_DIR):
+    if not os.path.isdir(face_dir):
+        return []
+    return sorted(filename for filename in os.listdir(face_dir) if filename.endswith(DATA_SUFFIX))
+
+
+def migrate_legacy_files(face_dir=FACE_DIR):
+    # Copies faces/<name>_data.npy into the store, for people not already in it. The files are left
+    # in place for older tools that read them; once a name is in the store, the store wins.
+    filenames = legacy_files(face_dir)
+    store = GalleryStore(face_dir)
+    stored = store.read_table()["identities"]
+    faces = {}
+    for filename in filenames:
+        name = label_from_filename(filename)
+        if name not in stored:
+            faces[name] = load_encodings_file(os.path.join(face_dir, filename))
+    if not faces:
+        print("[INFO] No legacy face data files that are not in the store yet.")
+        return 0
+    store.append_many(faces)
+    invalidate_galleries(face_dir)
+    rows = sum(len(encodings) for encodings in faces.values())
+    print(f"[INFO] Migrated {len(faces)} people ({rows} encodings) into {os.path.join(face_dir, STORE_TABLE)}; "
+          f"the *{DATA_SUFFIX} files were left in place and can be removed once nothing else reads them.")
+    return len(faces)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the consolidated gallery store")
+    parser.add_argument("command", choices=["migrate", "compact", "list"])
+    parser.add_argument("--face-dir", default=FACE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_legacy_files(args.face_dir)
+    elif args.command == "compact":
+        GalleryStore(args.face_dir).compact()
+    else:
+        table = GalleryStore(args.face_dir).read_table()
+        for name, (offset, count) in sorted(table["identities"].items()):
+            print(f"{name}\t{count} encodings")
+        print(f"[INFO] {len(table['identities'])} people, {table['rows']} rows in {table['matrix']}")
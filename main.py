@@ -1,178 +1,41 @@
-import cv2
-import dlib
-import numpy as np
-import os
-import face_recognition
-# import tkinter as tk
-# from tkinter import filedialog, messagebox, ttk
-
-
-FACE_DIR = "./faces"
-if not os.path.exists(FACE_DIR):
-    os.makedirs(FACE_DIR)
-
-
-def capture_face_data(name):
-    print(f"[INFO] Starting face data capture for {name}...")
-    cap = cv2.VideoCapture(0)
-    all_encodings = []
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[ERROR] Failed to capture frame!")
-            break
-
-        face_locations = face_recognition.face_locations(frame)
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
-
-        for face_encoding in face_encodings:
-            all_encodings.append(face_encoding)
-            for (top, right, bottom, left) in face_locations:
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-
-        cv2.imshow(f"Face Data Collection for {name}", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
-
-    if not all_encodings:
-        print("[ERROR] No face data captured. Trying again...")
-        capture_face_data(name)
-        return
-
-    data_path = os.path.join(FACE_DIR, f"{name}_data.npy")
-    np.save(data_path, all_encodings)
-    print(f"[INFO] Face data for {name} captured and saved as {data_path}!")
-
-
-def recognize_face_video():
-    print("[INFO] Starting face recognition in video stream...")
-
-    known_faces = {}
-    for filename in os.listdir(FACE_DIR):
-        if filename.endswith('_data.npy'):
-            encodings = np.load(os.path.join(FACE_DIR, filename), allow_pickle=True)
-            known_faces[filename.split('_')[0]] = encodings
-
-    cap = cv2.VideoCapture(0)
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[ERROR] Failed to capture frame!")
-            break
-
-        face_locations = face_recognition.face_locations(frame)
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
-
-        for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-            label = "Unknown"
-            for name, known_face_encodings in known_faces.items():
-                matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                if True in matches:
-                    label = name
-                    break
-
-            cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-
-        cv2.imshow("Face Recognition", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+import argparse
 
-    cap.release()
-    cv2.destroyAllWindows()
+import metrics
 
+# import tkinter as tk
+# from tkinter import filedialog, messagebox, ttk
 
-def recognize_face_in_image(image_path):
-    print(f"[INFO] Starting face recognition in image {image_path}...")
-
-    known_faces = {}
-    for filename in os.listdir(FACE_DIR):
-        if filename.endswith('_data.npy'):
-            encodings = np.load(os.path.join(FACE_DIR, filename), allow_pickle=True)
-            known_faces[filename.split('_')[0]] = encodings
-
-    image = cv2.imread(image_path)
-    face_locations = face_recognition.face_locations(image)
-    face_encodings = face_recognition.face_encodings(image, face_locations)
-
-    for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-        label = "Unknown"
-        for name, known_face_encodings in known_faces.items():
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            if True in matches:
-                label = name
-                break
-
-        cv2.putText(image, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-        cv2.rectangle(image, (left, top), (right, bottom), (0, 255, 0), 2)
-
-    cv2.imshow("Face Recognition in Image", image)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-
-
-def capture_face_data_from_folder(dir_path):
-    for subdir, _, files in os.walk(dir_path):
-        person_name = os.path.basename(subdir)
-        all_encodings = []
-
-        for file in files:
-            image_path = os.path.join(subdir, file)
-            try:
-                image = face_recognition.load_image_file(image_path)
-                face_encodings = face_recognition.face_encodings(image)
-
-                if not face_encodings:
-                    print(f"[WARNING] No faces found in {image_path}. Skipping...")
-                    continue
-
-                all_encodings.extend(face_encodings)
-            except Exception as e:
-                print(f"[ERROR] Error processing image {image_path}. Error: {e}")
-
-        if all_encodings:
-            data_path = os.path.join(FACE_DIR, f"{person_name}_data.npy")
-            np.save(data_path, all_encodings)
-            print(f"[INFO] Face data for {person_name} captured and saved as {data_path}!")
-
-def check_face_in_video(face_data_path, video_path):
-    print(f"[INFO] Loading face data from {face_data_path}")
-    known_face_encodings = np.load(face_data_path, allow_pickle=True)
-
-    print(f"[INFO] Opening video file {video_path}")
-    cap = cv2.VideoCapture(video_path)
-
-    frame_number = 0
-    while True:
-        ret, frame = cap.read()
-        frame_number += 1
-        if not ret:
-            print(f"[INFO] Reached end of video or failed to read frame {frame_number}. Exiting...")
-            break
-
-        print(f"[INFO] Processing frame {frame_number}")
-        frame_face_encodings = face_recognition.face_encodings(frame)
 
-        for encoding in frame_face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, encoding)
-            if True in matches:
-                print(f"[INFO] Face found in frame {frame_number}!")
-                cap.release()
-                cv2.destroyAllWindows()
-                return True
+def print_label_changes():
+    # Headless video: report who is in view whenever that changes instead of drawing every frame.
+    last = None
 
-    print("[INFO] Face not found in video.")
-    cap.release()
-    cv2.destroyAllWindows()
-    return False
+    def on_frame(video_frame):
+        nonlocal last
+        labels = sorted(face.label for face in video_frame.faces)
+        if labels != last:
+            print(f"[INFO] Frame {video_frame.number}: {', '.join(labels) or 'no faces'}")
+            last = labels
 
+    return on_frame
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-face recognition system")
+    parser.add_argument("--headless", action="store_true", help="no windows; print results instead")
+    parser.add_argument("--frame-gate", choices=("on", "off"), default=None,
+                        help="skip static and blurry frames before detection (default: off, or HELOS_FRAME_GATE)")
+    parser.add_argument("--detector", default=None,
+                        help="hog, cnn, haar or dnn (default: HELOS_DETECTOR, else the calibrated choice, else hog)")
+    parser.add_argument("--upsample", type=int, default=None, help="dlib upsample count (default: 1)")
+    parser.add_argument("--num-jitters", type=int, default=None, help="encoding re-samples per face (default: 1)")
+    parser.add_argument("--metrics", metavar="PATH", default=None,
+                        help="record per-stage timings and write them to PATH (.json or Prometheus text)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable(args.metrics)
+    gate_options = {} if args.frame_gate is None else {"gate": args.frame_gate == "on"}
+
     print("[INFO] Welcome to the multi-face recognition system!")
     print("Choose an option:")
     print("1. Capture face data")
@@ -180,29 +43,57 @@ if __name__ == "__main__":
     print("3. Recognize face in an image")
     print("4. Capture face data from a folder")
     print("5. Check if a face exists in a video")
+    print("6. Calibrate detector backends")
 
 
     choice = input("[INPUT] Enter the number of your choice: ")
 
+    # Imported once a choice is made so the menu appears immediately; OpenCV takes a moment to load
+    # and the dlib models only load on the first detection.
+    from face_recognition_utils import (
+        capture_face_data,
+        capture_face_data_from_folder,
+        check_face_in_video,
+        recognize_face_in_image,
+        recognize_face_video,
+    )
+    from detectors import detector_config, run_calibration
+
+    options = dict(gate_options, detector=detector_config(args.detector, args.upsample, args.num_jitters))
+
     if choice == '1':
         name = input("[INPUT] Enter the name of the person for face data capture: ")
-        capture_face_data(name)
+        capture_face_data(name, headless=args.headless, **options)
     elif choice == '2':
-        recognize_face_video()
+        recognize_face_video(headless=args.headless, on_frame=print_label_changes() if args.headless else None,
+                             **options)
     elif choice == '3':
         image_path = input("[INPUT] Enter the path to the image for face recognition: ")
-        recognize_face_in_image(image_path)
+        # Labels as the CLI has always drawn them: green, at font scale 0.9.
+        result = recognize_face_in_image(image_path, headless=args.headless, detector=options["detector"],
+                                         text_color=(0, 255, 0), font_scale=0.9)
+        for face in result.faces:
+            print(f"{face.label}\t{face.box}\t{face.distance:.3f}")
     elif choice == '4':
         dir_path = input("[INPUT] Enter the path to the directory containing face folders: ")
-        capture_face_data_from_folder(dir_path)
+        capture_face_data_from_folder(dir_path, detector=options["detector"])
     elif choice == '5':
-        face_image_path = input("[INPUT] Enter the path to the face image: ")
+        face_image_path = input("[INPUT] Enter an enrolled name or the path to a face data file: ")
         video_path = input("[INPUT] Enter the path to the video: ")
-        face_exists = check_face_in_video(face_image_path, video_path)
-        print(f"Face exists in video: {face_exists}")
+        sample_every = input("[INPUT] Analyse every Nth frame [1]: ")
+        result = check_face_in_video(face_image_path, video_path, sample_every=int(sample_every or 1),
+                                     **options)
+        print(f"Face exists in video: {result.found}")
+    elif choice == '6':
+        image_dir = input("[INPUT] Enter the path to a folder of sample images from this camera or dataset: ")
+        recall = input("[INPUT] Minimum recall against the cnn detector [0.9]: ")
+        run_calibration(image_dir, float(recall or 0.9))
     # ... (rest of your code)
     else:
         print("[ERROR] Invalid choice. Exiting...")
+    if metrics.enabled():
+        metrics.export()
+        metrics.print_summary()
 
 
 
@@ -0,0 +1,328 @@
+import atexit
+import bisect
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from functools import partial
+
+# Per-stage latency histograms and counters. Off unless HELOS_METRICS=1 or enable() is called; when off,
+# every hook is a single None check (stage() hands back a shared no-op context manager).
+#
+#     with metrics.stage("detect"):
+#         ...
+#     metrics.increment("encoding_cache_total", result="hit")
+#
+# HELOS_METRICS_FILE=path exports every HELOS_METRICS_INTERVAL seconds and at exit, as JSON when the
+# path ends in .json and as Prometheus text otherwise. Other exporters are plain callables taking
+# the registry (see add_exporter).
+PREFIX = "helos_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+EXPORT_INTERVAL = float(os.environ.get("HELOS_METRICS_INTERVAL", "10"))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other["counts"])]
+        self.sum += other["sum"]
+        self.count += other["count"]
+
+    def as_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def snapshot(self):
+        def entries(items, value):
+            return [{"name": name, "labels": dict(labels), "value": value(metric)}
+                    for (name, labels), metric in sorted(items, key=lambda item: item[0])]
+
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "pid": self.pid,
+                "histograms": entries(self.histograms.items(), Histogram.as_dict),
+                "counters": entries(self.counters.items(), lambda value: value),
+                "gauges": entries(self.gauges.items(), lambda value: value),
+            }
+
+    def merge(self, snapshot):
+        # Adds a worker process's drained snapshot into this registry.
+        with self.lock:
+            for entry in snapshot["histograms"]:
+                key = _key(entry["name"], entry["labels"])
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(entry["value"]["buckets"])
+                histogram.merge(entry["value"])
+            for entry in snapshot["counters"]:
+                key = _key(entry["name"], entry["labels"])
+                self.counters[key] = self.counters.get(key, 0) + entry["value"]
+            for entry in snapshot["gauges"]:
+                self.gauges[_key(entry["name"], entry["labels"])] = entry["value"]
+
+
+def _labels_text(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def prometheus_text(snapshot):
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for entry in snapshot["histograms"]:
+        name = PREFIX + entry["name"]
+        declare(name, "histogram")
+        value = entry["value"]
+        cumulative = 0
+        for bound, count in zip(value["buckets"] + ["+Inf"], value["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels_text(entry['labels'], {'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels_text(entry['labels'])} {value['sum']}")
+        lines.append(f"{name}_count{_labels_text(entry['labels'])} {value['count']}")
+    for kind, entries in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+        for entry in entries:
+            name = PREFIX + entry["name"]
+            declare(name, kind)
+            lines.append(f"{name}{_labels_text(entry['labels'])} {entry['value']}")
+    return "\n".join(lines) + "\n"
+
+
+class FileExporter:
+    # Rewrites one file with the current totals; JSON for *.json paths, Prometheus text otherwise
+    # (suitable for node_exporter's textfile collector).
+
+    def __init__(self, path):
+        self.path = path
+        self.json = path.endswith(".json")
+
+    def __call__(self, registry):
+        snapshot = registry.snapshot()
+        text = json.dumps(snapshot, indent=1) if self.json else prometheus_text(snapshot)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe("stage_seconds", time.perf_counter() - self.start, stage=self.name)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+_registry = None
+_exporters = []
+_export_thread = None
+_state_lock = threading.Lock()
+
+
+def enabled():
+    return _registry is not None
+
+
+def registry():
+    return _registry
+
+
+def enable(path=None, interval=EXPORT_INTERVAL):
+    global _registry, _export_thread
+    with _state_lock:
+        if _registry is None or _registry.pid != os.getpid():
+            _registry = Registry()
+        if path and not any(getattr(exporter, "path", None) == path for exporter in _exporters):
+            _exporters.append(FileExporter(path))
+        if _exporters and interval and _export_thread is None:
+            _export_thread = threading.Thread(target=_export_loop, args=(interval,), name="metrics-export",
+                                              daemon=True)
+            _export_thread.start()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+
+
+def export():
+    if _registry is None:
+        return
+    for exporter in list(_exporters):
+        try:
+            exporter(_registry)
+        except Exception as e:
+            print(f"[WARNING] Metrics export failed. Error: {e}")
+
+
+def _export_loop(interval):
+    while True:
+        time.sleep(interval)
+        export()
+
+
+def stage(name):
+    registry = _registry
+    if registry is None:
+        return _NOOP
+    return _Timer(registry, name)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    if _registry is not None:
+        _registry.observe(name, value, buckets, **labels)
+
+
+def increment(name, value=1, **labels):
+    if _registry is not None:
+        _registry.increment(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    if _registry is not None:
+        _registry.set_gauge(name, value, **labels)
+
+
+def snapshot():
+    return _registry.snapshot() if _registry is not None else None
+
+
+def stage_summary():
+    # [(stage, calls, total seconds, mean ms)] slowest total first; empty when disabled.
+    if _registry is None:
+        return []
+    rows = [(entry["labels"]["stage"], entry["value"]["count"], entry["value"]["sum"],
+             entry["value"]["sum"] * 1000 / max(entry["value"]["count"], 1))
+            for entry in _registry.snapshot()["histograms"] if entry["name"] == "stage_seconds"]
+    return sorted(rows, key=lambda row: -row[2])
+
+
+def print_summary():
+    rows = stage_summary()
+    if not rows:
+        return
+    print(f"{'stage':>14} {'calls':>8} {'total s':>9} {'mean ms':>9}")
+    for name, calls, seconds, mean_ms in rows:
+        print(f"{name:>14} {calls:>8} {seconds:>9.3f} {mean_ms:>9.2f}")
+
+
+def drain():
+    # Snapshot and reset; used to ship a worker process's measurements back to its parent.
+    global _registry
+    if _registry is None:
+        return None
+    registry, _registry = _registry, Registry()
+    return registry.snapshot()
+
+
+# A worker process's result together with the metrics it recorded while producing it.
+Drained = namedtuple("Drained", ["result", "snapshot"])
+
+
+def call_and_drain(fn, *args):
+    # A forked worker starts from a fresh registry so it never re-reports what the parent had counted.
+    if _registry is None or _registry.pid != os.getpid():
+        enable(interval=None)
+    return Drained(fn(*args), drain())
+
+
+def in_worker(pool, fn):
+    # Worker processes have registries of their own. When metrics are on, fn is wrapped so its
+    # measurements travel back with the result; pass every result through unwrap().
+    # Looked up rather than imported: the process pool machinery is slow to import, and when it was
+    # never imported pool cannot be a process pool.
+    process = sys.modules.get("concurrent.futures.process")
+    if _registry is not None and process is not None and isinstance(pool, process.ProcessPoolExecutor):
+        return partial(call_and_drain, fn)
+    return fn
+
+
+def unwrap(value):
+    if isinstance(value, Drained):
+        if value.snapshot is not None and _registry is not None:
+            _registry.merge(value.snapshot)
+        return value.result
+    return value
+
+
+if os.environ.get("HELOS_METRICS", "") not in ("", "0"):
+    # Spawned pool workers inherit the variable too; only the main process writes the file.
+    enable(os.environ.get("HELOS_METRICS_FILE") if multiprocessing.parent_process() is None else None)
+atexit.register(export)
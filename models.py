@@ -0,0 +1,47 @@
+import threading
+
+import numpy as np
+
+import metrics
+
+# face_recognition loads its dlib models (~100 MB) as soon as it is imported. Everything goes through
+# this module instead, so importing the package stays cheap and the models are loaded once per process,
+# on the first detection or encoding.
+_face_recognition = None
+_lock = threading.Lock()
+
+
+def face_recognition_module():
+    global _face_recognition
+    if _face_recognition is None:
+        with _lock:
+            if _face_recognition is None:
+                import face_recognition
+
+                _face_recognition = face_recognition
+    return _face_recognition
+
+
+def loaded():
+    return _face_recognition is not None
+
+
+def face_locations(image, number_of_times_to_upsample=1, model="hog"):
+    return face_recognition_module().face_locations(image, number_of_times_to_upsample, model)
+
+
+def face_encodings(image, known_face_locations=None, num_jitters=1, model="small"):
+    module = face_recognition_module()
+    with metrics.stage("encode"):
+        return module.face_encodings(image, known_face_locations, num_jitters, model)
+
+
+def load_image_file(file, mode="RGB"):
+    module = face_recognition_module()
+    with metrics.stage("decode"):
+        return module.load_image_file(file, mode)
+
+
+def warm():
+    # Loads the models and runs one tiny encoding, so the first real request pays neither cost.
+    face_encodings(np.zeros((32, 32, 3), dtype=np.uint8), [(0, 31, 31, 0)])
@@ -0,0 +1,46 @@
+import cv2
+
+import metrics
+
+# Rendering is a sink on top of the recognition generators: nothing here runs in headless mode.
+
+
+def draw_boxes(frame, locations, color=(0, 255, 0), thickness=2):
+    # In place; locations are (top, right, bottom, left).
+    with metrics.stage("annotate"):
+        for top, right, bottom, left in locations:
+            cv2.rectangle(frame, (left, top), (right, bottom), color, thickness)
+    return frame
+
+
+def draw_faces(frame, faces, box_color=(0, 255, 0), text_color=None, font_scale=0.9, thickness=2):
+    # In place; faces are FaceResults (anything with .box and .label).
+    text_color = text_color or box_color
+    with metrics.stage("annotate"):
+        for face in faces:
+            top, right, bottom, left = face.box
+            cv2.putText(frame, face.label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, font_scale, text_color,
+                        thickness)
+            cv2.rectangle(frame, (left, top), (right, bottom), box_color, thickness)
+    return frame
+
+
+def draw_status(frame, text):
+    cv2.putText(frame, text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+    return frame
+
+
+class WindowSink:
+    # Shows frames in an OpenCV window; show() returns True once the user pressed q.
+    # delay=0 waits for a key press (single images).
+
+    def __init__(self, title, delay=1):
+        self.title = title
+        self.delay = delay
+
+    def show(self, frame):
+        cv2.imshow(self.title, frame)
+        return cv2.waitKey(self.delay) & 0xFF == ord('q')
+
+    def close(self):
+        cv2.destroyWindow(self.title)
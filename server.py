@@ -0,0 +1,418 @@
+import argparse
+import io
+import json
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import repeat
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+
+from batch_recognition import IMAGE_EXTENSIONS, encode_item, recognize_images, warm_worker
+from compaction import MAX_PROTOTYPES, compact_encodings
+from detection import DETECTION_SCALE, check_detection_scale
+from detectors import BACKENDS, detector_config
+from encoding_cache import CACHE_SUBDIR
+from frame_gate import make_gate
+from gallery import FACE_DIR, TOLERANCE, build_gallery_data, get_gallery
+from gallery_store import save_face_data
+from video_pipeline import scan_video
+
+# Concurrent /recognize requests arriving within BATCH_WINDOW seconds are encoded and matched as
+# one batch of up to MAX_BATCH images. At most QUEUE_SIZE images wait for a batch; beyond that the
+# server answers 503 instead of letting latency grow without bound.
+BATCH_WINDOW = 0.01
+MAX_BATCH = 32
+QUEUE_SIZE = 256
+# Batches in flight at once, so one batch can be matched while the next is being encoded.
+DISPATCHERS = 2
+# Video checks are long-running; at most this many run, further requests get 503.
+VIDEO_SLOTS = 2
+REQUEST_TIMEOUT = 60.0
+# Enrollments go through their own batcher: at most ENROLL_QUEUE_SIZE wait, each for up to ENROLL_TIMEOUT.
+ENROLL_QUEUE_SIZE = 8
+ENROLL_TIMEOUT = 300.0
+MAX_IMAGE_BYTES = 32 * 1024 * 1024
+MAX_ENROLL_BYTES = 512 * 1024 * 1024
+MAX_VIDEO_BYTES = 4 * 1024 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class MicroBatcher:
+    # submit() returns a Future immediately; dispatcher threads gather whatever arrives within
+    # `window` seconds of the first item and hand the batch to process_batch(items) -> results.
+
+    def __init__(self, process_batch, max_batch=MAX_BATCH, window=BATCH_WINDOW, queue_size=QUEUE_SIZE,
+                 dispatchers=DISPATCHERS):
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = [threading.Thread(target=self._run, name=f"batcher-{i}", daemon=True)
+                        for i in range(dispatchers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, item):
+        # Raises queue.Full when the server is saturated.
+        future = Future()
+        self.queue.put_nowait((item, future))
+        return future
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+
+
+class RecognitionService:
+    # Owns the warm state shared by all requests: the worker pool, the gallery and the batcher.
+
+    def __init__(self, face_dir=FACE_DIR, workers=None, detection_scale=DETECTION_SCALE, tolerance=TOLERANCE,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, queue_size=QUEUE_SIZE, video_slots=VIDEO_SLOTS,
+                 detector=None):
+        self.face_dir = face_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.detection_scale = check_detection_scale(detection_scale)
+        self.detector = detector_config(detector)
+        self.tolerance = tolerance
+        self.cache_dir = os.path.join(face_dir, CACHE_SUBDIR)
+        self.gallery = get_gallery(face_dir)
+        self.gallery.load()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=warm_worker)
+        # Start every worker now rather than on the first request.
+        list(self.pool.map(abs, range(self.workers)))
+        self.batcher = MicroBatcher(self._recognize_batch, max_batch, batch_window, queue_size)
+        # One item per enrollment, however many images it has.
+        self.enroll_batcher = MicroBatcher(self._encode_batch, max_batch, batch_window, ENROLL_QUEUE_SIZE, 1)
+        self.video_slots = threading.BoundedSemaphore(video_slots)
+        self.started = time.time()
+
+    def _recognize_batch(self, contents):
+        results = recognize_images(contents, self.gallery, self.tolerance, self.detection_scale,
+                                   workers=self.workers, cache_dir=self.cache_dir, executor=self.pool,
+                                   detector=self.detector)
+        return [(result, len(contents)) for result in results]
+
+    def _encode_batch(self, enrollments):
+        contents = [content for images in enrollments for content in images]
+        encoded = iter(list(map(metrics.unwrap, self.pool.map(
+            metrics.in_worker(self.pool, encode_item), contents, repeat(self.detection_scale),
+            repeat(self.cache_dir), repeat(False), repeat(self.detector)))))
+        return [[next(encoded) for _ in images] for images in enrollments]
+
+    def recognize(self, content):
+        try:
+            future = self.batcher.submit(content)
+        except queue.Full:
+            raise HTTPError(503, "recognition queue is full", {"Retry-After": "1"})
+        try:
+            result, batch_size = future.result(timeout=REQUEST_TIMEOUT)
+        except TimeoutError:
+            raise HTTPError(504, "recognition timed out")
+        if result.error:
+            raise HTTPError(400, result.error)
+        return {
+            "faces": [{"box": face.box, "name": face.label, "distance": _finite(face.distance), "known": face.known}
+                      for face in result.faces],
+            "batch_size": batch_size,
+            "cache_hit": result.cache_hit,
+        }
+
+    def enroll(self, name, contents, append=False, max_prototypes=MAX_PROTOTYPES):
+        try:
+            future = self.enroll_batcher.submit(contents)
+        except queue.Full:
+            raise HTTPError(503, "enrollment queue is full", {"Retry-After": "5"})
+        try:
+            encoded = future.result(timeout=ENROLL_TIMEOUT)
+        except TimeoutError:
+            raise HTTPError(504, "enrollment timed out")
+        encodings = [encoding for _, image_encodings, _, _, _ in encoded for encoding in image_encodings]
+        errors = [error for _, _, _, error, _ in encoded if error]
+        if not encodings:
+            raise HTTPError(422, "no faces found in the uploaded images")
+        if append:
+            existing = self.gallery.load().as_dict().get(name)
+            if existing is not None:
+                encodings = list(existing) + encodings
+        prototypes = compact_encodings(encodings, max_prototypes)
+        save_face_data(name, prototypes, self.face_dir)
+        self.gallery.refresh(force=True)
+        return {"name": name, "images": len(contents), "faces": len(encodings), "prototypes": len(prototypes),
+                "errors": errors}
+
+    @contextmanager
+    def video_slot(self):
+        # Taken before the upload is read, so a saturated server does not spool videos it will refuse.
+        if not self.video_slots.acquire(blocking=False):
+            raise HTTPError(503, "too many video checks running", {"Retry-After": "5"})
+        try:
+            yield
+        finally:
+            self.video_slots.release()
+
+    def check_video(self, video_path, name=None, sample_every=1, start_time=None, end_time=None):
+        matcher = self.gallery
+        if name is not None:
+            encodings = self.gallery.load().as_dict().get(name)
+            if encodings is None:
+                raise HTTPError(404, f"{name} is not enrolled")
+            matcher = build_gallery_data({name: encodings})
+        gate = make_gate()
+        result = scan_video(video_path, matcher, sample_every, start_time, end_time, self.workers,
+                            self.detection_scale, self.tolerance, gate=gate, detector=self.detector,
+                            executor=self.pool)
+        payload = result._asdict()
+        if gate is not None:
+            payload["gate"] = gate.stats()
+        return payload
+
+    def health(self):
+        return {
+            "status": "ok",
+            "identities": len(self.gallery.load()),
+            "queued": self.batcher.queue.qsize(),
+            "workers": self.workers,
+            "detector": self.detector._asdict(),
+            "uptime": time.time() - self.started,
+        }
+
+    def close(self):
+        self.batcher.close()
+        self.enroll_batcher.close()
+        self.pool.shutdown()
+
+
+def _finite(distance):
+    # No candidate (an empty gallery) gives an infinite distance, which JSON cannot represent.
+    return distance if math.isfinite(distance) else None
+
+
+def _enroll_images(content):
+    # A single image, or a zip archive of images.
+    if not zipfile.is_zipfile(io.BytesIO(content)):
+        return [content]
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        return [archive.read(info) for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # POST /recognize            body: an encoded image
+    # POST /enroll?name=N        body: an image or a zip of images; &append=1 keeps existing encodings
+    # POST /check-video?name=N   body: a video file; &sample_every, &start, &end are optional
+    # GET  /health
+    # GET  /metrics              Prometheus text; 404 unless started with --metrics or HELOS_METRICS=1
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, allow_nan=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type="text/plain; version=0.0.4"):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _content_length(self, limit):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise HTTPError(411, "Content-Length required")
+        length = int(length)
+        if length > limit:
+            raise HTTPError(413, f"body larger than {limit} bytes")
+        return length
+
+    def _short_body(self, received, expected):
+        # The client went away mid-upload; what follows on this connection is not a request either.
+        self.close_connection = True
+        return HTTPError(400, f"body ended after {received} of {expected} bytes")
+
+    def _read_body(self, limit):
+        length = self._content_length(limit)
+        body = self.rfile.read(length)
+        if len(body) != length:
+            raise self._short_body(len(body), length)
+        return body
+
+    def _spool_body(self, limit, suffix):
+        # Streams the body to a temporary file without holding it in memory.
+        length = remaining = self._content_length(limit)
+        spool = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        with spool:
+            while remaining:
+                chunk = self.rfile.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                spool.write(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            os.remove(spool.name)
+            raise self._short_body(length - remaining, length)
+        return spool.name
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if method == "GET" and url.path == "/health":
+                return self._send_json(200, self.service.health())
+            if method == "GET" and url.path == "/metrics":
+                if not metrics.enabled():
+                    raise HTTPError(404, "metrics are disabled")
+                return self._send_text(200, metrics.prometheus_text(metrics.snapshot()))
+            if method != "POST":
+                raise HTTPError(404, f"no route for {method} {url.path}")
+
+            metrics.increment("http_requests_total", path=url.path)
+            if url.path == "/recognize":
+                payload = self.service.recognize(self._read_body(MAX_IMAGE_BYTES))
+            elif url.path == "/enroll":
+                name = params.get("name", "").strip()
+                if not name:
+                    raise HTTPError(400, "name is required")
+                images = _enroll_images(self._read_body(MAX_ENROLL_BYTES))
+                payload = self.service.enroll(name, images, append=params.get("append") == "1")
+            elif url.path == "/check-video":
+                suffix = os.path.splitext(params.get("filename", ""))[1] or ".mp4"
+                with self.service.video_slot():
+                    video_path = self._spool_body(MAX_VIDEO_BYTES, suffix)
+                    try:
+                        payload = self.service.check_video(
+                            video_path,
+                            params.get("name"),
+                            int(params.get("sample_every", 1)),
+                            float(params["start"]) if "start" in params else None,
+                            float(params["end"]) if "end" in params else None,
+                        )
+                    finally:
+                        os.remove(video_path)
+            else:
+                raise HTTPError(404, f"no route for {method} {url.path}")
+            self._send_json(200, payload)
+        except HTTPError as e:
+            # The request body may not have been read; do not reuse the connection.
+            self.close_connection = True
+            self._send_json(e.status, {"error": str(e)}, e.headers)
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self.close_connection = True
+            self._send_json(500, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class RecognitionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(host="127.0.0.1", port=8000, verbose=False, **options):
+    service = RecognitionService(**options)
+    server = RecognitionServer((host, port), RequestHandler)
+    server.service = service
+    server.verbose = verbose
+    print(f"[INFO] Serving face recognition on http://{host}:{port} with {service.workers} workers...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless face recognition HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--face-dir", default=FACE_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="default: one per CPU core")
+    parser.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    parser.add_argument("--detector", choices=BACKENDS, default=None, help="default: see detectors.py")
+    parser.add_argument("--upsample", type=int, default=None)
+    parser.add_argument("--num-jitters", type=int, default=None)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW * 1000)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    parser.add_argument("--metrics", action="store_true", help="serve per-stage timings on GET /metrics")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+    serve(args.host, args.port, args.verbose, face_dir=args.face_dir, workers=args.workers,
+          detection_scale=args.detection_scale, batch_window=args.batch_window_ms / 1000,
+          max_batch=args.max_batch, queue_size=args.queue_size,
+          detector=detector_config(args.detector, args.upsample, args.num_jitters))
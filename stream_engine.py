@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import metrics
+
+from batch_recognition import FaceResult, warm_worker
+from detection import DETECTION_SCALE, check_detection_scale
+from detectors import BACKENDS, detector_config
+from gallery import FACE_DIR, TOLERANCE, get_gallery
+from video_pipeline import FrameSlots, encode_shared_frame
+
+# Recognition events waiting for the consumer of StreamEngine.events(); when it falls behind,
+# streams stop taking frames and the capture threads drop them instead.
+EVENT_QUEUE_SIZE = 256
+# Latencies kept per stream for the percentiles in stats().
+LATENCY_WINDOW = 1000
+_DONE = object()
+
+# latency is seconds from the frame being read off the source to the event being emitted.
+RecognitionEvent = namedtuple("RecognitionEvent", ["stream", "frame_number", "faces", "latency"])
+
+
+def open_capture(source):
+    # "0", "1", ... are camera indexes; anything else is a file path or an rtsp:// / http:// URL.
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        return cv2.VideoCapture(int(source))
+    return cv2.VideoCapture(source)
+
+
+class StreamSource:
+    # Reads one source on its own thread and keeps only the newest frame: a frame that is
+    # replaced before recognition picks it up is counted as dropped.
+
+    def __init__(self, name, source, realtime=True):
+        self.name = name
+        self.source = source
+        # Local files are read at their own frame rate so they behave like live cameras.
+        self.realtime = realtime and isinstance(source, str) and os.path.isfile(source)
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.finished = False
+        self.error = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.started = None
+        self.stopped = None
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            latest, self._latest = self._latest, None
+        return latest
+
+    def capture(self, notify, stop):
+        # notify() is called (thread-safely) whenever a frame arrives or the source ends.
+        cap = open_capture(self.source)
+        self.started = time.perf_counter()
+        try:
+            if not cap.isOpened():
+                self.error = f"could not open {self.source}"
+                return
+            fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+            while not stop.is_set():
+                with metrics.stage("decode"):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+                self.captured += 1
+                if self.realtime and fps > 0:
+                    delay = self.started + self.captured / fps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self._lock:
+                    if self._latest is not None:
+                        self.dropped += 1
+                    self._latest = (self.captured, time.perf_counter(), frame)
+                notify()
+        finally:
+            cap.release()
+            self.stopped = time.perf_counter()
+            self.finished = True
+            notify()
+
+    def stats(self):
+        elapsed = (self.stopped or time.perf_counter()) - self.started if self.started else 0.0
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "captured": self.captured,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "fps": self.processed / elapsed if elapsed else 0.0,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "error": self.error,
+        }
+
+
+class StreamEngine:
+    # Recognises faces on many sources at once with one gallery and one pool of encoder processes:
+    #
+    #     engine = StreamEngine({"door": "rtsp://...", "lobby": "lobby.mp4"})
+    #     async for event in engine.events():
+    #         ...
+    #
+    # Each stream has at most one frame in the pool at a time, so latency stays bounded by one
+    # encode no matter how far behind the pool is; the rest are dropped at the source.
+
+    def __init__(self, sources, matcher=None, workers=None, detection_scale=DETECTION_SCALE, tolerance=TOLERANCE,
+                 realtime=True, pool=None, detector=None):
+        if not isinstance(sources, dict):
+            sources = {str(source): source for source in sources}
+        self.streams = {name: StreamSource(name, source, realtime) for name, source in sources.items()}
+        self.matcher = matcher if matcher is not None else get_gallery(FACE_DIR)
+        self.workers = workers or min(len(self.streams), os.cpu_count() or 1)
+        self.detection_scale = check_detection_scale(detection_scale)
+        # Resolved here so the encoder processes use this process's default backend.
+        self.detector = detector_config(detector)
+        self.tolerance = tolerance
+        self.pool = pool
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {name: stream.stats() for name, stream in self.streams.items()}
+
+    async def _consume(self, stream, notify, pool, slots, events):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Read finished before taking, so the last frame is never mistaken for the end.
+            finished = stream.finished
+            item = stream.take()
+            if item is None:
+                if finished:
+                    return
+                notify.clear()
+                await notify.wait()
+                continue
+            frame_number, captured_at, frame = item
+            shared = slots.put(frame)
+            try:
+                locations, encodings, _ = metrics.unwrap(await loop.run_in_executor(
+                    pool, metrics.in_worker(pool, encode_shared_frame), shared, self.detection_scale, None,
+                    self.detector))
+            finally:
+                slots.release(shared)
+            # Matched on another thread so a large gallery does not hold up the other streams.
+            matches = (await loop.run_in_executor(None, self.matcher.match, encodings, self.tolerance)
+                       if len(encodings) else [])
+            faces = [FaceResult(tuple(int(v) for v in location), match.name, match.distance, match.known)
+                     for location, match in zip(locations, matches)]
+            stream.processed += 1
+            latency = time.perf_counter() - captured_at
+            stream.latencies.append(latency)
+            metrics.observe("stream_latency_seconds", latency, stream=stream.name)
+            await events.put(RecognitionEvent(stream.name, frame_number, faces, latency))
+
+    async def events(self):
+        # Async iterator of RecognitionEvent; ends when every source has ended or stop() was called.
+        loop = asyncio.get_running_loop()
+        pool = self.pool or ProcessPoolExecutor(self.workers, initializer=warm_worker)
+        # Frames go to the pool through shared memory instead of being pickled.
+        slots = FrameSlots()
+        events = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self._stop.clear()
+
+        threads = []
+        consumers = []
+        for stream in self.streams.values():
+            notify = asyncio.Event()
+
+            def wake(notify=notify):
+                try:
+                    loop.call_soon_threadsafe(notify.set)
+                except RuntimeError:
+                    pass  # The loop already closed.
+
+            threads.append(threading.Thread(target=stream.capture, args=(wake, self._stop),
+                                            name=f"capture-{stream.name}", daemon=True))
+            consumers.append(asyncio.ensure_future(self._consume(stream, notify, pool, slots, events)))
+        for thread in threads:
+            thread.start()
+
+        async def finish():
+            try:
+                await asyncio.gather(*consumers)
+            finally:
+                await events.put(_DONE)
+
+        finisher = asyncio.ensure_future(finish())
+        try:
+            while True:
+                event = await events.get()
+                if event is _DONE:
+                    break
+                yield event
+            await finisher
+        finally:
+            self._stop.set()
+            for task in consumers + [finisher]:
+                task.cancel()
+            for thread in threads:
+                await loop.run_in_executor(None, thread.join)
+            if self.pool is None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            slots.close()
+
+
+def print_stats(stats):
+    print(f"{'stream':>20} {'captured':>9} {'processed':>10} {'dropped':>8} {'fps':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, stream in stats.items():
+        p50 = f"{stream['latency_p50_ms']:.1f}" if stream["latency_p50_ms"] is not None else "-"
+        p99 = f"{stream['latency_p99_ms']:.1f}" if stream["latency_p99_ms"] is not None else "-"
+        print(f"{name[-20:]:>20} {stream['captured']:>9} {stream['processed']:>10} {stream['dropped']:>8} "
+              f"{stream['fps']:>7.1f} {p50:>8} {p99:>8}")
+        if stream["error"]:
+            print(f"[ERROR] {name}: {stream['error']}")
+
+
+async def _main(args):
+    engine = StreamEngine(args.sources, workers=args.workers, detection_scale=args.detection_scale,
+                          realtime=not args.as_fast_as_possible,
+                          detector=detector_config(args.detector, args.upsample, args.num_jitters))
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    async for event in engine.events():
+        if not args.quiet and event.faces:
+            labels = ", ".join(face.label for face in event.faces)
+            print(f"[{event.stream}] frame {event.frame_number}: {labels} ({event.latency * 1000:.0f} ms)")
+        if deadline is not None and time.perf_counter() > deadline:
+            engine.stop()
+    print_stats(engine.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognise faces on several cameras, RTSP streams or video files")
+    parser.add_argument("sources", nargs="+", help="camera index, stream URL or video file")
+    parser.add_argument("--workers", type=int, default=None, help="encoder processes shared by all streams")
+    parser.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    parser.add_argument("--detector", choices=BACKENDS, default=None, help="default: see detectors.py")
+    parser.add_argument("--upsample", type=int, default=None)
+    parser.add_argument("--num-jitters", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--as-fast-as-possible", action="store_true",
+                        help="read video files as fast as they decode instead of at their frame rate")
+    parser.add_argument("--quiet", action="store_true", help="only print the per-stream summary")
+    asyncio.run(_main(parser.parse_args()))
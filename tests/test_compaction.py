@@ -0,0 +1,42 @@
+import numpy as np
+
+from compaction import DEDUP_DISTANCE, compact_encodings, deduplicate_rows
+from gallery import ENCODING_SIZE, build_gallery_data
+
+
+def webcam_burst(rng, poses, frames):
+    # frames encodings per pose, each a small step from the pose: like consecutive webcam frames.
+    centres = rng.normal(0, 0.1, (poses, ENCODING_SIZE))
+    steps = rng.normal(0, DEDUP_DISTANCE / 4 / np.sqrt(ENCODING_SIZE), (poses, frames, ENCODING_SIZE))
+    return (centres[:, None, :] + steps).reshape(-1, ENCODING_SIZE).astype(np.float32)
+
+
+def test_compact_encodings_bounds():
+    rng = np.random.default_rng(0)
+    encodings = webcam_burst(rng, 8, 25)
+    # Near-duplicates collapse to one per pose, well under the bound.
+    assert len(compact_encodings(encodings, 32)) == 8
+    # Over the bound, poses are clustered down to exactly max_prototypes.
+    prototypes = compact_encodings(webcam_burst(rng, 60, 3), 32)
+    assert prototypes.shape == (32, ENCODING_SIZE)
+    assert prototypes.dtype == np.float32
+    # None keeps every encoding; fewer than two are returned as they are.
+    assert len(compact_encodings(encodings, None)) == len(encodings)
+    assert len(compact_encodings(encodings[:1], 32)) == 1
+    assert len(compact_encodings(encodings[:0], 32)) == 0
+
+
+def test_compacted_gallery_still_recognises_every_pose():
+    rng = np.random.default_rng(1)
+    faces = {f"person_{i}": webcam_burst(rng, 4, 30) for i in range(10)}
+    compacted = build_gallery_data({name: compact_encodings(encodings, 4) for name, encodings in faces.items()})
+    for name, encodings in faces.items():
+        assert {match.name for match in compacted.match(encodings)} == {name}
+
+
+def test_deduplicate_rows_keeps_first_of_each_group():
+    encodings = np.zeros((5, ENCODING_SIZE), dtype=np.float32)
+    encodings[2:, 0] = 1.0
+    encodings[3, 1] = DEDUP_DISTANCE / 2
+    assert deduplicate_rows(encodings) == [0, 2]
+    assert deduplicate_rows(encodings[:0]) == []
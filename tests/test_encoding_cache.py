@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+from encoding_cache import BGR_PARAMS, EncodingCache, cached_faces
+from gallery import ENCODING_SIZE
+
+
+class Encoder:
+    # Stands in for detection + encoding and counts how often it actually ran.
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return [(1, 2, 3, 4)], [np.full(ENCODING_SIZE, 0.5, dtype=np.float32)]
+
+
+def test_hit_after_miss(tmp_path):
+    cache = EncodingCache(str(tmp_path))
+    encoder = Encoder()
+    first = cached_faces(cache, b"image", BGR_PARAMS, encoder)
+    second = cached_faces(cache, b"image", BGR_PARAMS, encoder)
+    assert (first[2], second[2], encoder.calls) == (False, True, 1)
+    assert second[0] == [(1, 2, 3, 4)]
+    np.testing.assert_array_equal(second[1], first[1])
+    # Another process (a fresh cache object) reads the same entry.
+    assert cached_faces(EncodingCache(str(tmp_path)), b"image", BGR_PARAMS, encoder)[2]
+    assert cache.stats()["hits"] == 1
+
+
+def test_changed_image_or_parameters_miss(tmp_path):
+    cache = EncodingCache(str(tmp_path))
+    encoder = Encoder()
+    cached_faces(cache, b"image", BGR_PARAMS, encoder)
+    for content, params in ((b"image2", BGR_PARAMS),
+                            (b"image", dict(BGR_PARAMS, channels="rgb")),
+                            (b"image", dict(BGR_PARAMS, scale=0.5)),
+                            (b"image", dict(BGR_PARAMS, detector="cnn"))):
+        assert not cached_faces(cache, content, params, encoder)[2]
+    assert encoder.calls == 5
+
+
+def test_corrupt_entry_is_recomputed(tmp_path):
+    cache = EncodingCache(str(tmp_path))
+    encoder = Encoder()
+    cached_faces(cache, b"image", BGR_PARAMS, encoder)
+    key = cache.key(b"image", BGR_PARAMS)
+    with open(cache._path(key), "wb") as f:
+        f.write(b"truncated")
+    assert not cached_faces(cache, b"image", BGR_PARAMS, encoder)[2]
+    assert cached_faces(cache, b"image", BGR_PARAMS, encoder)[2]
+    assert encoder.calls == 2
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = EncodingCache(str(tmp_path))
+    encoder = Encoder()
+    cached_faces(cache, b"old", BGR_PARAMS, encoder)
+    old_path = cache._path(cache.key(b"old", BGR_PARAMS))
+    os.utime(old_path, (0, 0))
+    cache.max_bytes = os.path.getsize(old_path) * 1.5
+    cached_faces(cache, b"new", BGR_PARAMS, encoder)
+    assert not os.path.exists(old_path)
+    assert cache.stats()["evictions"] == 1
+    assert cached_faces(cache, b"new", BGR_PARAMS, encoder)[2]
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from face_index import ExactIndex, IVFIndex, make_index
+from gallery import ENCODING_SIZE
+
+SIGMA = 0.02
+
+
+def stub_faces(rng, identities, start=0):
+    faces = {}
+    for i in range(start, start + identities):
+        centre = rng.normal(0, 0.1, ENCODING_SIZE)
+        faces[f"person_{i:04d}"] = (centre + rng.normal(0, SIGMA, (int(rng.integers(1, 6)), ENCODING_SIZE))
+                                    ).astype(np.float32)
+    return faces
+
+
+def queries_for(rng, faces, count):
+    names = sorted(faces)
+    picked = rng.integers(0, len(names), size=count)
+    return np.stack([faces[names[i]][0] + rng.normal(0, SIGMA, ENCODING_SIZE) for i in picked]).astype(np.float32)
+
+
+def recall(index, exact, queries):
+    # Share of queries whose nearest identity is the one exact search finds.
+    return np.mean([got.name == want.name for got, want in zip(index.match(queries), exact.match(queries))])
+
+
+def build(index, faces):
+    exact = ExactIndex()
+    for name, encodings in faces.items():
+        index.add(name, encodings)
+        exact.add(name, encodings)
+    return exact
+
+
+def check_recall(index, rng, minimum):
+    faces = stub_faces(rng, 600)
+    exact = build(index, faces)
+    assert recall(index, exact, queries_for(rng, faces, 200)) >= minimum
+
+    # Removed people are never found again; re-enrolled ones are found by their new encodings.
+    removed = sorted(faces)[::3]
+    for name in removed:
+        index.remove(name)
+        exact.remove(name)
+        del faces[name]
+    reenrolled = dict(zip(sorted(faces)[:20], stub_faces(rng, 20, start=1000).values()))
+    for name, encodings in dict(reenrolled, **stub_faces(rng, 20, start=2000)).items():
+        faces[name] = encodings
+        index.add(name, encodings)
+        exact.add(name, encodings)
+    queries = queries_for(rng, faces, 200)
+    assert recall(index, exact, queries) >= minimum
+    assert not {match.name for match in index.match(queries)} & set(removed)
+    return exact
+
+
+def test_ivf_recall_against_exact_index():
+    rng = np.random.default_rng(0)
+    # Small enough to be trained into 16 lists; probing every list is exact search.
+    index = IVFIndex(nlist=16, nprobe=4, min_train_size=256)
+    exact = check_recall(index, rng, 0.95)
+    assert index._centroids is not None
+    index.nprobe = 16
+    queries = rng.normal(0, 0.1, (50, ENCODING_SIZE)).astype(np.float32)
+    for got, want in zip(index.match(queries), exact.match(queries)):
+        assert got.name == want.name
+        assert got.distance == pytest.approx(want.distance, abs=1e-4)
+
+
+def test_hnsw_recall_against_exact_index():
+    pytest.importorskip("hnswlib")
+    rng = np.random.default_rng(1)
+    index = make_index("hnsw")
+    check_recall(index, rng, 0.95)
+    # More asked for than is left after deletions.
+    for name in list(index._rows)[1:]:
+        index.remove(name)
+    assert len(index.match(queries_for(rng, {"x": np.zeros((1, ENCODING_SIZE))}, 3))) == 3
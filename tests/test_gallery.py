@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from gallery import ENCODING_SIZE, TOLERANCE, build_gallery_data
+
+face_recognition = pytest.importorskip("face_recognition")
+
+SIGMA = 0.02
+
+
+def stub_faces(rng, identities):
+    # Centres ~1.6 apart; a query near a person is within ~0.4 of every one of their encodings.
+    faces = {}
+    for i in range(identities):
+        centre = rng.normal(0, 0.1, ENCODING_SIZE)
+        faces[f"person_{i:02d}"] = centre + rng.normal(0, SIGMA, (int(rng.integers(1, 6)), ENCODING_SIZE))
+    return faces
+
+
+def baseline_label(known_faces, face_encoding, tolerance):
+    # The loop the app used before the gallery: the first person with any encoding within tolerance.
+    for name, known_face_encodings in known_faces.items():
+        if True in face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance):
+            return name
+    return "Unknown"
+
+
+def test_match_agrees_with_compare_faces():
+    rng = np.random.default_rng(0)
+    known_faces = stub_faces(rng, 20)
+    data = build_gallery_data(known_faces)
+    names = sorted(known_faces)
+    queries = [known_faces[names[i]][0] + rng.normal(0, SIGMA, ENCODING_SIZE) for i in rng.integers(0, 20, 30)]
+    # Strangers: nobody is within tolerance of them.
+    queries += list(rng.normal(0, 0.1, (10, ENCODING_SIZE)))
+
+    matches = data.match(np.array(queries), TOLERANCE)
+    assert sum(match.known for match in matches) == 30
+    for query, match in zip(queries, matches):
+        assert (match.name if match.known else "Unknown") == baseline_label(known_faces, query, TOLERANCE)
+        distances = {name: face_recognition.face_distance(encodings, query).min()
+                     for name, encodings in known_faces.items()}
+        assert match.name == min(distances, key=distances.get)
+        assert match.distance == pytest.approx(distances[match.name], abs=1e-4)
+        assert match.known == any(face_recognition.compare_faces(np.concatenate(list(known_faces.values())), query,
+                                                                  TOLERANCE))
+
+
+def test_match_on_an_empty_gallery():
+    matches = build_gallery_data({}).match(np.zeros((2, ENCODING_SIZE)))
+    assert [(match.name, match.known) for match in matches] == [(None, False), (None, False)]
+    assert build_gallery_data({"ann": np.zeros((1, ENCODING_SIZE))}).match([]) == []
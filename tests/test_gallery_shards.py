@@ -0,0 +1,142 @@
+import multiprocessing
+import threading
+
+import numpy as np
+import pytest
+
+import gallery_shards
+from face_index import ExactIndex
+from gallery import ENCODING_SIZE
+from gallery_shards import ShardedIndex, serve_shard
+
+SHARDS = 3
+SIGMA = 0.05
+
+
+def stub_faces(rng, identities, start=0):
+    # 1-6 encodings per identity around its own random centre, so the shards end up uneven.
+    faces = {}
+    for i in range(start, start + identities):
+        centre = rng.normal(0, 0.1, ENCODING_SIZE)
+        faces[f"person_{i:03d}"] = (centre + rng.normal(0, SIGMA, (int(rng.integers(1, 7)), ENCODING_SIZE))
+                                    ).astype(np.float32)
+    return faces
+
+
+def queries_for(rng, faces, count):
+    names = sorted(faces)
+    picked = rng.integers(0, len(names), size=count)
+    return np.stack([faces[names[i]][0] + rng.normal(0, SIGMA, ENCODING_SIZE) for i in picked]).astype(np.float32)
+
+
+def add_all(faces, *indexes):
+    for name, encodings in faces.items():
+        for index in indexes:
+            index.add(name, encodings)
+
+
+def assert_same_matches(index, exact, queries):
+    for got, want in zip(index.match(queries), exact.match(queries)):
+        assert got.name == want.name
+        assert got.known == want.known
+        assert got.distance == pytest.approx(want.distance, abs=1e-4)
+        assert got.margin == pytest.approx(want.margin, abs=1e-4)
+
+
+def assert_one_shard_each(index, faces):
+    # An identity held by two shards would come back from both: its own encoding is at distance 0
+    # on each, so it would fill both of the top two places.
+    names = sorted(faces)
+    for name, found in zip(names, index.search(np.stack([faces[name][0] for name in names]), k=2)):
+        assert found[0][0] == name
+        assert len(found) < 2 or found[1][0] != name
+    stats = index.stats()
+    assert sum(shard["identities"] for shard in stats) == len(faces)
+    assert sum(shard["encodings"] for shard in stats) == sum(len(encodings) for encodings in faces.values())
+    return [shard["encodings"] for shard in stats]
+
+
+@pytest.fixture
+def index():
+    index = ShardedIndex(SHARDS)
+    try:
+        yield index
+    finally:
+        index.close()
+
+
+def test_match_equals_exact_index(index):
+    rng = np.random.default_rng(0)
+    faces = stub_faces(rng, 60)
+    exact = ExactIndex()
+    add_all(faces, index, exact)
+    assert len({shard["pid"] for shard in index.stats()}) == SHARDS
+    assert_same_matches(index, exact, queries_for(rng, faces, 50))
+    # Far from everyone: nothing matches, but the nearest identity is still reported.
+    assert_same_matches(index, exact, np.full((1, ENCODING_SIZE), 5.0, dtype=np.float32))
+
+
+def test_add_remove_and_rebalance_keep_identities_on_one_shard(index):
+    rng = np.random.default_rng(1)
+    # Equal-sized identities go to the least loaded shard in turn: person i to shard i % SHARDS.
+    faces = {name: encodings[:1].repeat(3, axis=0) + rng.normal(0, SIGMA, (3, ENCODING_SIZE)).astype(np.float32)
+             for name, encodings in stub_faces(rng, 45).items()}
+    exact = ExactIndex()
+    add_all(faces, index, exact)
+    assert assert_one_shard_each(index, faces) == [45, 45, 45]
+
+    # Emptying the first shard forces the next call to move identities onto it.
+    for name in sorted(faces)[::SHARDS]:
+        index.remove(name)
+        exact.remove(name)
+        del faces[name]
+    loads = assert_one_shard_each(index, faces)
+    assert min(loads) > 0
+    # Re-adding replaces an identity wherever it was.
+    replaced = sorted(faces)[0]
+    faces[replaced] = stub_faces(rng, 1, start=900)["person_900"]
+    added = stub_faces(rng, 5, start=100)
+    faces.update(added)
+    add_all(dict(added, **{replaced: faces[replaced]}), index, exact)
+
+    loads = assert_one_shard_each(index, faces)
+    # Balanced to within the tolerance, give or take one identity (at most 6 encodings).
+    assert max(loads) - min(loads) <= index.rebalance_tolerance * sum(loads) / SHARDS + 6
+    assert_same_matches(index, exact, queries_for(rng, faces, 40))
+
+
+def test_shard_error_leaves_the_other_shards_in_step(monkeypatch):
+    # Shards served from threads of this process, so one of them can be made to fail.
+    def search(shard, queries, k):
+        if "poison" in shard.faces:
+            raise ValueError("bad shard")
+        return original_search(shard, queries, k)
+
+    original_search = gallery_shards.Shard.search
+    monkeypatch.setattr(gallery_shards.Shard, "search", search)
+    authkey = b"test"
+    addresses = []
+    for _ in range(SHARDS):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        threading.Thread(target=serve_shard, args=(("127.0.0.1", 0), authkey, sender), daemon=True).start()
+        addresses.append(receiver.recv())
+    given = list(addresses)
+
+    rng = np.random.default_rng(2)
+    faces = stub_faces(rng, 30)
+    index = ShardedIndex(addresses=addresses, authkey=authkey)
+    try:
+        assert addresses == given
+        exact = ExactIndex()
+        add_all(faces, index, exact)
+        queries = queries_for(rng, faces, 20)
+        assert_same_matches(index, exact, queries)
+
+        index.add("poison", faces[sorted(faces)[0]])
+        with pytest.raises(RuntimeError, match="bad shard"):
+            index.match(queries)
+        index.remove("poison")
+        assert_same_matches(index, exact, queries)
+        assert_one_shard_each(index, faces)
+    finally:
+        index.close()
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+
+from gallery import ENCODING_SIZE, Gallery, face_data_path
+from gallery_store import GalleryStore, migrate_legacy_files, save_face_data
+
+
+def encodings(value, count):
+    return np.full((count, ENCODING_SIZE), value, dtype=np.float32)
+
+
+def stored(face_dir):
+    _, _, faces = GalleryStore(face_dir).load()
+    return {name: np.asarray(rows) for name, rows in faces.items()}
+
+
+def test_append_and_reenroll(tmp_path):
+    store = GalleryStore(str(tmp_path))
+    store.append("ann", encodings(0.1, 3))
+    store.append_many({"bob": encodings(0.2, 10), "cat": encodings(0.3, 1)})
+    table = store.read_table()
+    assert table["rows"] == 14
+    assert {name: count for name, (_, count) in table["identities"].items()} == {"ann": 3, "bob": 10, "cat": 1}
+
+    # Re-enrolling appends new rows and repoints the table; the old ones are garbage until compaction.
+    store.append("ann", encodings(0.4, 1))
+    table = store.read_table()
+    assert (table["rows"], table["generation"]) == (15, 0)
+    faces = stored(str(tmp_path))
+    np.testing.assert_array_equal(faces["ann"], encodings(0.4, 1))
+    np.testing.assert_array_equal(faces["bob"], encodings(0.2, 10))
+    # An empty enrollment removes the person.
+    store.append("cat", encodings(0, 0))
+    assert "cat" not in stored(str(tmp_path))
+
+
+def test_compaction_switches_generation(tmp_path):
+    face_dir = str(tmp_path)
+    store = GalleryStore(face_dir)
+    store.append_many({"ann": encodings(0.1, 4), "bob": encodings(0.2, 4)})
+    gallery = Gallery(face_dir, check_interval=0)
+    assert gallery.load().names == ["ann", "bob"]
+
+    # 4 of 9 rows become garbage, over COMPACT_GARBAGE_RATIO: the append compacts into generation 1.
+    store.append("ann", encodings(0.3, 1))
+    table = store.read_table()
+    assert (table["generation"], table["rows"], table["matrix"]) == (1, 5, "gallery.1.f32")
+    # The old generation stays until the next compaction, for readers that have just read the old table.
+    assert os.path.exists(os.path.join(face_dir, "gallery.0.f32"))
+    np.testing.assert_array_equal(gallery.load().as_dict()["ann"], encodings(0.3, 1))
+    assert gallery.match(encodings(0.2, 1))[0].name == "bob"
+
+    store.compact()
+    assert store.read_table()["generation"] == 2
+    assert sorted(name for name in os.listdir(face_dir) if name.endswith(".f32")) == ["gallery.1.f32",
+                                                                                     "gallery.2.f32"]
+    assert stored(face_dir).keys() == {"ann", "bob"}
+
+
+def test_store_supersedes_legacy_files(tmp_path):
+    face_dir = str(tmp_path)
+    np.save(face_data_path("ann", face_dir), encodings(0.1, 2))
+    np.save(face_data_path("bob", face_dir), encodings(0.2, 2))
+    gallery = Gallery(face_dir, check_interval=0)
+    assert len(gallery.load().as_dict()["ann"]) == 2
+
+    save_face_data("ann", encodings(0.3, 1), face_dir)
+    faces = gallery.load().as_dict()
+    np.testing.assert_array_equal(faces["ann"], encodings(0.3, 1))
+    assert len(faces["bob"]) == 2
+
+    # Migration copies only the people the store does not have yet and leaves the files in place.
+    assert migrate_legacy_files(face_dir) == 1
+    assert stored(face_dir).keys() == {"ann", "bob"}
+    np.testing.assert_array_equal(stored(face_dir)["ann"], encodings(0.3, 1))
+    assert os.path.exists(face_data_path("bob", face_dir))
+
+
+def test_unknown_store_version_is_refused(tmp_path):
+    (tmp_path / "gallery.json").write_text('{"version": 99}')
+    with pytest.raises(ValueError, match="Unsupported gallery store version 99"):
+        GalleryStore(str(tmp_path)).read_table()
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+import models
+import video_pipeline
+from gallery import ENCODING_SIZE, Match
+from stream_engine import StreamEngine
+
+FRAMES = 40
+SIZE = (96, 64)
+
+
+def write_clip(path, frames, seed):
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 25, SIZE)
+    for _ in range(frames):
+        writer.write(rng.integers(0, 256, (SIZE[1], SIZE[0], 3), dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+class StubMatcher:
+    def __init__(self):
+        self.threads = set()
+
+    def match(self, encodings, tolerance):
+        self.threads.add(threading.get_ident())
+        return [Match("someone", 0.1, 0.5, True) for _ in encodings]
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    # One face per frame, after an uneven delay so the two streams finish out of step.
+    rng = np.random.default_rng(0)
+
+    def detect_faces(frame, scale, config):
+        time.sleep(float(rng.uniform(0, 0.01)))
+        return [(0, 10, 10, 0)]
+
+    monkeypatch.setattr(video_pipeline, "detect_faces", detect_faces)
+    monkeypatch.setattr(models, "face_encodings",
+                        lambda frame, locations, num_jitters=1: [np.zeros(ENCODING_SIZE) for _ in locations])
+
+
+def test_events_arrive_in_order_per_stream(tmp_path, stub_models):
+    sources = {"a": write_clip(tmp_path / "a.avi", FRAMES, 1), "b": write_clip(tmp_path / "b.avi", FRAMES // 2, 2)}
+    matcher = StubMatcher()
+
+    async def collect():
+        with ThreadPoolExecutor(2) as pool:
+            engine = StreamEngine(sources, matcher, realtime=False, pool=pool)
+            return engine, threading.get_ident(), [event async for event in engine.events()]
+
+    engine, loop_thread, events = asyncio.run(collect())
+    stats = engine.stats()
+    for name, frames in (("a", FRAMES), ("b", FRAMES // 2)):
+        numbers = [event.frame_number for event in events if event.stream == name]
+        assert numbers and numbers == sorted(set(numbers))
+        assert stats[name]["captured"] == frames
+        assert stats[name]["processed"] == len(numbers)
+        assert stats[name]["error"] is None
+    assert all([face.label for face in event.faces] == ["someone"] for event in events)
+    assert loop_thread not in matcher.threads
@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+import models
+import video_pipeline
+from gallery import ENCODING_SIZE
+from video_pipeline import run_pipeline
+
+FRAMES = 30
+FACES_AT = {12, 20}
+SIZE = (64, 48)
+# Gray level of frame n is n * LEVEL, so a stub detector can tell which frame it was given.
+LEVEL = 8
+
+
+def write_numbered_clip(path):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, SIZE)
+    for number in range(1, FRAMES + 1):
+        writer.write(np.full((SIZE[1], SIZE[0], 3), number * LEVEL, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    # Frames before the first face take longest, so later frames finish first.
+    def detect_faces(frame, scale, config):
+        number = int(round(frame.mean() / LEVEL))
+        time.sleep(0.02 if number < min(FACES_AT) else 0.0)
+        return [(0, 10, 10, 0)] if number in FACES_AT else []
+
+    monkeypatch.setattr(video_pipeline, "detect_faces", detect_faces)
+    monkeypatch.setattr(models, "face_encodings",
+                        lambda frame, locations, num_jitters=1: [np.zeros(ENCODING_SIZE) for _ in locations])
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_stops_at_the_first_face_in_frame_order(tmp_path, stub_models, workers):
+    clip = write_numbered_clip(tmp_path / "numbered.avi")
+    seen = []
+
+    def on_faces(number, timestamp, locations, encodings):
+        seen.append(number)
+        return bool(encodings)
+
+    # Threads stand in for the worker processes, so the stubs above are the ones that run.
+    with ThreadPoolExecutor(workers) as pool:
+        processed, decoded, _ = run_pipeline(clip, on_faces, workers=workers,
+                                             executor=pool if workers > 1 else None)
+    first = min(FACES_AT)
+    assert seen == list(range(1, first + 1))
+    assert processed == first
+    assert first <= decoded <= FRAMES
+
+
+def test_sampling_and_end_time(tmp_path, stub_models):
+    clip = write_numbered_clip(tmp_path / "numbered.avi")
+    seen = []
+    run_pipeline(clip, lambda number, *_: seen.append(number), sample_every=3, end_time=1.5, workers=1)
+    # 10 frames/s: frame n is at (n - 1) / 10 s, so 1.5 s is frame 16.
+    assert seen == [1, 4, 7, 10, 13, 16]
@@ -0,0 +1,168 @@
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+import models
+
+from detection import DETECTION_SCALE, detect_faces
+from detectors import detector_config
+from gallery import TOLERANCE
+
+# Run HOG detection every DETECT_EVERY frames and re-encode a tracked face every REVERIFY_EVERY frames;
+# frames in between only move the boxes with sparse optical flow.
+DETECT_EVERY = 5
+REVERIFY_EVERY = 30
+# Mean absolute difference (0-255) between tiny grayscale thumbnails that counts as a scene change.
+SCENE_CHANGE_THRESHOLD = 25.0
+SCENE_THUMBNAIL = (64, 48)
+IOU_MATCH = 0.3
+MIN_TRACK_POINTS = 4
+
+LK_PARAMS = dict(winSize=(15, 15), maxLevel=2, criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+def iou(a, b):
+    # Boxes are (top, right, bottom, left) like face_recognition.face_locations.
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / max(area_a + area_b - intersection, 1e-9)
+
+
+class Track:
+    def __init__(self, box, label, verified_at):
+        self.box = np.asarray(box, dtype=np.float32)
+        self.label = label
+        self.verified_at = verified_at
+        self.points = None
+
+    def location(self):
+        return tuple(int(round(v)) for v in self.box)
+
+    def seed_points(self, gray):
+        top, right, bottom, left = self.location()
+        mask = np.zeros_like(gray)
+        mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+        self.points = cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=3, mask=mask)
+
+
+class FaceTracker:
+    # Tracks faces between detections so video can be labelled at display frame rate.
+    # detect_every=1 and reverify_every=1 reproduce detect-and-encode-every-frame.
+
+    def __init__(self, matcher, detect_every=DETECT_EVERY, reverify_every=REVERIFY_EVERY,
+                 scene_change_threshold=SCENE_CHANGE_THRESHOLD, tolerance=TOLERANCE, detection_scale=DETECTION_SCALE,
+                 gate=None, detector=None):
+        # gate: a frame_gate.FrameGate; small or blurred faces are tracked but not encoded until they improve.
+        # detector: a backend name or detectors.DetectorConfig.
+        self.matcher = matcher
+        self.detector = detector_config(detector)
+        self.gate = gate
+        self.detection_scale = detection_scale
+        self.detect_every = max(1, detect_every)
+        self.reverify_every = max(1, reverify_every)
+        self.scene_change_threshold = scene_change_threshold
+        self.tolerance = tolerance
+        self.tracks = []
+        self.frames = 0
+        self.detections = 0
+        self.encodings = 0
+        self._since_detection = 0
+        self._prev_gray = None
+        self._prev_thumbnail = None
+        self._start = None
+
+    @property
+    def duty_cycle(self):
+        return self.detections / self.frames if self.frames else 0.0
+
+    @property
+    def fps(self):
+        if not self.frames:
+            return 0.0
+        return self.frames / max(time.perf_counter() - self._start, 1e-9)
+
+    def _scene_changed(self, gray):
+        thumbnail = cv2.resize(gray, SCENE_THUMBNAIL, interpolation=cv2.INTER_AREA)
+        previous, self._prev_thumbnail = self._prev_thumbnail, thumbnail
+        if previous is None:
+            return True
+        return cv2.absdiff(previous, thumbnail).mean() > self.scene_change_threshold
+
+    def _detect(self, frame, gray):
+        locations = detect_faces(frame, self.detection_scale, self.detector)
+        tracks = []
+        to_encode = []
+        unmatched = list(self.tracks)
+        for location in locations:
+            best = max(unmatched, key=lambda track: iou(track.box, location), default=None)
+            if best is not None and iou(best.box, location) >= IOU_MATCH:
+                unmatched.remove(best)
+                track = best
+                track.box = np.asarray(location, dtype=np.float32)
+            else:
+                track = Track(location, "Unknown", verified_at=None)
+            if track.verified_at is None or self.frames - track.verified_at >= self.reverify_every:
+                to_encode.append(track)
+            track.seed_points(gray)
+            tracks.append(track)
+
+        if to_encode and self.gate is not None:
+            to_encode = [track for track in to_encode if self.gate.accept_face(frame, track.location())]
+        if to_encode:
+            encodings = models.face_encodings(frame, [track.location() for track in to_encode],
+                                              self.detector.num_jitters)
+            for track, match in zip(to_encode, self.matcher.match(encodings, self.tolerance)):
+                track.label = match.name if match.known else "Unknown"
+                track.verified_at = self.frames
+            self.encodings += len(to_encode)
+
+        self.tracks = tracks
+        self.detections += 1
+        self._since_detection = 0
+
+    def _propagate(self, gray):
+        for track in self.tracks:
+            if track.points is None or len(track.points) < MIN_TRACK_POINTS:
+                track.seed_points(self._prev_gray)
+                if track.points is None:
+                    continue
+            points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points, None, **LK_PARAMS)
+            good = status.reshape(-1) == 1
+            if not good.any():
+                track.points = None
+                continue
+            dx, dy = np.median(points[good] - track.points[good], axis=0).reshape(2)
+            track.box += np.array([dy, dx, dy, dx], dtype=np.float32)
+            track.points = points[good].reshape(-1, 1, 2)
+
+    def process(self, frame, detect=True):
+        # Returns [(location, label)] for this frame. detect=False (a frame the frame gate skipped) only
+        # moves the tracks along, so optical flow never jumps over a run of skipped frames.
+        if self._start is None:
+            self._start = time.perf_counter()
+        with metrics.stage("color_convert"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scene_changed = self._scene_changed(gray)
+        if detect and (scene_changed or self._since_detection + 1 >= self.detect_every or self._prev_gray is None):
+            self._detect(frame, gray)
+        elif self._prev_gray is not None:
+            self._since_detection += 1
+            with metrics.stage("track"):
+                self._propagate(gray)
+        self._prev_gray = gray
+        self.frames += 1
+        return [(track.location(), track.label) for track in self.tracks]
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "fps": self.fps,
+            "detections": self.detections,
+            "duty_cycle": self.duty_cycle,
+            "encodings": self.encodings,
+        }
@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from compaction import DEDUP_DISTANCE, deduplicate_rows
+from detection import DETECTION_SCALE, check_detection_scale
+from detectors import BACKENDS, detector_config
+from gallery import ENCODING_SIZE, FACE_DIR, TOLERANCE, get_gallery
+from video_pipeline import run_pipeline
+
+VIDEO_INDEX_DIR = "./video_index"
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v")
+# Faces are grouped into segments of this many seconds; within a segment near-identical encodings
+# (the same person in consecutive frames) are stored once.
+SEGMENT_SECONDS = 1.0
+# Analyse every Nth frame while indexing.
+INDEX_SAMPLE_EVERY = 5
+# Version 2 records the indexing parameters; older indexes are rebuilt.
+INDEX_VERSION = 2
+
+Appearance = namedtuple("Appearance", ["video", "name", "timestamp", "frame_number", "box", "distance"])
+
+
+def index_path_for(video_path, index_dir=VIDEO_INDEX_DIR):
+    digest = hashlib.sha1(os.path.abspath(video_path).encode()).hexdigest()[:10]
+    return os.path.join(index_dir, f"{os.path.basename(video_path)}.{digest}.npz")
+
+
+def _video_signature(video_path):
+    stat = os.stat(video_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def index_params(sample_every=INDEX_SAMPLE_EVERY, segment_seconds=SEGMENT_SECONDS, detection_scale=DETECTION_SCALE,
+                 dedup_distance=DEDUP_DISTANCE, detector=None):
+    # Everything the indexed faces depend on besides the video itself; stored in the index header.
+    return dict(sample_every=sample_every, segment_seconds=segment_seconds,
+                detection_scale=check_detection_scale(detection_scale), dedup_distance=dedup_distance, **detector_config(detector).params())
+
+
+def is_up_to_date(video_path, index_path, params=None):
+    # params: index_params() the index should have been built with; None accepts any.
+    if not os.path.exists(index_path):
+        return False
+    with np.load(index_path) as index:
+        return (int(index["version"]) == INDEX_VERSION
+                and np.array_equal(index["signature"], _video_signature(video_path))
+                and (params is None or json.loads(str(index["params"])) == params))
+
+
+def index_video(video_path, index_path=None, sample_every=INDEX_SAMPLE_EVERY, segment_seconds=SEGMENT_SECONDS,
+                workers=None, detection_scale=DETECTION_SCALE, dedup_distance=DEDUP_DISTANCE, detector=None):
+    # Decodes the video once and writes every face seen (timestamp, frame, box, float16 encoding).
+    index_path = index_path or index_path_for(video_path)
+    detector = detector_config(detector)
+    params = index_params(sample_every, segment_seconds, detection_scale, dedup_distance, detector)
+    segments = {}
+
+    def on_faces(number, timestamp, locations, encodings):
+        for location, encoding in zip(locations, encodings):
+            face = (timestamp, number, location, np.asarray(encoding, dtype=np.float32))
+            segments.setdefault(int(timestamp // segment_seconds), []).append(face)
+
+    processed, decoded, seconds = run_pipeline(video_path, on_faces, sample_every, workers=workers,
+                                               detection_scale=detection_scale, detector=detector)
+
+    faces = []
+    for segment in sorted(segments):
+        # Within a segment, only the first sighting of each face is kept.
+        segment_faces = segments[segment]
+        faces.extend(segment_faces[row]
+                     for row in deduplicate_rows([face[3] for face in segment_faces], dedup_distance))
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            version=np.int32(INDEX_VERSION),
+            video=np.array(os.path.abspath(video_path)),
+            signature=_video_signature(video_path),
+            sample_every=np.int32(sample_every),
+            params=np.array(json.dumps(params, sort_keys=True)),
+            timestamps=np.array([face[0] for face in faces], dtype=np.float32),
+            frame_numbers=np.array([face[1] for face in faces], dtype=np.int32),
+            boxes=np.array([face[2] for face in faces], dtype=np.int32).reshape(-1, 4),
+            encodings=np.array([face[3] for face in faces], dtype=np.float16).reshape(-1, ENCODING_SIZE),
+        )
+    os.replace(tmp_path, index_path)
+    return {"video": video_path, "index": index_path, "frames": processed, "faces": len(faces),
+            "seconds": seconds, "fps": processed / max(seconds, 1e-9)}
+
+
+def index_directory(video_dir, index_dir=VIDEO_INDEX_DIR, sample_every=INDEX_SAMPLE_EVERY, workers=None,
+                    detection_scale=DETECTION_SCALE, force=False, detector=None):
+    videos = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(video_dir)
+        for file in files
+        if file.lower().endswith(VIDEO_EXTENSIONS)
+    )
+    params = index_params(sample_every, detection_scale=detection_scale, detector=detector)
+    start = time.perf_counter()
+    reports = []
+    for video_path in videos:
+        index_path = index_path_for(video_path, index_dir)
+        if not force and is_up_to_date(video_path, index_path, params):
+            print(f"[INFO] {video_path} is already indexed. Skipping...")
+            continue
+        try:
+            report = index_video(video_path, index_path, sample_every, workers=workers,
+                                 detection_scale=detection_scale, detector=detector)
+        except ValueError as e:
+            print(f"[ERROR] Could not index {video_path}. Error: {e}")
+            continue
+        reports.append(report)
+        print(f"[INFO] Indexed {video_path}: {report['frames']} frames, {report['faces']} faces, "
+              f"{report['fps']:.1f} frames/s")
+
+    frames = sum(report["frames"] for report in reports)
+    seconds = time.perf_counter() - start
+    print(f"[INFO] Indexed {len(reports)} of {len(videos)} videos, {frames} frames in {seconds:.1f}s "
+          f"({frames / max(seconds, 1e-9):.1f} frames/s)")
+    return reports
+
+
+def query_index(index_path, matcher, name=None, tolerance=TOLERANCE):
+    # Matches every indexed face against the gallery in one batch; no video decoding.
+    with np.load(index_path) as index:
+        video = str(index["video"])
+        encodings = index["encodings"].astype(np.float32)
+        timestamps = index["timestamps"]
+        frame_numbers = index["frame_numbers"]
+        boxes = index["boxes"]
+
+    appearances = []
+    for i, match in enumerate(matcher.match(encodings, tolerance) if len(encodings) else []):
+        if match.known and (name is None or match.name == name):
+            appearances.append(Appearance(video, match.name, float(timestamps[i]), int(frame_numbers[i]),
+                                          tuple(int(v) for v in boxes[i]), match.distance))
+    return appearances
+
+
+def query_index_dir(matcher, name=None, index_dir=VIDEO_INDEX_DIR, tolerance=TOLERANCE):
+    appearances = []
+    if not os.path.isdir(index_dir):
+        return appearances
+    for filename in sorted(os.listdir(index_dir)):
+        if filename.endswith(".npz"):
+            appearances.extend(query_index(os.path.join(index_dir, filename), matcher, name, tolerance))
+    return appearances
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index videos once, then answer who-appears-when from the index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index_parser = subparsers.add_parser("index", help="index every video under a directory")
+    index_parser.add_argument("video_dir")
+    index_parser.add_argument("--index-dir", default=VIDEO_INDEX_DIR)
+    index_parser.add_argument("--sample-every", type=int, default=INDEX_SAMPLE_EVERY)
+    index_parser.add_argument("--workers", type=int, default=None)
+    index_parser.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    index_parser.add_argument("--detector", choices=BACKENDS, default=None, help="default: see detectors.py")
+    index_parser.add_argument("--upsample", type=int, default=None)
+    index_parser.add_argument("--force", action="store_true", help="re-index videos that did not change")
+    query_parser = subparsers.add_parser("query", help="list where enrolled people appear")
+    query_parser.add_argument("name", nargs="?", help="default: every enrolled person")
+    query_parser.add_argument("--index-dir", default=VIDEO_INDEX_DIR)
+    query_parser.add_argument("--face-dir", default=FACE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "index":
+        index_directory(args.video_dir, args.index_dir, args.sample_every, args.workers, args.detection_scale,
+                        args.force, detector_config(args.detector, args.upsample))
+    else:
+        start = time.perf_counter()
+        appearances = query_index_dir(get_gallery(args.face_dir), args.name, args.index_dir)
+        for appearance in appearances:
+            print(f"{appearance.video}\t{appearance.timestamp:9.2f}s\tframe {appearance.frame_number}\t"
+                  f"{appearance.name}\t{appearance.distance:.3f}")
+        print(f"[INFO] {len(appearances)} appearances found in {(time.perf_counter() - start) * 1000:.1f} ms")
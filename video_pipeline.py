@@ -0,0 +1,330 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+import metrics
+import models
+
+from batch_recognition import warm_worker
+from detection import DETECTION_SCALE, check_detection_scale, detect_faces
+from detectors import detector_config
+from gallery import TOLERANCE
+
+# Decoded frames queued per worker process: one being encoded and one waiting, so a worker never idles
+# while the next frame is decoded. Bounds memory (and the FrameSlots files) when decoding outruns encoding.
+FRAMES_PER_WORKER = 2
+# Seconds between on_progress calls.
+PROGRESS_INTERVAL = 0.5
+# Frames reach worker processes through files in this directory rather than through the pool's pipe;
+# /dev/shm is memory-backed, so a frame is copied once instead of pickled, sent and unpickled. A run needs
+# about workers * FRAMES_PER_WORKER + 2 frames of it (~6 MB each at 1080p).
+FRAME_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+_DONE = object()
+
+# A frame in a FrameSlots file: what a worker needs to map it.
+SharedFrame = namedtuple("SharedFrame", ["path", "shape", "dtype"])
+
+# total_frames is the number of frames that will be analysed, or None when the container does not say.
+# faces_seen and match are filled in by scan_video: match is the earliest matching face found so far.
+# frames_skipped were decoded but turned away by the frame gate; they count towards total_frames.
+Progress = namedtuple("Progress", [
+    "frames_processed", "frames_decoded", "total_frames", "seconds", "faces_seen", "match", "frames_skipped",
+], defaults=(0,))
+
+
+class VideoMatch(namedtuple("VideoMatch", [
+    "found", "frame_number", "timestamp", "name", "distance", "frames_scanned", "frames_decoded", "seconds",
+])):
+    # Truthy when a face matched, so it can stand in for the old bool result.
+
+    def __bool__(self):
+        return bool(self.found)
+
+
+def _frame_timestamp(cap, frame_number, fps):
+    if fps > 0:
+        return (frame_number - 1) / fps
+    return cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+
+def _expected_frames(cap, fps, sample_every, start_frame, end_time):
+    count = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+    if count <= 0:
+        return None
+    last = min(count, end_time * fps) if end_time is not None and fps > 0 else count
+    return max(0, int((last - start_frame + sample_every - 1) // sample_every))
+
+
+class FrameSlots:
+    # Memory-backed files that carry frames to worker processes; a slot is reused once its frame's
+    # result is back, so a run needs only as many as it keeps frames in flight. Each file is allocated
+    # in full when it is created, so a /dev/shm that is too small (Docker's default is 64 MB) is found
+    # out then and the slots move to the temporary directory, instead of a worker dying of SIGBUS.
+
+    def __init__(self):
+        self.directories = [tempfile.mkdtemp(prefix="helos-frames-", dir=FRAME_DIR)]
+        self._free = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _create(self, size):
+        with self._lock:
+            self._count += 1
+            while True:
+                path = os.path.join(self.directories[-1], f"{self._count}.frame")
+                try:
+                    with open(path, "wb") as f:
+                        if hasattr(os, "posix_fallocate"):
+                            os.posix_fallocate(f.fileno(), 0, size)
+                        else:
+                            f.truncate(size)
+                    return path
+                except OSError as e:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    if len(self.directories) > 1 or FRAME_DIR is None:
+                        raise
+                    print(f"[WARNING] No room for frames in {FRAME_DIR} ({e}); using {tempfile.gettempdir()} "
+                          f"instead. Give containers more shared memory, e.g. docker run --shm-size=1g.")
+                    self.directories.append(tempfile.mkdtemp(prefix="helos-frames-"))
+
+    def put(self, frame):
+        frame = np.ascontiguousarray(frame)
+        with self._lock:
+            slot = next((slot for slot in self._free if slot[1] >= frame.nbytes), None)
+            if slot is not None:
+                self._free.remove(slot)
+        path, size = slot if slot is not None else (self._create(frame.nbytes), frame.nbytes)
+        mapped = np.memmap(path, dtype=np.uint8, mode="r+", shape=(size,))
+        mapped[:frame.nbytes] = frame.reshape(-1).view(np.uint8)
+        del mapped
+        return SharedFrame(path, frame.shape, frame.dtype.str)
+
+    def release(self, shared):
+        with self._lock:
+            self._free.append((shared.path, os.path.getsize(shared.path)))
+
+    def close(self):
+        for directory in self.directories:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def shared_frame(shared):
+    # In a worker: the frame of a FrameSlots slot, mapped copy-on-write so nothing leaks back.
+    count = int(np.prod(shared.shape))
+    return np.memmap(shared.path, dtype=np.dtype(shared.dtype), mode="c", shape=(count,)).reshape(shared.shape)
+
+
+def _encode(frame, detection_scale, face_filter, detector):
+    # Returns (locations, encodings, reasons faces were dropped by face_filter).
+    config = detector_config(detector)
+    locations = detect_faces(frame, detection_scale, config)
+    metrics.observe("faces_per_frame", len(locations), metrics.COUNT_BUCKETS)
+    dropped = []
+    if face_filter is not None and locations:
+        locations, dropped = face_filter.split(frame, locations)
+    encodings = models.face_encodings(frame, locations, config.num_jitters) if locations else []
+    return locations, [np.asarray(encoding) for encoding in encodings], dropped
+
+
+def encode_shared_frame(shared, detection_scale=DETECTION_SCALE, face_filter=None, detector=None):
+    # Runs in a worker process.
+    return _encode(shared_frame(shared), detection_scale, face_filter, detector)
+
+
+def encode_frame(frame, detection_scale=DETECTION_SCALE, gate=None, detector=None):
+    locations, encodings, dropped = _encode(frame, detection_scale, gate.face_filter if gate is not None else None,
+                                            detector)
+    if dropped:
+        gate.record_dropped(dropped)
+    return locations, encodings
+
+
+def run_pipeline(video_path, on_faces, sample_every=1, start_time=None, end_time=None, workers=None,
+                 on_progress=None, gate=None, detection_scale=DETECTION_SCALE, detector=None, executor=None):
+    # A decoder thread reads every sample_every-th frame (from start_time to end_time seconds), checks
+    # it with gate (a frame_gate.FrameGate) and hands it to a pool of worker processes, which detect and
+    # encode faces; dlib holds the GIL, so threads would not run in parallel. Up to workers *
+    # FRAMES_PER_WORKER frames wait in a bounded queue, so decoding never waits for a slow frame unless
+    # the queue is full. Results are taken in frame order: on_faces(frame_number, timestamp, locations,
+    # encodings) is called from the calling thread and a truthy return stops the run, so no earlier frame
+    # is ever left unprocessed. on_progress(Progress) is called every PROGRESS_INTERVAL seconds and once
+    # at the end. With workers=1 faces are encoded in the calling thread while the decoder reads ahead.
+    # Pass a long-lived executor (a ProcessPoolExecutor with warm_worker as its initializer) to avoid
+    # starting a pool per video. Returns (frames_processed, frames_decoded, seconds).
+    check_detection_scale(detection_scale)
+    workers = workers or os.cpu_count() or 1
+    sample_every = max(1, sample_every)
+    detector = detector_config(detector)
+    face_filter = gate.face_filter if gate is not None else None
+    counters = {"processed": 0, "decoded": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    frame_number = 0
+    if start_time:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start_time * 1000.0)
+        frame_number = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    total_frames = _expected_frames(cap, fps, sample_every, frame_number, end_time)
+    # The last frame to look at, so neither read() nor grab() goes past end_time; without a frame
+    # rate the decoded frame's position is checked instead.
+    end_frame = int(end_time * fps) + 1 if end_time is not None and fps > 0 else None
+
+    pool = executor
+    if pool is None and workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=warm_worker)
+    encode = metrics.in_worker(pool, encode_shared_frame) if pool is not None else None
+    slots = FrameSlots() if pool is not None else None
+    frames = queue.Queue(maxsize=workers * FRAMES_PER_WORKER)
+    stop = threading.Event()
+    errors = []
+
+    def next_frame():
+        nonlocal frame_number
+        while end_frame is None or frame_number < end_frame:
+            frame_number += 1
+            # grab() skips decoding the frames that will not be analysed.
+            if (frame_number - 1) % sample_every:
+                if not cap.grab():
+                    return None
+                continue
+            with metrics.stage("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                return None
+            timestamp = _frame_timestamp(cap, frame_number, fps)
+            if end_time is not None and timestamp > end_time:
+                return None
+            counters["decoded"] += 1
+            if gate is not None and gate.check(frame):
+                counters["skipped"] += 1
+                continue
+            return frame_number, timestamp, frame
+        return None
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode():
+        try:
+            while not stop.is_set():
+                item = next_frame()
+                if item is None:
+                    break
+                number, timestamp, frame = item
+                if pool is not None:
+                    shared = slots.put(frame)
+                    frame = (shared, pool.submit(encode, shared, detection_scale, face_filter, detector))
+                if not put((number, timestamp, frame)):
+                    if pool is not None:
+                        frame[1].cancel()
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(_DONE)
+
+    def report():
+        if on_progress is not None:
+            on_progress(Progress(counters["processed"], counters["decoded"], total_frames,
+                                 time.perf_counter() - start, None, None, counters["skipped"]))
+
+    decoder = threading.Thread(target=decode, name="video-decoder", daemon=True)
+    decoder.start()
+    try:
+        last_report = time.perf_counter()
+        while True:
+            # Waited on in slices so progress is reported from this (the caller's) thread, e.g. a UI thread.
+            try:
+                item = frames.get(timeout=PROGRESS_INTERVAL)
+            except queue.Empty:
+                report()
+                last_report = time.perf_counter()
+                continue
+            if item is _DONE:
+                break
+            number, timestamp, work = item
+            if pool is None:
+                locations, encodings, dropped = _encode(work, detection_scale, face_filter, detector)
+            else:
+                shared, future = work
+                while not wait([future], PROGRESS_INTERVAL).done:
+                    report()
+                    last_report = time.perf_counter()
+                slots.release(shared)
+                locations, encodings, dropped = metrics.unwrap(future.result())
+            if dropped:
+                gate.record_dropped(dropped)
+            counters["processed"] += 1
+            if on_faces(number, timestamp, locations, encodings):
+                break
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                report()
+                last_report = time.perf_counter()
+    finally:
+        stop.set()
+        decoder.join()
+        # Frames still queued or being encoded keep their slots until they finish.
+        pending = []
+        while not frames.empty():
+            item = frames.get_nowait()
+            if item is not _DONE and pool is not None:
+                item[2][1].cancel()
+                pending.append(item[2][1])
+        wait(pending)
+        if pool is not None and executor is None:
+            pool.shutdown()
+        if slots is not None:
+            slots.close()
+        cap.release()
+    if errors:
+        raise errors[0]
+    report()
+    return counters["processed"], counters["decoded"], time.perf_counter() - start
+
+
+def scan_video(video_path, matcher, sample_every=1, start_time=None, end_time=None, workers=None,
+               detection_scale=DETECTION_SCALE, tolerance=TOLERANCE, on_progress=None, gate=None, detector=None,
+               executor=None):
+    # Stops at the first frame in which any face matches; frames are matched in order, so that is the
+    # earliest one. Frames the gate skips count as decoded, not scanned.
+    found = []
+    faces_seen = [0]
+
+    def on_faces(number, timestamp, locations, encodings):
+        faces_seen[0] += len(encodings)
+        known = [match for match in matcher.match(encodings, tolerance) if match.known] if len(encodings) else []
+        if known:
+            found.append((number, timestamp, min(known, key=lambda match: match.distance)))
+        return bool(known)
+
+    def result(scanned, decoded, seconds):
+        if not found:
+            return VideoMatch(False, None, None, None, None, scanned, decoded, seconds)
+        number, timestamp, match = found[0]
+        return VideoMatch(True, number, timestamp, match.name, match.distance, scanned, decoded, seconds)
+
+    def progress(update):
+        partial = result(update.frames_processed, update.frames_decoded, update.seconds)
+        on_progress(update._replace(faces_seen=faces_seen[0], match=partial if partial else None))
+
+    return result(*run_pipeline(video_path, on_faces, sample_every, start_time, end_time, workers,
+                                progress if on_progress is not None else None, gate, detection_scale, detector,
+                                executor))